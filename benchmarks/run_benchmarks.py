@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+"""
+run_benchmarks.py
+=================
+
+Benchmarks of extractions, station searches and bounding box checks on a
+synthetic MIDAS archive (see `midas_extract.synthetic`).
+
+Each benchmark is timed over `--repeat` runs (the best is reported) and then run
+once more with `tracemalloc` to record the peak memory allocated by Python (the
+peak resident memory of the whole run is also reported, where the `resource`
+module is available). Throughput is in MB of
+partition files per second for extractions, and in queries or points per second
+otherwise.
+
+Usage:
+======
+
+    python benchmarks/run_benchmarks.py [--stations 200] [--years 3] [--obs-per-day 2]
+        [--archive-dir <dir>] [--repeat 3] [--only <name>[,<name>...]] [--json <file>]
+
+If `--archive-dir` is given then the archive is written there (or reused if it
+already exists) rather than to a temporary directory.
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import tracemalloc
+
+import click
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from midas_extract import bbox_utils
+from midas_extract import synthetic
+from midas_extract.stations import StationIDGetter
+from midas_extract.subsetter import MIDASSubsetter
+
+
+class Benchmark:
+    """
+    A named benchmark: `func` is called with the archive description and returns
+    the amount of work done, in `units`.
+    """
+
+    def __init__(self, name, func, units):
+        self.name = name
+        self.func = func
+        self.units = units
+
+
+def _partition_bytes(archive, tableID, years=None):
+    return sum(os.path.getsize(path) for path in archive["files"]
+               if f"/{tableID}/" in path and (years is None or path[-17:-13] in years))
+
+
+def _extract(archive, **kwargs):
+    output = os.path.join(archive["tmp_dir"], "bench_output.txt")
+    MIDASSubsetter(outputPath=output, verbose=False, tmp_dir=archive["tmp_dir"], **kwargs)
+    os.unlink(output)
+
+
+def bench_full_rows(archive):
+    "All rows of the TD table in its first year."
+    year = str(archive["start_year"])
+    _extract(archive, table="TD", startTime=year + "01010000", endTime=year + "12312359")
+    return _partition_bytes(archive, "TD", [year]) / 1e6
+
+
+def bench_src_ids(archive):
+    "Ten stations from the whole of the TD table."
+    src_ids = [str(station[0]) for station in archive["stations"][::10][:10]]
+    _extract(archive, table="TD", src_ids=src_ids)
+    return _partition_bytes(archive, "TD") / 1e6
+
+
+def bench_columns(archive):
+    "Three columns and a condition from the whole of the TD table."
+    _extract(archive, table="TD", columns="src_id,ob_end_time,max_air_temp",
+             conditions="max_air_temp:greater_than=20")
+    return _partition_bytes(archive, "TD") / 1e6
+
+
+def bench_rain(archive):
+    "All rows of the RD table."
+    _extract(archive, table="RD")
+    return _partition_bytes(archive, "RD") / 1e6
+
+
+_QUERIES = 20
+
+
+def bench_stations_bbox(archive):
+    for i in range(_QUERIES):
+        StationIDGetter([], [55 + i * 0.1, -4, 51, 0], None, None, quiet=True)
+    return _QUERIES
+
+
+def bench_stations_county(archive):
+    for i in range(_QUERIES):
+        StationIDGetter(synthetic.COUNTIES[i % 4:i % 4 + 4], None, None, None, quiet=True)
+    return _QUERIES
+
+
+def bench_stations_srcc(archive):
+    for i in range(_QUERIES):
+        StationIDGetter([], [60, -6, 50, 1], archive["start_year"] * 10000 + 101,
+                        (archive["start_year"] + 1) * 10000 + 1231, data_type=["rain", "dcnn"],
+                        quiet=True)
+    return _QUERIES
+
+
+_POINTS = 1000000
+
+
+def bench_bbox_array(archive):
+    rng = np.random.default_rng(0)
+    lats = rng.uniform(-90, 90, _POINTS)
+    lons = rng.uniform(-180, 180, _POINTS)
+
+    for bbox in [(60, -10, 50, 2), (10, -170, -10, -100), (-30, 45, -80, 160)]:
+        bbox_utils.is_in_bbox_array(lats, lons, *bbox)
+
+    return 3 * _POINTS
+
+
+def bench_bbox_points(archive):
+    rng = np.random.default_rng(0)
+    points = list(zip(rng.uniform(-90, 90, _POINTS // 10), rng.uniform(-180, 180, _POINTS // 10)))
+
+    for (lat, lon) in points:
+        bbox_utils.is_in_bbox(lat, lon, 60, -10, 50, 2)
+
+    return len(points)
+
+
+BENCHMARKS = [
+    Benchmark("extract_full_rows", bench_full_rows, "MB/s"),
+    Benchmark("extract_src_ids", bench_src_ids, "MB/s"),
+    Benchmark("extract_columns", bench_columns, "MB/s"),
+    Benchmark("extract_rain", bench_rain, "MB/s"),
+    Benchmark("stations_bbox", bench_stations_bbox, "queries/s"),
+    Benchmark("stations_county", bench_stations_county, "queries/s"),
+    Benchmark("stations_srcc", bench_stations_srcc, "queries/s"),
+    Benchmark("bbox_array", bench_bbox_array, "points/s"),
+    Benchmark("bbox_points", bench_bbox_points, "points/s"),
+]
+
+
+def run_benchmark(benchmark, archive, repeat=3):
+    """
+    Runs `benchmark` `repeat` times, then once under `tracemalloc`. Returns a
+    dictionary of the results.
+    """
+    times = []
+
+    for i in range(repeat):
+        start = time.perf_counter()
+        work = benchmark.func(archive)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        benchmark.func(archive)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    best = min(times)
+    return {"name": benchmark.name, "seconds": best, "throughput": work / best,
+            "units": benchmark.units, "peak_mb": peak / 1e6}
+
+
+def _quiet(func, *args, **kwargs):
+    "Calls `func` with standard output discarded."
+    stdout = sys.stdout
+
+    with open(os.devnull, "w") as devnull:
+        sys.stdout = devnull
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sys.stdout = stdout
+
+
+@click.command()
+@click.option("--stations", default=200, help="Number of stations")
+@click.option("--years", default=3, help="Number of years")
+@click.option("--obs-per-day", default=2, help="Observations per station per day")
+@click.option("--start-year", default=2017, help="First year of data")
+@click.option("--archive-dir", default=None, help="Directory to write (or reuse) the archive in")
+@click.option("--repeat", default=3, help="Number of timed runs of each benchmark")
+@click.option("--only", default=None, help="Comma-separated names of the benchmarks to run")
+@click.option("--json", "json_path", default=None, help="File to write the results to as JSON")
+def main(stations, years, obs_per_day, start_year, archive_dir, repeat, only, json_path):
+    """
+    Generates a synthetic archive and runs the benchmarks on it.
+    """
+    root = archive_dir or tempfile.mkdtemp(prefix="midas_bench_")
+    os.makedirs(root, exist_ok=True)
+
+    if os.path.isdir(os.path.join(root, "data")):
+        print(f"Reusing archive in: {root}")
+        archive = {"data_dir": os.path.join(root, "data"),
+                   "metadata_dir": os.path.join(root, "metadata")}
+        archive["files"] = sorted(os.path.join(dr, name)
+                                  for (dr, _, names) in os.walk(archive["data_dir"])
+                                  for name in names if name.endswith(".txt"))
+        archive["stations"] = synthetic.read_stations(archive["metadata_dir"])
+    else:
+        print(f"Writing archive ({stations} stations x {years} years x {obs_per_day} obs/day) "
+              f"to: {root}")
+        archive = synthetic.generate_archive(root, stations=stations, years=years,
+                                             obs_per_day=obs_per_day, start_year=start_year)
+        print(f"Wrote {archive['rows']} rows ({archive['bytes'] / 1e6:.1f} MB)")
+
+    archive["start_year"] = start_year
+    archive["tmp_dir"] = tempfile.mkdtemp(prefix="midas_bench_tmp_")
+
+    os.environ["MIDAS_DATA_DIR"] = archive["data_dir"]
+    os.environ["MIDAS_METADATA_DIR"] = archive["metadata_dir"]
+    os.environ["MIDAS_SERVER_SOCKET"] = os.path.join(archive["tmp_dir"], "no_server.sock")
+    os.environ.pop("MIDAS_CACHE_DIR", None)
+
+    names = only.split(",") if only else [benchmark.name for benchmark in BENCHMARKS]
+    results = []
+
+    print(f"\n{'benchmark':<20} {'seconds':>9} {'throughput':>14} {'':<10} {'peak MB':>8}")
+
+    try:
+        for benchmark in BENCHMARKS:
+            if benchmark.name not in names:
+                continue
+
+            result = _quiet(run_benchmark, benchmark, archive, repeat=repeat)
+            results.append(result)
+
+            print(f"{result['name']:<20} {result['seconds']:>9.3f} {result['throughput']:>14.1f} "
+                  f"{result['units']:<10} {result['peak_mb']:>8.1f}")
+
+    finally:
+        shutil.rmtree(archive["tmp_dir"])
+
+        if not archive_dir:
+            shutil.rmtree(root)
+
+    # Peak resident memory of the whole run (Linux reports it in kB), where available
+    max_rss_mb = None
+
+    if resource is not None:
+        max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+        print(f"\nPeak resident memory: {max_rss_mb:.1f} MB")
+
+    if json_path:
+        with open(json_path, "w") as writer:
+            json.dump({"archive": {"stations": stations, "years": years,
+                                   "obs_per_day": obs_per_day},
+                       "results": results, "max_rss_mb": max_rss_mb}, writer, indent=2)
+
+    return results
+
+
+if __name__ == "__main__":
+
+    sys.exit(main())  # pragma: no cover
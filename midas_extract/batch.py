@@ -0,0 +1,240 @@
+"""
+batch.py
+========
+
+Runs many extractions together with one scan of each partition file.
+
+Each job is a dictionary of the arguments of ``midas_extract extract`` (see
+`JOB_KEYS`). Every job is planned as usual (see `midas_extract.planner`); the
+partition files that any of them need are then read once each, in order, and
+each line is checked against the time range, src_ids and conditions of every job
+that reads that file and written to the output of each job it matches. Total I/O
+is proportional to the number of distinct files touched rather than the number
+of jobs.
+
+Where the jobs on a file have sidecar indexes, only the union of the parts of the
+file that they need is read. Columnar copies are not used by the shared scan.
+
+"""
+
+import os
+import time
+import tempfile
+
+
+from midas_extract import catalogue
+from midas_extract import compression
+from midas_extract import conditions as conditions_mod
+from midas_extract import subsetter
+
+
+JOB_KEYS = ("output_filepath", "table", "start", "end", "columns", "conditions", "src_ids",
+            "delimiter", "region", "src_id_file", "compress", "compress_level",
+            "compress_background", "format")
+
+
+class BatchJob:
+    """
+    One extraction in a batch: its `subsetter.MIDASSubsetter` (planned but not
+    run), the temporary file its rows are written to and its compiled filters.
+    """
+
+    def __init__(self, extraction, tmp_dir):
+        self.extraction = extraction
+        self.startTimeLong = int(subsetter.pad_time(extraction.startTime, "start"))
+        self.endTimeLong = int(subsetter.pad_time(extraction.endTime, "end"))
+        self.src_ids = frozenset(str(src_id).strip() for src_id in extraction.src_ids) \
+            if extraction.src_ids else None
+
+        self.subset = extraction.columnIndexes is not None or bool(extraction.conditionSet)
+        self.pending = []
+        self.count = 0
+
+        now = time.strftime("%Y%m%d.%H%M%S", time.localtime(time.time()))
+        fd, self.tempPath = tempfile.mkstemp(prefix="temp_batch_%s_" % now, dir=tmp_dir)
+        self.output = os.fdopen(fd, "w")
+
+    @property
+    def fileList(self):
+        return self.extraction.plan.fileList
+
+    def add(self, line):
+        "Writes `line` (a matching row), or keeps it for the next chunk of conditions."
+        if not self.subset:
+            self.output.write(line + "\n")
+            self.count += 1
+            return
+
+        self.pending.append(line)
+
+        if len(self.pending) >= conditions_mod.CHUNK_ROWS:
+            self.flush()
+
+    def flush(self):
+        "Evaluates the conditions on the kept rows and writes those that pass."
+        if self.pending:
+            self.count += subsetter._writeSubsetChunk(self.pending, self.output,
+                                                      self.extraction.columnIndexes,
+                                                      self.extraction.conditionSet)
+            self.pending = []
+
+
+def parse_job(job):
+    """
+    Returns a dictionary of the arguments of `subsetter.MIDASSubsetter` for `job`, a
+    dictionary with keys in `JOB_KEYS`.
+    """
+    unknown = set(job) - set(JOB_KEYS)
+    if unknown:
+        raise Exception(f"Batch job keys not known: {', '.join(sorted(unknown))}")
+
+    if not job.get("table"):
+        raise Exception(f"Batch job must include a table: {job}")
+
+    src_ids = job.get("src_ids")
+
+    if isinstance(src_ids, str):
+        src_ids = src_ids.split(",")
+
+    if job.get("src_id_file"):
+        with open(job["src_id_file"]) as reader:
+            src_ids = reader.read().strip().split()
+
+    return {"table": job["table"], "outputPath": job.get("output_filepath") or "display",
+            "startTime": job.get("start"), "endTime": job.get("end"),
+            "columns": job.get("columns") or "all", "conditions": job.get("conditions"),
+            "src_ids": src_ids, "region": job.get("region"),
+            "delimiter": job.get("delimiter") or "default", "compress": job.get("compress"),
+            "compress_level": job.get("compress_level"),
+            "compress_background": bool(job.get("compress_background")),
+            "output_format": job.get("format") or "text"}
+
+
+def _file_runs(filename, jobs, use_index=True):
+    """
+    Returns a sorted list of (byte_offset, end_offset) tuples covering the parts of
+    `filename` that any of `jobs` need. An `end_offset` of None means "to the end of
+    the file".
+    """
+    runs = []
+
+    for job in jobs:
+        for (offset, _, end) in subsetter.partitionRuns(
+                filename, job.startTimeLong, job.endTimeLong, job.extraction.src_ids,
+                use_index=use_index, verbose=False):
+            runs.append((offset, end))
+
+    merged = []
+
+    for (offset, end) in sorted(runs, key=lambda run: run[0]):
+        if merged and (merged[-1][1] is None or offset <= merged[-1][1]):
+            last = merged[-1][1]
+            merged[-1] = (merged[-1][0], None if None in (last, end) else max(last, end))
+        else:
+            merged.append((offset, end))
+
+    return merged
+
+
+def scan_file(filename, jobs, datePattern, srcidIndex=None, use_index=True):
+    """
+    Reads the parts of partition file `filename` needed by `jobs` (a list of
+    `BatchJob`s) once, and passes each line to every job whose time range and
+    src_ids it matches. Returns the number of lines read.
+    """
+    active = list(jobs)
+    endTimeLong = max(job.endTimeLong for job in jobs)
+    nlines = 0
+
+    with compression.open_partition(filename, "rb") as fh:
+
+        for (offset, end) in _file_runs(filename, jobs, use_index=use_index):
+            # Compressed files are only read from the start
+            if offset:
+                fh.seek(offset)
+            pos = offset
+
+            for line in fh:
+                if end is not None and pos >= end:
+                    break
+
+                pos += len(line)
+                nlines += 1
+
+                line = line.decode().strip()
+                dmatch = subsetter.dateMatch(line, datePattern)
+
+                if not dmatch:
+                    continue
+
+                # Files are in time order: jobs that have passed their end time are done
+                if dmatch > endTimeLong:
+                    return nlines
+
+                if any(dmatch > job.endTimeLong for job in active):
+                    active = [job for job in active if dmatch <= job.endTimeLong]
+
+                src_id = subsetter.srcIdOf(line, srcidIndex) if srcidIndex is not None else None
+
+                for job in active:
+                    if job.startTimeLong <= dmatch and \
+                            (job.src_ids is None or src_id in job.src_ids):
+                        job.add(line)
+
+    return nlines
+
+
+def run_batch(jobs, tmp_dir=None, use_index=True, verbose=True):
+    """
+    Runs the extractions described by `jobs` (a list of dictionaries with keys in
+    `JOB_KEYS`) reading each partition file once. Each job's output is written as
+    by `subsetter.MIDASSubsetter`. Returns a list of the number of rows extracted
+    by each job.
+    """
+    if not tmp_dir:
+        tmp_dir = tempfile.gettempdir()
+
+    batchJobs = []
+
+    try:
+        for job in jobs:
+            extraction = subsetter.MIDASSubsetter(verbose=False, use_index=use_index,
+                                                  use_store=False, tmp_dir=tmp_dir, run=False,
+                                                  **parse_job(job))
+            batchJobs.append(BatchJob(extraction, tmp_dir))
+
+        for tableID in sorted({job.extraction.tableID for job in batchJobs}):
+            tableJobs = [job for job in batchJobs if job.extraction.tableID == tableID]
+            datePattern = subsetter.getDatePattern(tableID)
+
+            srcidIndex = None
+            if any(job.src_ids for job in tableJobs):
+                srcidIndex = subsetter.getColumnIndex(tableID, "src_id")
+
+            # Partition files in catalogue order, as read by each job on its own
+            for filename in catalogue.get_partition_files(tableID):
+                fileJobs = [job for job in tableJobs if filename in job.fileList]
+
+                if not fileJobs:
+                    continue
+
+                nlines = scan_file(filename, fileJobs, datePattern, srcidIndex,
+                                   use_index=use_index)
+
+                if verbose:
+                    print(f'Read {nlines} lines of "{filename}" for {len(fileJobs)} job(s).')
+
+        for job in batchJobs:
+            job.flush()
+            job.output.close()
+            job.extraction._writeOutputFile(job.tempPath, job.extraction.outputPath,
+                                            job.extraction.delimiter)
+
+    finally:
+        for job in batchJobs:
+            if not job.output.closed:
+                job.output.close()
+            if os.path.isfile(job.tempPath):
+                os.unlink(job.tempPath)
+
+    return [job.count for job in batchJobs]
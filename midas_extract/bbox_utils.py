@@ -12,6 +12,8 @@ import os
 import sys
 import logging
 
+import numpy as np
+
 
 logging.basicConfig()
 log = logging.getLogger(__name__)
@@ -26,17 +28,10 @@ def is_in_range(i, start, end):
     return False
 
 
-def is_in_bbox(lat, lon, n, w, s, e):
+def validate_bbox(n, w, s, e):
     """
-    Returns a boolean. True if (lat, lon) point is in bounding box (n, w, s, e).
-
-    It handles the various longitude bounding box cases:
-
-     (1) x1 is +ve, x2 is -ve : raises an Exception
-     (2) x1 is -ve, x2 is -ve
-     (3) x1 is -ve, x2 is +ve
-     (4) x1 is +ve, x2 is +ve
-
+    Raises a ValueError if the bounding box (n, w, s, e) is not valid: south must
+    not be greater than north, nor west greater than east, and each must be in range.
     """
     # Check order of s-to-n and w-to-e are correct
     if s > n:
@@ -44,7 +39,7 @@ def is_in_bbox(lat, lon, n, w, s, e):
             "South cannot be greater than north in bounding box specification: south = %s; north = %s" % (s, n))
 
     if w > e:
-        # This also handles case (1) above
+        # This also handles case (1) in `is_in_bbox`
         raise ValueError(
             "West cannot be greater than east in bounding box specification: west = %s; east = %s" % (w, e))
 
@@ -59,6 +54,21 @@ def is_in_bbox(lat, lon, n, w, s, e):
             raise ValueError(
                 "%s cannot be out of range %s - %s but is: %s" % (name, start, end, v))
 
+
+def is_in_bbox(lat, lon, n, w, s, e):
+    """
+    Returns a boolean. True if (lat, lon) point is in bounding box (n, w, s, e).
+
+    It handles the various longitude bounding box cases:
+
+     (1) x1 is +ve, x2 is -ve : raises an Exception
+     (2) x1 is -ve, x2 is -ve
+     (3) x1 is -ve, x2 is +ve
+     (4) x1 is +ve, x2 is +ve
+
+    """
+    validate_bbox(n, w, s, e)
+
     # Check lat is in south-north range
     if not is_in_range(lat, s, n):
         return False
@@ -95,6 +105,37 @@ def is_in_bbox(lat, lon, n, w, s, e):
             return False
 
 
+def is_in_bbox_array(lats, lons, n, w, s, e):
+    """
+    Returns a boolean NumPy array. True for each (lat, lon) point in the arrays
+    `lats` and `lons` that is in bounding box (n, w, s, e). Handles the longitude
+    cases exactly as `is_in_bbox` does, validating the box once.
+    """
+    validate_bbox(n, w, s, e)
+
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    in_lat = (lats >= s) & (lats <= n)
+
+    # Case (2)
+    if w < 0 and e < 0:
+        lons = np.where(lons > 0, lons - 360, lons)
+        return in_lat & (lons >= w) & (lons <= e)
+
+    # Case (4)
+    elif w >= 0 and e >= 0:
+        lons = np.where(lons < 0, lons + 360, lons)
+        return in_lat & (lons >= w) & (lons <= e)
+
+    # Case (3): check (w --> 0) and (0 --> e) as in `is_in_bbox`
+    lon_check1 = np.where(lons >= 0, lons - 360, lons)
+    lon_check2 = np.where(lons < 0, lons + 360, lons)
+
+    return in_lat & (((lon_check1 >= w) & (lon_check1 <= 0)) |
+                     ((lon_check2 >= 0) & (lon_check2 <= e)))
+
+
 if __name__ == "__main__":
 
     lons = (-270, -170, -5, 5, 150, 350)
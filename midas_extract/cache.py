@@ -0,0 +1,236 @@
+"""
+cache.py
+========
+
+An on-disk cache of extraction results.
+
+If the ``MIDAS_CACHE_DIR`` environment variable is set then the rows extracted
+for each request are kept in that directory, keyed by the normalised request
+(table, padded start and end times, sorted src_ids, columns, conditions and
+region) and the sizes and modification times of the partition files it could
+read. Repeating a request (in any process) reuses the saved rows rather than
+scanning the partition files again; changing a partition file changes the key.
+
+The cache is limited to ``MIDAS_CACHE_BYTES`` (default: 1 GB). The least recently
+used results are removed when it grows past that.
+
+Identical requests made at the same time are coalesced: the first takes the lock
+for its key and extracts the rows while the others wait for it and then read its
+result. Different requests do not wait for each other.
+
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+from midas_extract import settings
+
+
+CACHE_VERSION = 2
+DEFAULT_CACHE_BYTES = 1024 ** 3
+
+_SUFFIX = ".rows"
+_LOCK_SUFFIX = ".lock"
+
+
+def get_cache_bytes():
+    "Returns the maximum size of the cache in bytes."
+    return int(settings.get_cache_bytes() or DEFAULT_CACHE_BYTES)
+
+
+def make_key(tableID, startTimeLong, endTimeLong, src_ids=None, columns=None, conditions=None,
+             region=None, partitions=()):
+    """
+    Returns the cache key (a hex digest) of a request. `columns` is the list of
+    (0-based) column indexes or None for all, `conditions` a
+    `conditions.ConditionSet` and `partitions` the catalogue entries of the
+    partition files that the request could read.
+    """
+    files = []
+    conds = None
+
+    for partition in partitions:
+        st = os.stat(partition["path"])
+        files.append([partition["path"], st.st_size, st.st_mtime_ns])
+
+    # The exact values, as the descriptions of conditions round numbers
+    if conditions:
+        conds = sorted([conditions.columnNames[index], kind,
+                        value.pattern if kind == "pattern" else repr(value)]
+                       for (index, kind, value) in conditions.conditions)
+
+    key = {"version": CACHE_VERSION, "table": tableID, "start": startTimeLong,
+           "end": endTimeLong,
+           "src_ids": sorted({str(src_id).strip() for src_id in src_ids}) if src_ids else None,
+           "columns": columns, "conditions": conds,
+           "region": region, "files": files}
+
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+class _Lock:
+    "An exclusive lock on the lock file of `key` (a no-op without `fcntl`)."
+
+    def __init__(self, cache_dir, key):
+        lock_dir = os.path.join(cache_dir, "locks")
+        os.makedirs(lock_dir, exist_ok=True)
+        self.path = os.path.join(lock_dir, key + _LOCK_SUFFIX)
+
+    def __enter__(self):
+        self.fh = open(self.path, "a")
+
+        if fcntl:
+            fcntl.flock(self.fh, fcntl.LOCK_EX)
+
+        return self
+
+    def __exit__(self, *args):
+        self.fh.close()
+
+
+def _link_or_copy(src, dst):
+    "Hard links `src` to `dst`, or copies it if they are on different file systems."
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _checkout(entry, tmp_dir):
+    """
+    Returns the path of a new file in `tmp_dir` holding the cached rows in `entry`,
+    or None if there is no such entry. The entry is marked as recently used.
+    """
+    try:
+        os.utime(entry)
+    except FileNotFoundError:
+        return None
+
+    fd, path = tempfile.mkstemp(prefix="temp_cached_", dir=tmp_dir)
+    os.close(fd)
+    os.unlink(path)
+
+    try:
+        _link_or_copy(entry, path)
+    except FileNotFoundError:
+        # Evicted since it was found
+        return None
+
+    return path
+
+
+def _store(path, entry):
+    "Saves the rows in file `path` as `entry`."
+    tmp_path = f"{entry}.{os.getpid()}.tmp"
+
+    try:
+        _link_or_copy(path, tmp_path)
+        os.replace(tmp_path, entry)
+    except OSError:
+        if os.path.isfile(tmp_path):
+            os.unlink(tmp_path)
+
+
+def evict(cache_dir, max_bytes):
+    """
+    Removes the least recently used entries from `cache_dir` until they total no
+    more than `max_bytes`. Returns the number of entries removed.
+    """
+    entries = []
+
+    with os.scandir(cache_dir) as scan:
+        for item in scan:
+            if item.name.endswith(_SUFFIX):
+                try:
+                    st = item.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, item.path))
+
+    total = sum(size for (_, size, _) in entries)
+    removed = 0
+
+    for (_, size, path) in sorted(entries):
+        if total <= max_bytes:
+            break
+
+        try:
+            os.unlink(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+
+        total -= size
+
+    _remove_locks(cache_dir)
+    return removed
+
+
+def _remove_locks(cache_dir):
+    """
+    Removes the lock files in `cache_dir` that have no entry and are not held. (A
+    request that opens one just as it is removed may extract its rows again, which
+    is harmless.)
+    """
+    lock_dir = os.path.join(cache_dir, "locks")
+
+    if not fcntl or not os.path.isdir(lock_dir):
+        return
+
+    for name in os.listdir(lock_dir):
+        key = name[:-len(_LOCK_SUFFIX)]
+
+        if not name.endswith(_LOCK_SUFFIX) or \
+                os.path.exists(os.path.join(cache_dir, key + _SUFFIX)):
+            continue
+
+        path = os.path.join(lock_dir, name)
+
+        try:
+            with open(path, "a") as fh:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.unlink(path)
+        except OSError:
+            # Held by a request in progress, or already removed
+            pass
+
+
+def fetch(key, extract, tmp_dir=None):
+    """
+    Returns the path of a new file in `tmp_dir` holding the rows for cache key
+    `key`. If they are not cached then `extract` (a function returning the path of
+    such a file) is called and its result saved. The caller owns the returned file.
+
+    If no cache directory is set this simply returns ``extract()``.
+    """
+    cache_dir = settings.get_cache_dir()
+
+    if not cache_dir:
+        return extract()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = os.path.join(cache_dir, key + _SUFFIX)
+    max_bytes = get_cache_bytes()
+
+    with _Lock(cache_dir, key):
+        path = _checkout(entry, tmp_dir)
+
+        if path:
+            return path
+
+        path = extract()
+
+        if os.path.getsize(path) <= max_bytes:
+            _store(path, entry)
+
+    evict(cache_dir, max_bytes)
+    return path
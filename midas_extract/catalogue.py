@@ -0,0 +1,179 @@
+"""
+catalogue.py
+============
+
+A persistent catalogue of the partition files of each MIDAS table.
+
+The catalogue of a table lists, for each yearly partition file, its path, the
+name part of the file (the region, for the GLOBAL table), the range of months it
+covers and its size and modification time. It is built the first time a table is
+used by listing its "yearly_files" directory once, and saved so that later
+extractions (in any process) find their files with a single ``stat`` of the
+directory rather than a directory listing.
+
+A catalogue records the modification time of the directory it describes and is
+rebuilt if that has changed (that is, if partition files have been added, removed
+or renamed). Catalogues are also kept in memory for the life of the process.
+
+Each catalogue is written to ``partition_catalogue.json`` alongside the table's
+"yearly_files" directory unless the ``MIDAS_CATALOGUE_DIR`` environment variable
+is set. If it cannot be written (for example, because the archive is read-only)
+it is only kept in memory.
+
+"""
+
+import os
+import re
+import json
+
+
+from midas_extract import settings
+from midas_extract import compression
+
+
+CATALOGUE_VERSION = 2
+CATALOGUE_NAME = "partition_catalogue.json"
+
+# Partition file names: midas_<name>_<YYYYMM>-<YYYYMM>.txt[.gz|.bz2|.xz|.zst]
+PARTITION_PATTERN = re.compile(r"\w+_([a-zA-Z\-]+)_(\d{6})-(\d{6})\.txt(\.gz|\.bz2|\.xz|\.zst)?$")
+
+# In-memory catalogues: {<partition_dir>: (<dir_mtime_ns>, <partitions>)}
+_catalogues = {}
+
+
+def get_partition_dir(tableID):
+    "Returns the directory holding the partition files of table `tableID`."
+    return os.path.join(settings.get_data_dir(), tableID, "yearly_files")
+
+
+def get_catalogue_path(tableID):
+    """
+    Returns the path of the saved catalogue for table `tableID`.
+    """
+    catalogue_dir = settings.get_catalogue_dir()
+
+    if catalogue_dir:
+        return os.path.join(catalogue_dir, f"{tableID}_{CATALOGUE_NAME}")
+
+    return os.path.join(settings.get_data_dir(), tableID, CATALOGUE_NAME)
+
+
+def build_catalogue(partition_dir):
+    """
+    Lists `partition_dir` and returns a list of its partition files, sorted by name,
+    as dictionaries of:
+        {"path": <file_path>, "region": <name>, "start": <YYYYMM>, "end": <YYYYMM>,
+         "size": <bytes>, "mtime_ns": <mtime_ns>, "compression": <format or None>}
+
+    Partition files may be compressed (see `midas_extract.compression`). If a file is
+    present both with and without compression, only the uncompressed file is listed.
+    """
+    partitions = {}
+
+    with os.scandir(partition_dir) as entries:
+        for entry in entries:
+            pmatch = PARTITION_PATTERN.match(entry.name)
+
+            if not pmatch or not entry.is_file():
+                continue
+
+            st = entry.stat()
+            (region, start, end, suffix) = pmatch.groups()
+            name = entry.name[:-len(suffix)] if suffix else entry.name
+
+            if name in partitions and not partitions[name]["compression"]:
+                continue
+
+            partitions[name] = {"path": entry.path, "region": region, "start": int(start),
+                                "end": int(end), "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                                "compression": compression.get_compression(entry.name)}
+
+    return [partitions[name] for name in sorted(partitions)]
+
+
+def _read_catalogue(catalogue_path, partition_dir, dir_mtime_ns):
+    "Returns the saved list of partitions if it describes `partition_dir` as it is now."
+    try:
+        with open(catalogue_path) as reader:
+            catalogue = json.load(reader)
+    except (OSError, ValueError):
+        return None
+
+    if (catalogue.get("version"), catalogue.get("directory"), catalogue.get("dir_mtime_ns")) != \
+            (CATALOGUE_VERSION, partition_dir, dir_mtime_ns):
+        return None
+
+    return catalogue["partitions"]
+
+
+def _write_catalogue(catalogue_path, partition_dir, dir_mtime_ns, partitions):
+    "Saves a catalogue. Returns False if it cannot be written."
+    catalogue = {"version": CATALOGUE_VERSION, "directory": partition_dir,
+                 "dir_mtime_ns": dir_mtime_ns, "partitions": partitions}
+
+    # Write to a temporary name then rename so readers never see a partial catalogue
+    tmp_path = f"{catalogue_path}.{os.getpid()}.tmp"
+
+    try:
+        os.makedirs(os.path.dirname(catalogue_path), exist_ok=True)
+
+        with open(tmp_path, "w") as writer:
+            json.dump(catalogue, writer)
+
+        os.replace(tmp_path, catalogue_path)
+
+    except OSError:
+        if os.path.isfile(tmp_path):
+            os.unlink(tmp_path)
+        return False
+
+    return True
+
+
+def load_catalogue(tableID):
+    """
+    Returns the list of partitions of table `tableID` (see `build_catalogue`), from
+    memory or the saved catalogue if they are up to date, otherwise by listing the
+    partition directory. Returns an empty list if the table has no partition
+    directory.
+    """
+    partition_dir = get_partition_dir(tableID)
+
+    try:
+        dir_mtime_ns = os.stat(partition_dir).st_mtime_ns
+    except FileNotFoundError:
+        return []
+
+    cached = _catalogues.get(partition_dir)
+    if cached and cached[0] == dir_mtime_ns:
+        return cached[1]
+
+    catalogue_path = get_catalogue_path(tableID)
+    partitions = _read_catalogue(catalogue_path, partition_dir, dir_mtime_ns)
+
+    if partitions is None:
+        partitions = build_catalogue(partition_dir)
+        _write_catalogue(catalogue_path, partition_dir, dir_mtime_ns, partitions)
+
+    _catalogues[partition_dir] = (dir_mtime_ns, partitions)
+    return partitions
+
+
+def get_partitions(tableID, region=None):
+    """
+    Returns the list of partitions of table `tableID`. If `region` is set (as one of
+    the GLOBAL region numbers) then only partitions of that region are included.
+    """
+    partitions = load_catalogue(tableID)
+
+    if region:
+        from midas_extract import subsetter
+        regionName = subsetter.globalWXCodes[region]
+        partitions = [partition for partition in partitions if partition["region"] == regionName]
+
+    return partitions
+
+
+def get_partition_files(tableID, region=None):
+    "Returns a list of the paths of the partition files of table `tableID`."
+    return [partition["path"] for partition in get_partitions(tableID, region)]
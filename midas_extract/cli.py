@@ -9,11 +9,17 @@ __license__ = "BSD - see LICENSE file in top-level package directory"
 
 
 import sys
+import json
 import click
 import tempfile
 
 from midas_extract.settings import START_DEFAULT, END_DEFAULT
-from midas_extract.stations import StationIDGetter
+from midas_extract import indexing
+from midas_extract import columnar
+from midas_extract import batch as batch_mod
+from midas_extract import client
+from midas_extract import server
+from midas_extract.stations import StationIDGetter, write_station_list
 from midas_extract.subsetter import MIDASSubsetter
 
 
@@ -34,9 +40,33 @@ def main():
 @click.option('--region', '-r', default=None, help='Region')
 @click.option('--src-id-file', '-f', default=None, help='File containing a list of SRC IDs')
 @click.option('--tmp-dir', '-p', default=None, help='Path to temporary directory')
+@click.option('--workers', '-w', default=None, type=int,
+              help='Number of worker processes (default: chosen by the planner)')
+@click.option('--engine', default='auto', type=click.Choice(['auto', 'text', 'mmap']),
+              help='Scan engine used to read the partition files')
+@click.option('--explain', is_flag=True, help='Print the extraction plan without extracting')
+@click.option('--batch', default=None,
+              help='JSON lines file of extraction jobs to run with one scan of each file')
+@click.option('--compress', default=None, type=click.Choice(['gzip', 'zstd']),
+              help='Compress the output file')
+@click.option('--compress-level', default=None, type=int,
+              help='Compression level (default: 6 for gzip, 3 for zstd)')
+@click.option('--compress-background', is_flag=True,
+              help='Compress the output in a background thread')
+@click.option('--format', 'output_format', default='text',
+              type=click.Choice(['text', 'parquet', 'feather', 'netcdf']),
+              help='Output file format')
+@click.option('--stats', default=None, type=click.Choice(['json']),
+              help='Write performance metrics of the run to standard error')
+@click.option('--max-rows', default=None, type=click.IntRange(min=1),
+              help='Maximum number of rows to extract (prints a continuation token if more may follow)')
+@click.option('--cursor', default=None,
+              help='Continuation token from an earlier extraction to resume from')
 def extract(output_filepath=None, table=None, start=None, end=None, columns='all',
            conditions=None, src_ids=None, delimiter='default', region=None, src_id_file=None,
-           tmp_dir=None):
+           tmp_dir=None, workers=None, engine='auto', explain=False, batch=None, compress=None,
+           compress_level=None, compress_background=False, output_format='text', stats=None,
+           max_rows=None, cursor=None):
     """
     Filters records in a MIDAS data table (across multiple files).
 
@@ -51,13 +81,32 @@ def extract(output_filepath=None, table=None, start=None, end=None, columns='all
     The output can be modified by delimiter. 
 
     Subsets a MIDAS data table (across multiple files).
+
+    With --batch, the options of each extraction are given in its job, so only
+    --tmp-dir may also be given.
     """
-    return extract_records(**vars())
+    if batch:
+        ctx = click.get_current_context()
+        given = [param.opts[0] for param in ctx.command.params
+                 if param.name not in ('batch', 'tmp_dir') and
+                 ctx.get_parameter_source(param.name) != click.core.ParameterSource.DEFAULT]
+
+        if given:
+            raise click.UsageError(f"--batch cannot be combined with {', '.join(given)}: give "
+                                   f"these in each job of the batch file.")
+
+        return extract_batch(batch, tmp_dir=tmp_dir)
+
+    kwargs = vars()
+    kwargs.pop('batch')
+    return extract_records(**kwargs)
 
 
 def extract_records(output_filepath=None, table=None, start=None, end=None, columns='all',
            conditions=None, src_ids=None, delimiter='default', region=None, src_id_file=None,
-           tmp_dir=None):
+           tmp_dir=None, workers=None, engine='auto', explain=False, compress=None,
+           compress_level=None, compress_background=False, output_format='text', stats=None,
+           max_rows=None, cursor=None):
     """ 
     Subsets data from the MIDAS flat files. Allows extraction by:
 
@@ -65,7 +114,8 @@ def extract_records(output_filepath=None, table=None, start=None, end=None, colu
     is essentially a description of the table contents in a text file. This is parsed each
     time this script is called.
 
-    There is hard-coded limit of 100,000 lines that can currently be extracted.
+    The number of rows extracted can be limited with --max-rows, which returns a
+    continuation token to pass as --cursor to extract the next page.
 
 Where:
 ------
@@ -74,7 +124,9 @@ Where:
     -s          - provide the start date/time
     -e          - provide the end date/time
     -c          - provide a comma-separated list of required columns
-    -n          - provide a list of comma-separated list of conditions in the form:
+    -n          - provide a list of comma-separated list of conditions in the form
+                  [<column>:]<condition>=<value> (without a column, a condition applies
+                  to each of the columns selected with -c). Conditions are:
                     * range=<low>:<high>     [<low> and <high> are values]
                     * greater_than=<value>
                     * less_than=<value>
@@ -87,6 +139,25 @@ Where:
                   Regions are: 1-Africa, 2-Asia, 3-South America, 4-North Central America,
                                5-South West Pacific, 6-Europe, 7-Antarctic.
     -p           - temporary directory location (absolute path)
+    -w          - number of worker processes used to filter partition files in parallel
+                  (by default the planner chooses)
+    --engine    - scan engine: "auto" (default; chosen by the planner), "text" or "mmap"
+                  (memory-mapped, bytes-level)
+    --explain   - print the extraction plan (files read or skipped, scan engines,
+                  predicate order, workers and estimated bytes and rows) without extracting
+    --compress  - compress the output file as it is written: "gzip" or "zstd" (the
+                  suffix ".gz" or ".zst" is added to the file name if missing)
+    --compress-level      - the compression level
+    --compress-background - compress in a background thread
+    --format    - output format: "text" (default), or typed columns in "parquet",
+                  "feather" or "netcdf" (compressed internally if --compress is given)
+    --stats     - "json": write the time spent in each stage, the bytes and lines read
+                  and matched, the files pruned and the peak memory of the run to
+                  standard error as a JSON document (the job is run in-process)
+    --max-rows  - stop after extracting this many rows; if more may follow then a
+                  continuation token is printed
+    --cursor    - continuation token printed by an earlier run of the same request:
+                  resume the scan where it stopped
 
 Examples:
 =========
@@ -95,19 +166,18 @@ Examples:
     midas_extract extract -t RS -s 200401010000 -e 200401011000 outputfile.dat
     midas_extract extract -t RS -s 200401010000 -e 200401011000 -g testlist.txt outputfile.dat
     midas_extract extract -t RS -s 200401010000 -e 200401011000 -i 214,926 -d tab
+    midas_extract extract -t TD -s 201701010000 -e 201712312359 -c src_id,max_air_temp -n max_air_temp:greater_than=25
+    midas_extract extract -t RS -s 200401010000 -e 200401011000 -i 214,926 --explain
+    midas_extract extract -t TD -s 201701010000 -e 201712312359 --compress zstd td_2017.txt
+    midas_extract extract -t TD -s 201701010000 -e 201712312359 --format parquet td_2017.parquet
+    midas_extract extract -t TD -s 201701010000 -e 201712312359 --stats json td_2017.txt
+    midas_extract extract -t TD -s 201701010000 -e 201712312359 --max-rows 1000 page1.txt
+    midas_extract extract -t TD -s 201701010000 -e 201712312359 --max-rows 1000 --cursor <token> page2.txt
 
     """
     if not output_filepath:
         output_filepath = 'display'
 
-    if conditions:
-        conditions = {}
-        condition_list = value.split(',')
-
-        for cond in condition_list:
-            a, b = cond.split('=')
-            conditions[a] = b 
-
     if src_ids:
         src_ids = src_ids.split(',')
 
@@ -120,8 +190,113 @@ Examples:
     if not table:
         raise click.ClickException('Must provide table ID with "-t" argument.')
 
+    # Run the job on the extraction server if one is running (metrics are of a local run)
+    if client.is_available() and not stats:
+        header = client.extract({'output_filepath': output_filepath, 'table': table, 'start': start,
+                               'end': end, 'columns': columns, 'conditions': conditions,
+                               'src_ids': src_ids, 'region': region, 'delimiter': delimiter,
+                               'tmp_dir': tmp_dir, 'workers': workers, 'engine': engine,
+                               'explain': explain, 'compress': compress,
+                               'compress_level': compress_level,
+                               'compress_background': compress_background,
+                               'output_format': output_format, 'limit': max_rows,
+                               'cursor': cursor})
+
+        if header.get('cursor'):
+            print(f"More rows may be available. To extract the next {max_rows}, use the "
+                  f"continuation token:\n{header['cursor']}\n")
+
+        return header
+
     return MIDASSubsetter(table, output_filepath, start, end, columns, conditions,
-                          src_ids, region, delimiter, tmp_dir=tmp_dir)
+                          src_ids, region, delimiter, tmp_dir=tmp_dir, workers=workers, engine=engine,
+                          explain=explain, compress=compress, compress_level=compress_level,
+                          compress_background=compress_background, output_format=output_format,
+                          stats=stats, limit=max_rows, cursor=cursor)
+
+
+def extract_batch(batch, tmp_dir=None):
+    """
+    Runs the extraction jobs in JSON lines file `batch` together, reading each
+    partition file once (see `midas_extract.batch`). Each line is a dictionary of
+    the arguments of `extract_records`, for example:
+
+        {"table": "TD", "start": "201701010000", "end": "201712312359",
+         "src_ids": "214,926", "output_filepath": "td_2017.txt"}
+
+    Returns a list of the number of rows extracted by each job.
+    """
+    with open(batch) as reader:
+        jobs = [json.loads(line) for line in reader if line.strip()]
+
+    try:
+        return batch_mod.run_batch(jobs, tmp_dir=tmp_dir)
+    except Exception as exc:
+        raise click.ClickException(str(exc))
+
+
+@main.command('index')
+@click.option('--table', '-t', default=None, help='MIDAS Database table identifier')
+@click.option('--region', '-r', default=None, help='Region')
+@click.option('--block-lines', '-b', default=indexing.DEFAULT_BLOCK_LINES, type=int,
+              help='Number of lines between each index entry')
+def index(table=None, region=None, block_lines=indexing.DEFAULT_BLOCK_LINES):
+    """
+    Builds sidecar index files for the partition files of a MIDAS data table.
+    """
+    return build_indexes(**vars())
+
+
+def build_indexes(table=None, region=None, block_lines=indexing.DEFAULT_BLOCK_LINES):
+    """
+    Builds (or rebuilds) the sidecar index for every partition file in a table.
+    Indexes are written alongside the partition files unless MIDAS_INDEX_DIR is set.
+    """
+    if not table:
+        raise click.ClickException('Must provide table ID with "-t" argument.')
+
+    return indexing.build_table_indexes(table, region=region, block_lines=int(block_lines))
+
+
+@main.command('convert')
+@click.option('--table', '-t', default=None, help='MIDAS Database table identifier')
+@click.option('--region', '-r', default=None, help='Region')
+@click.option('--row-group-size', '-g', default=columnar.DEFAULT_ROW_GROUP_SIZE, type=int,
+              help='Number of rows in each Parquet row group')
+def convert(table=None, region=None, row_group_size=columnar.DEFAULT_ROW_GROUP_SIZE):
+    """
+    Writes a typed columnar (Parquet) copy of the partition files of a MIDAS data table.
+    """
+    return convert_tables(**vars())
+
+
+def convert_tables(table=None, region=None, row_group_size=columnar.DEFAULT_ROW_GROUP_SIZE):
+    """
+    Writes (or rewrites) the columnar copy of every partition file in a table.
+    Copies are written to a "columnar" directory alongside the partition files unless
+    MIDAS_COLUMNAR_DIR is set. Extractions use them automatically while they are up
+    to date.
+    """
+    if not table:
+        raise click.ClickException('Must provide table ID with "-t" argument.')
+
+    try:
+        return columnar.convert_table(table, region=region, row_group_size=int(row_group_size))
+    except Exception as exc:
+        raise click.ClickException(str(exc))
+
+
+@main.command('serve')
+@click.option('--socket', '-s', 'socket_path', default=None,
+              help='Path of the Unix socket to listen on (default: MIDAS_SERVER_SOCKET)')
+@click.option('--jobs', '-j', default=server.DEFAULT_JOBS, type=int,
+              help='Maximum number of jobs run at once')
+def serve(socket_path=None, jobs=server.DEFAULT_JOBS):
+    """
+    Runs a long-lived extraction server. While it is running, the extract and
+    stations commands send their jobs to it.
+    """
+    return server.serve(socket_path, jobs=jobs)
 
 
 @main.command('stations')
@@ -133,8 +308,12 @@ Examples:
 @click.option('--start', '-s', default=None, help='Start datetime as: YYYYMMDDhhmm')
 @click.option('--end', '-e', default=None, help='End datetime as: YYYYMMDDhhmm') 
 @click.option('--data-type', '-d', default=None, help='List of data types')
+@click.option('--batch', default=None,
+              help='JSON lines file of queries to answer together (one result line per query)')
+@click.option('--stats', default=None, type=click.Choice(['json']),
+              help='Write performance metrics of the search to standard error')
 def stations(output_filepath=None, county=None, bbox=None, quiet=False, counties_file=None,
-                 start=None, end=None, data_type=None):
+                 start=None, end=None, data_type=None, batch=None, stats=None):
     """
     Returns a list of stations SRC IDs based on inputs.
     """
@@ -142,10 +321,22 @@ def stations(output_filepath=None, county=None, bbox=None, quiet=False, counties
 
 
 def get_stations(output_filepath=None, county=None, bbox=None, quiet=False, counties_file=None,
-                 start=None, end=None, data_type=None):
+                 start=None, end=None, data_type=None, batch=None, stats=None):
     """
     Returns a list of stations SRC IDs based on inputs.
+
+    If `stats` is "json" then the metrics of the search (see
+    `midas_extract.metrics`) are written to standard error, and the search is run
+    in-process.
+
+    If `batch` is given it is a JSON lines file holding one query per line, as a
+    dictionary with the keys "county", "bbox", "start", "end" and "data_type". The
+    queries are answered together and a JSON list of SRC IDs is written (to the
+    output file, or the terminal) for each, in order. Returns the list of results.
     """
+    if batch:
+        return get_stations_batch(batch, output_filepath)
+
     if not county:
         county = []
     else:
@@ -172,8 +363,43 @@ def get_stations(output_filepath=None, county=None, bbox=None, quiet=False, coun
         raise click.ClickException("You must provide a miminum of either a list of counties or " \
                                    "bbox coordinates.")
 
+    # Run the query on the extraction server if one is running
+    if client.is_available() and not stats:
+        query = {'county': county, 'bbox': bbox, 'start': start, 'end': end, 'data_type': data_type}
+        st_list = client.stations([query])[0]
+
+        write_station_list(st_list, output_filepath, quiet)
+        return st_list
+
     return StationIDGetter(county, bbox, start_time=start, end_time=end, data_type=data_type,
-                           output_file=output_filepath, quiet=quiet)
+                           output_file=output_filepath, quiet=quiet, stats=stats)
+
+
+def get_stations_batch(batch, output_filepath=None):
+    """
+    Answers the station queries in JSON lines file `batch` with
+    `StationIDGetter.query_many` and writes one JSON list of SRC IDs per query.
+    """
+    with open(batch) as reader:
+        queries = [json.loads(line) for line in reader if line.strip()]
+
+    try:
+        if client.is_available():
+            results = client.stations(queries)
+        else:
+            results = StationIDGetter.query_many(queries)
+    except Exception as exc:
+        raise click.ClickException(str(exc))
+
+    lines = "".join(json.dumps(result) + "\n" for result in results)
+
+    if output_filepath:
+        with open(output_filepath, "w") as writer:
+            writer.write(lines)
+    else:
+        click.echo(lines, nl=False)
+
+    return results
 
 
 if __name__ == "__main__":
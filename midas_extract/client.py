@@ -0,0 +1,106 @@
+"""
+client.py
+=========
+
+A thin client for the extraction server (see `midas_extract.server`).
+
+The command-line interface uses the server when one is listening on
+``MIDAS_SERVER_SOCKET`` with the same data and metadata settings as the client;
+otherwise it runs jobs in-process.
+
+"""
+
+import os
+import sys
+import json
+import socket
+import shutil
+
+
+from midas_extract import settings
+from midas_extract import server
+
+
+_CHUNK_BYTES = 1024 ** 2
+
+
+def request(command, args=None, socket_path=None):
+    """
+    Sends a request to the server and returns a tuple of (header, reader) where
+    `reader` is a binary file object holding the output of the job. Raises an
+    Exception holding the message of an error reply, or OSError if no server is
+    listening.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        sock.connect(socket_path or settings.get_server_socket())
+        sock.sendall((json.dumps({"command": command, "args": args or {}}) + "\n").encode())
+        reader = sock.makefile("rb")
+    finally:
+        # The reader keeps the connection open
+        sock.close()
+
+    header = json.loads(reader.readline() or "{}")
+
+    if header.get("status") != "ok":
+        reader.close()
+        raise Exception(header.get("message", "No reply from the extraction server."))
+
+    return header, reader
+
+
+def is_available(socket_path=None):
+    """
+    Returns True if a server is listening and it uses the same settings as this
+    process.
+    """
+    socket_path = socket_path or settings.get_server_socket()
+
+    if not os.path.exists(socket_path):
+        return False
+
+    try:
+        header, reader = request("ping", socket_path=socket_path)
+    except Exception:
+        return False
+
+    reader.close()
+    return (header.get("version") == server.PROTOCOL_VERSION and
+            header.get("environment") == server.get_environment())
+
+
+def extract(args, output=None, socket_path=None):
+    """
+    Runs an extraction on the server. `args` are the arguments of
+    `cli.extract_records`. If no output file is given then the output is streamed
+    to the binary file `output` (default: standard output). Returns the header of
+    the reply.
+    """
+    args = dict(args)
+
+    # Paths are resolved by the server so must be absolute
+    for name in ("output_filepath", "tmp_dir"):
+        if args.get(name) and args[name] != "display":
+            args[name] = os.path.abspath(args[name])
+
+    header, reader = request("extract", args, socket_path=socket_path)
+
+    with reader:
+        shutil.copyfileobj(reader, output or sys.stdout.buffer, _CHUNK_BYTES)
+
+    if header.get("output"):
+        print(f"Output written to: {header['output']}")
+
+    return header
+
+
+def stations(queries, socket_path=None):
+    """
+    Answers station queries (see `StationIDGetter.query_many`) on the server.
+    Returns a list holding the list of SRC IDs found for each.
+    """
+    header, reader = request("stations", {"queries": queries}, socket_path=socket_path)
+
+    with reader:
+        return [json.loads(line) for line in reader]
@@ -0,0 +1,577 @@
+"""
+columnar.py
+===========
+
+A typed, columnar (Parquet) copy of the MIDAS partition files.
+
+`convert_table` writes one Parquet file per yearly partition file, with a column
+for each name in ``table_structures/<ID>TB.txt``. Each column has the type given
+by `reader.get_column_type` (timestamp, int64, float64 or string). Timestamp and
+int64 columns are only used where every value converts back to exactly the same
+text; otherwise the column is stored as a string.
+
+Float64 columns record the number of decimal places that their values are
+written with, so that the text is reproduced exactly (18.0 is written as "18.0").
+If a column's values are not all written with the same number of places then its
+text is also kept, in an extra ``_text_<name>`` column. An extra ``_time_key``
+column holds the observation time as an integer (YYYYMMDDhhmm) for predicate
+pushdown.
+
+The subsetter reads the store in place of the text file whenever an up-to-date
+copy exists, pruning row groups on time (and src_id) statistics and reading only
+the columns it needs. The rows it writes are identical to those of a text scan.
+
+The store is written to a "columnar" directory alongside each table's
+"yearly_files" directory unless ``MIDAS_COLUMNAR_DIR`` is set. It requires
+`pyarrow`.
+
+"""
+
+import io
+import os
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+from midas_extract import settings
+from midas_extract import catalogue
+from midas_extract import compression
+from midas_extract import indexing
+
+
+STORE_VERSION = "2"
+TIME_KEY = "_time_key"
+TEXT_PREFIX = "_text_"
+DECIMALS_KEY = b"midas_decimals"
+TIME_FORMAT = "%Y-%m-%d %H:%M"
+DEFAULT_ROW_GROUP_SIZE = 65536
+
+_BATCH_LINES = 100000
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise Exception("The columnar store requires 'pyarrow' to be installed.")
+
+
+def get_store_path(data_file):
+    """
+    Returns the path of the columnar copy of partition file `data_file`.
+    """
+    store_dir = settings.get_columnar_dir()
+    store_name = os.path.splitext(os.path.basename(data_file))[0] + ".parquet"
+
+    if store_dir:
+        return os.path.join(store_dir, store_name)
+
+    table_dir = os.path.dirname(os.path.dirname(os.path.abspath(data_file)))
+    return os.path.join(table_dir, "columnar", store_name)
+
+
+def has_store(data_file):
+    """
+    Returns a boolean. True if an up-to-date columnar copy of `data_file` exists
+    (and `pyarrow` is available to read it).
+    """
+    if pa is None:
+        return False
+
+    store_path = get_store_path(data_file)
+
+    if not os.path.isfile(store_path):
+        return False
+
+    try:
+        metadata = pq.read_schema(store_path).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return False
+
+    signature = (metadata.get(b"midas_version"), metadata.get(b"midas_source_size"),
+                 metadata.get(b"midas_source_mtime_ns"))
+    size, mtime_ns = indexing.file_signature(data_file)
+
+    return signature == (STORE_VERSION.encode(), str(size).encode(), str(mtime_ns).encode())
+
+
+def _format_fixed(arr, decimals):
+    "Returns float array `arr` as strings with `decimals` decimal places."
+    if isinstance(arr, pa.ChunkedArray):
+        arr = arr.combine_chunks()
+
+    values = pc.fill_null(arr, 0.0).to_numpy(zero_copy_only=False)
+    text = pa.array(np.char.mod(f"%.{decimals}f", values).astype(object), pa.string())
+
+    return pc.if_else(pc.is_null(arr), pa.scalar(None, pa.string()), text)
+
+
+def _to_text(arr, fmt=TIME_FORMAT, decimals=None):
+    """
+    Returns typed array `arr` as strings, as they appear in the text files. Floats
+    are written with `decimals` decimal places if given.
+    """
+    if pa.types.is_string(arr.type):
+        text = arr
+    elif pa.types.is_timestamp(arr.type):
+        text = pc.strftime(arr, format=fmt)
+    elif decimals is not None and pa.types.is_floating(arr.type):
+        text = _format_fixed(arr, decimals)
+    else:
+        text = pc.cast(arr, pa.string())
+
+    return pc.fill_null(text, "")
+
+
+def _text_column(table, name):
+    "Returns column `name` of `table` (read from the store) as the strings of the text file."
+    if TEXT_PREFIX + name in table.column_names:
+        return pc.fill_null(table.column(TEXT_PREFIX + name), "")
+
+    decimals = (table.schema.field(name).metadata or {}).get(DECIMALS_KEY)
+    return _to_text(table.column(name), decimals=int(decimals) if decimals else None)
+
+
+def _column_names(schema):
+    "Returns the names of the table's columns in the store's `schema`."
+    return [name for name in schema.names
+            if name != TIME_KEY and not name.startswith(TEXT_PREFIX)]
+
+
+def _to_typed(arr, typ, fmt=TIME_FORMAT):
+    "Returns string array `arr` as type `typ`, with empty strings as nulls."
+    if pa.types.is_string(typ):
+        return arr
+
+    nulled = pc.if_else(pc.equal(arr, ""), pa.scalar(None, pa.string()), arr)
+
+    if pa.types.is_timestamp(typ):
+        return pc.strptime(nulled, format=fmt, unit="s")
+
+    return pc.cast(nulled, typ)
+
+
+def _is_lossless(arr, typ, decimals=None):
+    """
+    Returns True if every string in `arr` converts to `typ` and back unchanged
+    (with `decimals` decimal places, for floats).
+    """
+    try:
+        typed = _to_typed(arr, typ)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return False
+
+    return pc.all(pc.equal(_to_text(typed, decimals=decimals), arr)).as_py() is not False
+
+
+def _parses(arr, typ):
+    "Returns True if every string in `arr` converts to `typ`."
+    try:
+        _to_typed(arr, typ)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return False
+
+    return True
+
+
+def _decimal_places(arr):
+    """
+    Returns the number of decimal places of the first non-empty string in `arr`, or
+    None if all are empty.
+    """
+    values = pc.filter(arr, pc.not_equal(arr, ""))
+
+    if len(values) == 0:
+        return None
+
+    first = values[0].as_py()
+    return len(first) - first.index(".") - 1 if "." in first else 0
+
+
+def _read_batches(data_file, time_of, ncols, batch_lines=_BATCH_LINES):
+    """
+    Generator that yields (time_keys, columns) for batches of the rows of `data_file`
+    that have a time, where `columns` is a list of string arrays. Rows are split
+    with only the newline removed, so that empty last fields are kept.
+    """
+    keys = []
+    rows = []
+
+    def batch():
+        return pa.array(keys, pa.int64()), [pa.array(col, pa.string()) for col in zip(*rows)]
+
+    with compression.open_partition(data_file) as reader:
+
+        for line in reader:
+            line = line.rstrip("\r\n")
+            tm = time_of(line)
+
+            if tm is None:
+                continue
+
+            fields = line.split(", ")
+
+            if len(fields) != ncols:
+                raise Exception(f"Cannot convert '{data_file}': found a row with {len(fields)} "
+                                f"fields but the table has {ncols} columns.")
+
+            keys.append(tm)
+            rows.append(fields)
+
+            if len(rows) == batch_lines:
+                yield batch()
+                keys = []
+                rows = []
+
+    if rows:
+        yield batch()
+
+
+def convert_partition(data_file, tableID, row_group_size=DEFAULT_ROW_GROUP_SIZE):
+    """
+    Writes the columnar copy of partition file `data_file` of table `tableID`.
+    Returns the path of the Parquet file.
+
+    The file is read twice: once to check the type of each column and once to
+    write it.
+    """
+    _require_pyarrow()
+    from midas_extract import reader
+    from midas_extract import subsetter
+
+    names = [name.strip().lower() for name in
+             open(os.path.join(settings.get_metadata_dir(), f"table_structures/{tableID}TB.txt"))
+             if name.strip()]
+    datePattern = subsetter.getDatePattern(tableID)
+
+    def time_of(line):
+        return subsetter.dateMatch(line, datePattern)
+
+    arrowTypes = {"datetime": pa.timestamp("s"), "int": pa.int64(), "float": pa.float64(),
+                  "str": pa.string()}
+    types = [arrowTypes[reader.get_column_type(name)] for name in names]
+    places = [None] * len(names)
+    exact = [True] * len(names)
+
+    for (_, columns) in _read_batches(data_file, time_of, len(names)):
+        for i, arr in enumerate(columns):
+            typ = types[i]
+
+            if pa.types.is_floating(typ):
+                if not _parses(arr, typ):
+                    types[i] = pa.string()
+                    continue
+
+                if places[i] is None:
+                    places[i] = _decimal_places(arr)
+
+                exact[i] = exact[i] and _is_lossless(arr, typ, places[i])
+
+            elif not pa.types.is_string(typ) and not _is_lossless(arr, typ):
+                types[i] = pa.string()
+
+    # Floats record their decimal places, or keep their text if these vary
+    fields = []
+    texts = []
+
+    for (name, typ, decimals, isExact) in zip(names, types, places, exact):
+        if pa.types.is_floating(typ) and not isExact:
+            texts.append(name)
+
+        if pa.types.is_floating(typ) and isExact and decimals is not None:
+            fields.append(pa.field(name, typ, metadata={DECIMALS_KEY: str(decimals)}))
+        else:
+            fields.append(pa.field(name, typ))
+
+    size, mtime_ns = indexing.file_signature(data_file)
+    schema = pa.schema(fields + [pa.field(TIME_KEY, pa.int64())] +
+                       [pa.field(TEXT_PREFIX + name, pa.string()) for name in texts],
+                       metadata={"midas_version": STORE_VERSION,
+                                 "midas_source_size": str(size),
+                                 "midas_source_mtime_ns": str(mtime_ns)})
+
+    store_path = get_store_path(data_file)
+    os.makedirs(os.path.dirname(store_path), exist_ok=True)
+    tmp_path = f"{store_path}.{os.getpid()}.tmp"
+
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        for (keys, columns) in _read_batches(data_file, time_of, len(names)):
+            arrays = [_to_typed(arr, typ) for arr, typ in zip(columns, types)] + [keys] + \
+                [columns[names.index(name)] for name in texts]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema),
+                               row_group_size=row_group_size)
+
+    os.replace(tmp_path, store_path)
+    return store_path
+
+
+def convert_table(table, region=None, row_group_size=DEFAULT_ROW_GROUP_SIZE, verbose=True):
+    """
+    Writes the columnar copy of every partition file in `table`. Returns a list of
+    the Parquet file paths written. Partition files that cannot be converted (for
+    example, because they hold rows with the wrong number of fields) are reported,
+    and once the others are written an Exception is raised naming them (extractions
+    read them as text).
+    """
+    _require_pyarrow()
+    from midas_extract import subsetter
+
+    tableID = subsetter.tableMatch(table.upper())[0]
+    partitionFiles = catalogue.get_partition_files(tableID, region)
+
+    written = []
+    failed = []
+
+    for fname in partitionFiles:
+        if verbose:
+            print(f"Converting: {fname}")
+
+        try:
+            written.append(convert_partition(fname, tableID, row_group_size=row_group_size))
+        except Exception as exc:
+            print(f"Skipping: {exc}")
+            failed.append(fname)
+
+    if failed:
+        raise Exception(f"Could not convert {len(failed)} of {len(partitionFiles)} partition "
+                        f"file(s) of table '{tableID}': {', '.join(failed)}")
+
+    return written
+
+
+def _coerce_src_ids(src_ids, typ):
+    """
+    Returns `src_ids` as an array of type `typ`, keeping only those whose text form
+    in the data files would be identical (so matches are the same as a text scan).
+    """
+    src_ids = [str(src_id).strip() for src_id in src_ids]
+
+    if pa.types.is_string(typ):
+        return pa.array(src_ids, pa.string())
+
+    values = []
+    for src_id in src_ids:
+        try:
+            value = _to_typed(pa.array([src_id], pa.string()), typ)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            continue
+
+        if value[0].is_valid and _to_text(value)[0].as_py() == src_id:
+            values.append(value[0].as_py())
+
+    return pa.array(values, typ)
+
+
+def filterStore(filename, output, datePattern, startTimeLong, endTimeLong, src_ids=None,
+                srcidIndex=None, use_index=True, verbose=True, columns=None, conditions=None,
+                stats=None):
+    """
+    Scan engine that reads the columnar copy of partition file `filename` and writes
+    its rows that fall between `startTimeLong` and `endTimeLong` (and belong to one
+    of `src_ids`, if given) to `output`, as text identical to a scan of the text file.
+    The arguments are as for `iterStore`. Returns the number of rows written.
+    """
+    binary = not isinstance(output, io.TextIOBase)
+    count = 0
+
+    for lines in iterStore(filename, datePattern, startTimeLong, endTimeLong, src_ids,
+                           srcidIndex, use_index=use_index, verbose=verbose, columns=columns,
+                           conditions=conditions, stats=stats):
+        data = "\n".join(lines) + "\n"
+
+        output.write(data.encode() if binary else data)
+        count += len(lines)
+
+    return count
+
+
+def iterStore(filename, datePattern, startTimeLong, endTimeLong, src_ids=None, srcidIndex=None,
+              use_index=True, verbose=True, columns=None, conditions=None, stats=None):
+    """
+    Generator that reads the columnar copy of partition file `filename` and yields
+    a list of its rows (as lines of text, without newlines) from each row group
+    read that fall between `startTimeLong` and `endTimeLong` (and belong to one of
+    `src_ids`, if given).
+
+    Row groups are skipped using their time and src_id statistics. If `columns` (a
+    list of 0-based column indexes) is given then only those columns are yielded,
+    and if `conditions` (a `conditions.ConditionSet`) is given then only the rows
+    that meet them. Only the columns needed are read.
+
+    If `stats` is a dictionary then the (compressed) bytes of the column chunks read
+    and the number of rows in the row groups read are added to its "bytes_read" and
+    "lines_scanned".
+    """
+    _require_pyarrow()
+
+    pf = pq.ParquetFile(get_store_path(filename))
+    schema = pf.schema_arrow
+    names = _column_names(schema)
+    outColumns = [names[i] for i in columns] if columns is not None else names
+    readColumns = list(outColumns)
+
+    if conditions:
+        readColumns.extend(names[i] for i in conditions.columns if names[i] not in readColumns)
+
+    # The text of the columns whose values do not reproduce it
+    readColumns.extend([TEXT_PREFIX + name for name in readColumns
+                        if TEXT_PREFIX + name in schema.names])
+
+    if verbose:
+        print(f'\nReading columnar store for "{filename}" ({pf.metadata.num_rows} rows).')
+
+    srcName = None
+    if src_ids:
+        srcName = names[srcidIndex]
+        srcValues = _coerce_src_ids(src_ids, schema.field(srcName).type)
+
+        if len(srcValues) == 0:
+            return
+
+        if srcName not in readColumns:
+            readColumns.append(srcName)
+
+    readColumns.append(TIME_KEY)
+
+    for i in _select_row_groups(pf, startTimeLong, endTimeLong, srcName,
+                                srcValues if srcName else None):
+        table = pf.read_row_group(i, columns=readColumns)
+
+        if stats is not None:
+            _add_row_group_stats(stats, pf.metadata.row_group(i), readColumns)
+        key = table.column(TIME_KEY)
+        mask = pc.and_(pc.greater_equal(key, startTimeLong), pc.less_equal(key, endTimeLong))
+
+        if srcName:
+            srcColumn = table.column(srcName)
+            if pa.types.is_string(srcColumn.type):
+                srcColumn = pc.utf8_trim_whitespace(srcColumn)
+
+            mask = pc.and_(mask, pc.is_in(srcColumn, value_set=srcValues))
+
+        table = table.filter(mask)
+
+        if conditions and table.num_rows:
+            table = table.filter(pa.array(_evaluate(conditions, table, names)))
+
+        if table.num_rows == 0:
+            continue
+
+        texts = [_text_column(table, name) for name in outColumns]
+
+        # Selected columns are written stripped, as they are from the text files
+        if columns is not None:
+            texts = [pc.utf8_trim_whitespace(text) for text in texts]
+        lines = pc.binary_join_element_wise(*texts, ", ") if len(texts) > 1 else texts[0]
+
+        # Whole rows are written stripped, as the lines are by a text scan
+        if columns is None:
+            lines = pc.utf8_trim_whitespace(lines)
+
+        yield lines.to_pylist()
+
+
+def _add_row_group_stats(stats, rowGroup, readColumns):
+    "Adds the bytes and rows of the `readColumns` of `rowGroup` to the `stats` dictionary."
+    nbytes = 0
+
+    for j in range(rowGroup.num_columns):
+        chunk = rowGroup.column(j)
+
+        if chunk.path_in_schema in readColumns:
+            nbytes += chunk.total_compressed_size
+
+    stats["bytes_read"] = stats.get("bytes_read", 0) + nbytes
+    stats["lines_scanned"] = stats.get("lines_scanned", 0) + rowGroup.num_rows
+
+
+def _select_row_groups(pf, startTimeLong, endTimeLong, srcName=None, srcValues=None):
+    """
+    Returns a list of the numbers of the row groups of Parquet file `pf` whose
+    statistics show that they may hold rows in the time range (and, for typed
+    src_ids, rows for one of `srcValues`).
+    """
+    schema = pf.schema_arrow
+    timeIndex = schema.get_field_index(TIME_KEY)
+    selected = []
+
+    # String statistics are of the untrimmed values so are only used for typed ids
+    useSrc = srcName is not None and not pa.types.is_string(srcValues.type)
+
+    for i in range(pf.num_row_groups):
+        rowGroup = pf.metadata.row_group(i)
+
+        if not _may_overlap(rowGroup, timeIndex, startTimeLong, endTimeLong):
+            continue
+
+        if useSrc and not _may_overlap(rowGroup, schema.get_field_index(srcName),
+                                       pc.min(srcValues).as_py(), pc.max(srcValues).as_py()):
+            continue
+
+        selected.append(i)
+
+    return selected
+
+
+def estimate_scan(filename, startTimeLong, endTimeLong, src_ids=None, srcidIndex=None):
+    """
+    Returns a tuple of (row_groups, total_row_groups, rows, bytes) describing how
+    much of the columnar copy of `filename` a scan of the time range (and `src_ids`,
+    if given) would read. `bytes` is the uncompressed size of the row groups read.
+    """
+    _require_pyarrow()
+
+    pf = pq.ParquetFile(get_store_path(filename))
+    srcName = srcValues = None
+
+    if src_ids:
+        names = _column_names(pf.schema_arrow)
+        srcName = names[srcidIndex]
+        srcValues = _coerce_src_ids(src_ids, pf.schema_arrow.field(srcName).type)
+
+        if len(srcValues) == 0:
+            return (0, pf.num_row_groups, 0, 0)
+
+    selected = _select_row_groups(pf, startTimeLong, endTimeLong, srcName, srcValues)
+    rowGroups = [pf.metadata.row_group(i) for i in selected]
+
+    return (len(selected), pf.num_row_groups, sum(rg.num_rows for rg in rowGroups),
+            sum(rg.total_byte_size for rg in rowGroups))
+
+
+def _evaluate(conditions, table, names):
+    """
+    Returns the mask of `conditions` evaluated on `table`. Numeric columns that are
+    only used in numeric conditions are passed as typed arrays, others as text.
+    """
+    chunk = {}
+
+    for i in conditions.columns:
+        column = table.column(names[i])
+
+        if i in conditions.numericColumns and (pa.types.is_integer(column.type) or
+                                               pa.types.is_floating(column.type)):
+            chunk[i] = pc.fill_null(pc.cast(column, pa.float64()), float("nan")).to_numpy()
+        else:
+            chunk[i] = pc.utf8_trim_whitespace(_text_column(table, names[i])).to_numpy(
+                zero_copy_only=False)
+
+    return conditions.evaluate(chunk, table.num_rows)
+
+
+def _may_overlap(rowGroup, columnIndex, low, high):
+    "Returns False if the statistics of a row group column show no values in [low, high]."
+    stats = rowGroup.column(columnIndex).statistics
+
+    if stats is None or not stats.has_min_max:
+        return True
+
+    try:
+        return not (stats.max < low or stats.min > high)
+    except TypeError:
+        return True
@@ -0,0 +1,278 @@
+"""
+compression.py
+==============
+
+Reading compressed partition files and writing compressed output.
+
+A partition file may be stored compressed, as ``<name>.txt.gz``, ``.txt.bz2``,
+``.txt.xz`` or ``.txt.zst`` (the last requires the `zstandard` package).
+`open_partition` opens any partition file for reading, decompressing it as it is
+streamed. Compressed files are decompressed in a background thread, which runs
+ahead of the reader by up to `PREFETCH_CHUNKS` chunks so that decompression
+overlaps with filtering (zlib, bz2, lzma and zstandard all release the GIL while
+they work).
+
+Compressed files cannot be memory-mapped or indexed, so they are always read with
+the text engine from the start of the file.
+
+`open_output` opens an output file that is compressed (with gzip or zstd) as it
+is written, optionally in a background thread.
+
+"""
+
+import io
+import os
+import bz2
+import gzip
+import lzma
+import queue
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Suffixes of compressed partition files and the name of each format
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".bz2": "bzip2", ".xz": "xz", ".zst": "zstd"}
+
+PREFETCH_CHUNKS = 4
+CHUNK_BYTES = 1024 ** 2
+
+
+def get_compression(filename):
+    "Returns the name of the compression format of `filename`, or None."
+    return COMPRESSION_SUFFIXES.get(os.path.splitext(filename)[1])
+
+
+def is_compressed(filename):
+    "Returns True if `filename` has the suffix of a compression format."
+    return get_compression(filename) is not None
+
+
+def _decompressor(compression, source):
+    """
+    Returns a binary file object that decompresses `source`, a file name (which is
+    closed with the returned object) or binary file object.
+    """
+    if compression == "gzip":
+        return gzip.open(source)
+    if compression == "bzip2":
+        return bz2.open(source)
+    if compression == "xz":
+        return lzma.open(source)
+
+    if zstandard is None:
+        raise Exception("Reading zstd-compressed partition files requires 'zstandard' "
+                        "to be installed.")
+
+    if isinstance(source, str):
+        source = open(source, "rb")
+        return zstandard.ZstdDecompressor().stream_reader(source, read_size=CHUNK_BYTES)
+
+    return zstandard.ZstdDecompressor().stream_reader(source, read_size=CHUNK_BYTES,
+                                                      closefd=False)
+
+
+class _PrefetchReader(io.RawIOBase):
+    """
+    A raw, read-only stream of the output of the binary file object `source`,
+    which is read in chunks by a background thread.
+    """
+
+    def __init__(self, source):
+        self._source = source
+        self._queue = queue.Queue(maxsize=PREFETCH_CHUNKS)
+        self._stop = threading.Event()
+        self._chunk = memoryview(b"")
+        self._eof = False
+
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def _fill(self):
+        try:
+            while True:
+                data = self._source.read(CHUNK_BYTES)
+
+                if not self._put(data) or not data:
+                    return
+
+        except Exception as exc:
+            self._put(exc)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk:
+            if self._eof:
+                return 0
+
+            item = self._queue.get()
+
+            if isinstance(item, Exception):
+                raise item
+
+            if not item:
+                self._eof = True
+                return 0
+
+            self._chunk = memoryview(item)
+
+        n = min(len(buffer), len(self._chunk))
+        buffer[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            self._source.close()
+
+        super().close()
+
+
+def open_partition(filename, mode="r", prefetch=True):
+    """
+    Opens partition file `filename` for reading in text ("r") or binary ("rb")
+    `mode`. Compressed files are decompressed as they are read, in a background
+    thread if `prefetch` is True. Compressed files cannot seek.
+    """
+    compression = get_compression(filename)
+
+    if compression is None:
+        return open(filename, mode)
+
+    source = _decompressor(compression, filename)
+
+    if prefetch:
+        source = io.BufferedReader(_PrefetchReader(source), CHUNK_BYTES)
+
+    if mode == "rb":
+        return source
+
+    return io.TextIOWrapper(source)
+
+
+def sample(filename, nbytes):
+    """
+    Returns a tuple of (data, consumed): up to `nbytes` bytes read from the start of
+    partition file `filename` (after decompression), and the number of bytes of the
+    file read to get them.
+    """
+    with open(filename, "rb") as raw:
+        compression = get_compression(filename)
+
+        if compression is None:
+            data = raw.read(nbytes)
+            return data, len(data)
+
+        data = _decompressor(compression, raw).read(nbytes)
+        return data, raw.tell()
+
+
+# Compression formats for output files and their suffixes and default levels
+OUTPUT_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3}
+
+
+def get_output_path(filename, compress=None):
+    "Returns `filename` with the suffix of output compression `compress` added if missing."
+    suffix = OUTPUT_SUFFIXES.get(compress, "")
+
+    if compress and compress not in OUTPUT_SUFFIXES:
+        raise Exception(f"Output compression not known: {compress}")
+
+    return filename if filename.endswith(suffix) else filename + suffix
+
+
+class _BackgroundWriter(io.RawIOBase):
+    """
+    A raw, write-only stream that passes the data written to it to the binary file
+    object `sink` in a background thread. Errors in the thread are raised by the
+    next write or by `close`.
+    """
+
+    def __init__(self, sink):
+        self._sink = sink
+        self._queue = queue.Queue(maxsize=PREFETCH_CHUNKS)
+        self._error = None
+
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        while True:
+            data = self._queue.get()
+
+            if data is None:
+                return
+
+            if self._error is None:
+                try:
+                    self._sink.write(data)
+                except Exception as exc:
+                    self._error = exc
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self._error is not None:
+            raise self._error
+
+        self._queue.put(bytes(data))
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._queue.put(None)
+            self._thread.join()
+            self._sink.close()
+
+        super().close()
+
+        if self._error is not None:
+            raise self._error
+
+
+def open_output(filename, compress=None, level=None, background=False):
+    """
+    Opens `filename` for writing text. If `compress` is "gzip" or "zstd" the text
+    is compressed (at `level`, or the default for the format) as it is written, in
+    a background thread if `background` is True.
+    """
+    if not compress:
+        return open(filename, "w")
+
+    get_output_path(filename, compress)
+
+    if level is None:
+        level = DEFAULT_LEVELS[compress]
+
+    if compress == "gzip":
+        sink = gzip.open(filename, "wb", compresslevel=int(level))
+
+    elif zstandard is None:
+        raise Exception("Writing zstd-compressed output requires 'zstandard' to be installed.")
+
+    else:
+        sink = zstandard.ZstdCompressor(level=int(level)).stream_writer(open(filename, "wb"))
+
+    if background:
+        sink = io.BufferedWriter(_BackgroundWriter(sink), CHUNK_BYTES)
+
+    return io.TextIOWrapper(sink)
@@ -0,0 +1,213 @@
+"""
+conditions.py
+=============
+
+Value conditions for MIDAS extractions. Each condition takes the form:
+
+    [<column>:]<condition>=<value>
+
+Where <condition> is one of:
+
+    * range=<low>:<high>     [<low> and <high> are values; inclusive]
+    * greater_than=<value>
+    * less_than=<value>
+    * exact=<match>          [<match> is a string]
+    * pattern=<pattern>      [<pattern> is a regular expression]
+
+A condition without a column applies to each of the columns selected for output.
+A row is kept only if every condition holds.
+
+Conditions are compiled once into a `ConditionSet` and evaluated with NumPy on
+chunks of rows, so rows that fail them are never formatted or written.
+
+"""
+
+import re
+
+import numpy as np
+
+
+CONDITION_TYPES = ("range", "greater_than", "less_than", "exact", "pattern")
+NUMERIC_CONDITIONS = ("range", "greater_than", "less_than")
+
+# Relative cost of evaluating each condition: comparisons of whole arrays are cheap
+# (and a range is at least as selective as a single bound); patterns run per row
+CONDITION_COSTS = {"exact": 0, "range": 1, "greater_than": 2, "less_than": 2, "pattern": 3}
+
+# Number of rows evaluated together
+CHUNK_ROWS = 65536
+
+
+def parse_conditions(conditions):
+    """
+    Returns a list of (column, condition, value) tuples. `column` is None if the
+    condition does not name one.
+
+    `conditions` can be a comma-separated string, a dictionary of {<key>: <value>},
+    or a list of strings or tuples in either form.
+    """
+    if not conditions:
+        return []
+
+    if isinstance(conditions, str):
+        conditions = conditions.split(",")
+    elif isinstance(conditions, dict):
+        conditions = list(conditions.items())
+
+    parsed = []
+
+    for cond in conditions:
+        if isinstance(cond, str):
+            if "=" not in cond:
+                raise Exception(f"Condition must be of the form [<column>:]<condition>=<value>: {cond}")
+            cond = cond.split("=", 1)
+
+        if len(cond) == 3:
+            column, kind, value = cond
+        else:
+            key, value = cond
+            column, _, kind = key.strip().rpartition(":")
+
+        kind = kind.strip().lower()
+        column = column.strip().lower() if column else None
+
+        if kind not in CONDITION_TYPES:
+            raise Exception(f"Condition type not known: {kind}")
+
+        parsed.append((column, kind, value))
+
+    return parsed
+
+
+def _as_float(arr):
+    "Returns `arr` as a float array. Empty or non-numeric values become NaN."
+    if arr.dtype.kind in "fiub":
+        return arr.astype(np.float64, copy=False)
+
+    arr = np.where(arr == "", "nan", arr)
+
+    try:
+        return arr.astype(np.float64)
+    except ValueError:
+        return np.array([_to_float(value) for value in arr], dtype=np.float64)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+class ConditionSet:
+    """
+    A compiled set of conditions to evaluate on chunks of rows.
+
+    `columnNames` is the list of column names of the table and `defaultColumns` is
+    the list of (0-based) indexes of the columns that conditions without a column
+    apply to.
+    """
+
+    def __init__(self, conditions, columnNames, defaultColumns=None):
+        self.conditions = []
+        self.columnNames = columnNames = [name.lower() for name in columnNames]
+
+        for (column, kind, value) in parse_conditions(conditions):
+
+            if column:
+                if column not in columnNames:
+                    raise Exception(f"Cannot find column name '{column}' for condition: {kind}={value}")
+                indexes = [columnNames.index(column)]
+
+            elif defaultColumns:
+                indexes = list(defaultColumns)
+
+            else:
+                raise Exception(f"Condition '{kind}={value}' must name a column (as "
+                                f"<column>:{kind}=<value>) unless columns are selected.")
+
+            if kind == "range":
+                low, high = value.split(":")
+                value = (float(low), float(high))
+            elif kind in NUMERIC_CONDITIONS:
+                value = float(value)
+            elif kind == "pattern":
+                value = re.compile(value)
+
+            for index in indexes:
+                self.conditions.append((index, kind, value))
+
+    def __bool__(self):
+        return bool(self.conditions)
+
+    @property
+    def columns(self):
+        "Returns a sorted list of the indexes of the columns used by the conditions."
+        return sorted({index for (index, _, _) in self.conditions})
+
+    @property
+    def numericColumns(self):
+        "Returns a set of the indexes of the columns used only by numeric conditions."
+        text = {index for (index, kind, _) in self.conditions if kind not in NUMERIC_CONDITIONS}
+        return set(self.columns) - text
+
+    def order(self):
+        """
+        Sorts the conditions so that the cheapest and most selective are evaluated
+        first. Later conditions are only evaluated on the rows that remain.
+        """
+        self.conditions.sort(key=lambda cond: CONDITION_COSTS[cond[1]])
+
+    def describe(self):
+        "Returns a list of descriptions of the conditions, in evaluation order."
+        descriptions = []
+
+        for (index, kind, value) in self.conditions:
+            if kind == "range":
+                value = f"{value[0]:g}:{value[1]:g}"
+            elif kind == "pattern":
+                value = value.pattern
+            elif kind in NUMERIC_CONDITIONS:
+                value = f"{value:g}"
+
+            descriptions.append(f"{self.columnNames[index]} {kind}={value}")
+
+        return descriptions
+
+    def evaluate(self, chunk, nrows):
+        """
+        Returns a boolean NumPy array that is True for each row that meets every
+        condition. `chunk` is a dictionary of {<column_index>: <array>} holding each
+        column in `self.columns` as a NumPy array of strings (or of numbers, for
+        columns only used in numeric conditions).
+        """
+        mask = np.ones(nrows, dtype=bool)
+        floats = {}
+
+        for (index, kind, value) in self.conditions:
+
+            if not mask.any():
+                break
+
+            if kind in NUMERIC_CONDITIONS:
+                if index not in floats:
+                    floats[index] = _as_float(chunk[index])
+                arr = floats[index]
+
+                if kind == "range":
+                    mask &= (arr >= value[0]) & (arr <= value[1])
+                elif kind == "greater_than":
+                    mask &= arr > value
+                else:
+                    mask &= arr < value
+
+            elif kind == "exact":
+                mask &= chunk[index] == value
+
+            else:
+                search = value.search
+                arr = chunk[index]
+                mask &= np.fromiter((bool(search(v)) if m else False for v, m in zip(arr, mask)),
+                                    dtype=bool, count=nrows)
+
+        return mask
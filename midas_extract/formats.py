@@ -0,0 +1,196 @@
+"""
+formats.py
+==========
+
+Typed binary output formats for extractions: Parquet, Feather (Arrow IPC) and
+NetCDF.
+
+The rows extracted are taken from the scan in batches of `DEFAULT_BATCH_ROWS`
+and written as typed columns named from the table structure, one row group (or
+record batch, or slab of the unlimited "row" dimension) per batch, so the whole
+result is never held in memory. Each column has the type given by
+`reader.get_column_type` and is converted as by `reader.read_table` (so a file
+holds the same values as a DataFrame of the same request): timestamp, int64,
+float64 or string. Empty values are stored as nulls (NaN or the fill value, in
+NetCDF).
+
+Parquet and Feather require `pyarrow`; NetCDF also requires `netCDF4`.
+
+"""
+
+import os
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+try:
+    import netCDF4
+except ImportError:
+    netCDF4 = None
+
+
+OUTPUT_FORMATS = ("text", "parquet", "feather", "netcdf")
+DEFAULT_BATCH_ROWS = 65536
+
+_EPOCH = "seconds since 1970-01-01 00:00:00"
+
+
+def _require(output_format):
+    if pa is None:
+        raise Exception(f"Writing {output_format} output requires 'pyarrow' to be installed.")
+
+    if output_format == "netcdf" and netCDF4 is None:
+        raise Exception("Writing netcdf output requires 'netCDF4' to be installed.")
+
+
+# Arrow types of the column types of `reader.get_column_type`
+ARROW_TYPES = {"datetime": "timestamp[s]", "int": "int64", "float": "float64", "str": "string"}
+
+
+def _to_arrow(values, missing, typ):
+    "Returns a column converted by `reader._convert` as an Arrow array of type `typ`."
+    if pa.types.is_string(typ):
+        return pa.array(values, typ)
+
+    return pa.array(values, typ, mask=missing, from_pandas=True)
+
+
+def _typed_batches(lines, names, batch_rows):
+    """
+    Generator that yields the Arrow schema of the `names` columns, then the `lines`
+    (rows of text, as from the scan) as Arrow tables of up to `batch_rows` rows.
+    """
+    from midas_extract import reader
+
+    types = [reader.get_column_type(name) for name in names]
+    schema = pa.schema([pa.field(name, pa.type_for_alias(ARROW_TYPES[typ]))
+                        for name, typ in zip(names, types)])
+
+    yield schema
+
+    for columns in reader._columns(iter(lines), names, types, batch_rows):
+        arrays = [_to_arrow(values, missing, field.type)
+                  for (values, missing), field in zip(columns, schema)]
+        yield pa.Table.from_arrays(arrays, schema=schema)
+
+
+def write_parquet(lines, outputPath, names, compress=None, level=None,
+                  batch_rows=DEFAULT_BATCH_ROWS):
+    batches = _typed_batches(lines, names, batch_rows)
+    count = 0
+
+    with pq.ParquetWriter(outputPath, next(batches), compression=compress or "snappy",
+                          compression_level=level) as writer:
+        for table in batches:
+            writer.write_table(table, row_group_size=batch_rows)
+            count += table.num_rows
+
+    return count
+
+
+def write_feather(lines, outputPath, names, compress=None, level=None,
+                  batch_rows=DEFAULT_BATCH_ROWS):
+    if compress == "gzip":
+        raise Exception("Feather output can only be compressed with zstd.")
+
+    batches = _typed_batches(lines, names, batch_rows)
+    options = pa.ipc.IpcWriteOptions(
+        compression=pa.Codec(compress, level) if compress else None)
+    count = 0
+
+    with pa.OSFile(outputPath, "wb") as sink, \
+            pa.ipc.new_file(sink, next(batches), options=options) as writer:
+        for table in batches:
+            writer.write_table(table)
+            count += table.num_rows
+
+    return count
+
+
+def _netcdf_values(arr):
+    "Returns typed Arrow array `arr` as a NumPy (masked) array for a NetCDF variable."
+    if pa.types.is_string(arr.type):
+        return np.array(pc.fill_null(arr, "").to_pylist(), dtype=object)
+
+    if pa.types.is_timestamp(arr.type):
+        arr = arr.cast(pa.int64())
+
+    if pa.types.is_floating(arr.type):
+        return arr.to_numpy(zero_copy_only=False)
+
+    values = pc.fill_null(arr, 0).to_numpy()
+    return np.ma.masked_array(values, mask=arr.is_null().to_numpy(zero_copy_only=False))
+
+
+def write_netcdf(lines, outputPath, names, compress=None, level=None,
+                 batch_rows=DEFAULT_BATCH_ROWS):
+    if compress == "zstd":
+        raise Exception("NetCDF output can only be compressed with gzip.")
+
+    batches = _typed_batches(lines, names, batch_rows)
+    schema = next(batches)
+    count = 0
+
+    with netCDF4.Dataset(outputPath, "w", format="NETCDF4") as dataset:
+        dataset.createDimension("row", None)
+        variables = []
+
+        for field in schema:
+            if pa.types.is_string(field.type):
+                variable = dataset.createVariable(field.name, str, ("row",))
+            elif pa.types.is_floating(field.type):
+                variable = dataset.createVariable(field.name, "f8", ("row",), zlib=bool(compress),
+                                                  complevel=level or 4, fill_value=np.nan)
+            else:
+                variable = dataset.createVariable(field.name, "i8", ("row",), zlib=bool(compress),
+                                                  complevel=level or 4)
+
+            if pa.types.is_timestamp(field.type):
+                variable.units = _EPOCH
+
+            variables.append(variable)
+
+        for table in batches:
+            for variable, column in zip(variables, table.columns):
+                variable[count:count + table.num_rows] = _netcdf_values(column.combine_chunks())
+
+            count += table.num_rows
+
+    return count
+
+
+_WRITERS = {"parquet": write_parquet, "feather": write_feather, "netcdf": write_netcdf}
+
+
+def write_output(lines, outputPath, names, output_format, compress=None, level=None,
+                 batch_rows=None):
+    """
+    Writes the `lines` (rows of text, as from `MIDASSubsetter.iterLines` or a file
+    written by a scan) to `outputPath` in `output_format` ("parquet", "feather" or "netcdf"), with columns called
+    `names`. `compress` ("gzip" or "zstd") and `level` set the compression used
+    within the file. Batches are of `batch_rows` rows (default:
+    `DEFAULT_BATCH_ROWS`). Returns the number of rows written.
+    """
+    if output_format not in _WRITERS:
+        raise Exception(f"Output format not known: {output_format}")
+
+    _require(output_format)
+    batch_rows = batch_rows or DEFAULT_BATCH_ROWS
+    tmp_path = f"{outputPath}.{os.getpid()}.tmp"
+
+    try:
+        count = _WRITERS[output_format](lines, tmp_path, names, compress=compress, level=level,
+                                        batch_rows=batch_rows)
+        os.replace(tmp_path, outputPath)
+
+    finally:
+        if os.path.isfile(tmp_path):
+            os.unlink(tmp_path)
+
+    return count
@@ -0,0 +1,312 @@
+"""
+indexing.py
+===========
+
+Sparse sidecar indexes for MIDAS partition files.
+
+Each yearly partition file can have an index file (``<partition>.idx``) that
+records the byte offset at the start of every block of ``block_lines`` lines
+along with the time range of the observations held in each block. The
+subsetter uses it to seek straight to the first block that can hold the
+requested start time rather than reading the file from byte 0.
+
+Where the table has a ``src_id`` column the index also holds a posting list for
+each station: the runs of blocks that contain its rows. Station-filtered
+extractions read only those blocks and skip files holding none of the requested
+stations.
+
+An index records the size and modification time of the file it describes and
+is ignored (treated as stale) if either has changed.
+
+Indexes are written alongside the partition files unless the ``MIDAS_INDEX_DIR``
+environment variable is set.
+
+"""
+
+import os
+import json
+import bisect
+
+
+from midas_extract import settings
+from midas_extract import catalogue
+from midas_extract import compression
+
+
+INDEX_VERSION = 2
+DEFAULT_BLOCK_LINES = 1000
+
+
+def get_index_path(data_file):
+    """
+    Returns the path of the sidecar index file for `data_file`.
+    """
+    index_dir = settings.get_index_dir()
+    index_name = os.path.basename(data_file) + ".idx"
+
+    if index_dir:
+        return os.path.join(index_dir, index_name)
+
+    return data_file + ".idx"
+
+
+def file_signature(data_file):
+    "Returns a tuple of (size, mtime_ns) used to detect changes to `data_file`."
+    st = os.stat(data_file)
+    return st.st_size, st.st_mtime_ns
+
+
+def _to_runs(blocks):
+    "Returns a sorted list of block numbers as a list of inclusive [first, last] runs."
+    runs = []
+
+    for b in blocks:
+        if runs and runs[-1][1] == b - 1:
+            runs[-1][1] = b
+        else:
+            runs.append([b, b])
+
+    return runs
+
+
+def build_index(data_file, time_of, block_lines=DEFAULT_BLOCK_LINES, src_of=None):
+    """
+    Builds, writes and returns the index for `data_file`.
+
+    `time_of` is a callable that takes a (stripped) line and returns its time
+    as an integer of the form YYYYMMDDhhmm, or None if it has no time.
+
+    If `src_of` is given it is a callable that takes a (stripped) line and returns
+    its src_id as a string; it is used to build the station posting lists.
+    """
+    postings = {}
+    offsets = []
+    prefix_max = []
+    block_min = []
+    block_max = []
+
+    size, mtime_ns = file_signature(data_file)
+    running_max = 0
+    offset = 0
+    lcount = 0
+
+    with open(data_file, "rb") as reader:
+
+        for raw in reader:
+
+            if lcount % block_lines == 0:
+                offsets.append(offset)
+                prefix_max.append(running_max)
+                block_min.append(None)
+                block_max.append(None)
+
+            lcount += 1
+            offset += len(raw)
+            line = raw.decode().strip()
+
+            src_id = src_of(line) if src_of else None
+
+            if src_id is not None:
+                blocks = postings.setdefault(src_id, [])
+                if not blocks or blocks[-1] != len(offsets) - 1:
+                    blocks.append(len(offsets) - 1)
+
+            tm = time_of(line)
+            if tm is None:
+                continue
+
+            if block_min[-1] is None or tm < block_min[-1]:
+                block_min[-1] = tm
+            if block_max[-1] is None or tm > block_max[-1]:
+                block_max[-1] = tm
+
+            running_max = max(running_max, tm)
+
+    index = {"version": INDEX_VERSION, "size": size, "mtime_ns": mtime_ns,
+             "block_lines": block_lines, "offsets": offsets, "prefix_max": prefix_max,
+             "block_min": block_min, "block_max": block_max}
+
+    if src_of:
+        index["postings"] = {src_id: _to_runs(blocks) for src_id, blocks in postings.items()}
+
+    index_path = get_index_path(data_file)
+    index_dir = os.path.dirname(index_path)
+
+    if index_dir and not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+
+    # Write to a temporary name then rename so readers never see a partial index
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as writer:
+        json.dump(index, writer)
+
+    os.replace(tmp_path, index_path)
+    return index
+
+
+def is_stale(index, data_file):
+    """
+    Returns a boolean. True if `index` no longer describes `data_file`.
+    """
+    if index.get("version") != INDEX_VERSION:
+        return True
+
+    return (index["size"], index["mtime_ns"]) != file_signature(data_file)
+
+
+def load_index(data_file):
+    """
+    Returns the index for `data_file`, or None if it does not exist or is stale.
+    Compressed partition files are not indexed.
+    """
+    if compression.is_compressed(data_file):
+        return None
+
+    index_path = get_index_path(data_file)
+
+    if not os.path.isfile(index_path):
+        return None
+
+    try:
+        with open(index_path) as reader:
+            index = json.load(reader)
+    except ValueError:
+        return None
+
+    if is_stale(index, data_file):
+        return None
+
+    return index
+
+
+def find_start_block(index, start_time):
+    """
+    Returns the number of the first block that can hold a line at or after
+    `start_time`. Every line in the blocks before it is earlier than `start_time`,
+    whether or not the file is sorted.
+    """
+    return max(bisect.bisect_left(index["prefix_max"], start_time) - 1, 0)
+
+
+def find_start_offset(index, start_time):
+    """
+    Returns the byte offset from which a scan for `start_time` should begin.
+    """
+    if not index["offsets"]:
+        return 0
+
+    return index["offsets"][find_start_block(index, start_time)]
+
+
+def find_end_block(index, end_time):
+    """
+    Returns the number of the last block that can hold a line at or before
+    `end_time`, or -1 if there is none. Every line in the blocks after it is later
+    than `end_time`, whether or not the file is sorted.
+    """
+    block_min = index["block_min"]
+
+    for b in range(len(block_min) - 1, -1, -1):
+        if block_min[b] is not None and block_min[b] <= end_time:
+            return b
+
+    return -1
+
+
+def find_time_run(index, start_time, end_time):
+    """
+    Returns a (byte_offset, line_count, end_offset) tuple covering every block that
+    may hold lines between `start_time` and `end_time`, or None if no block can.
+    `line_count` and `end_offset` are None if the run extends to the end of the file.
+    """
+    offsets = index["offsets"]
+
+    if not offsets:
+        return (0, None, None)
+
+    first_block = find_start_block(index, start_time)
+    last_block = find_end_block(index, end_time)
+
+    if last_block < first_block:
+        return None
+
+    if last_block + 1 == len(offsets):
+        return (offsets[first_block], None, None)
+
+    return (offsets[first_block], (last_block - first_block + 1) * index["block_lines"],
+            offsets[last_block + 1])
+
+
+def find_station_runs(index, src_ids, start_time, end_time):
+    """
+    Returns a list of (byte_offset, line_count, end_offset) tuples covering every
+    block that may hold rows for any of `src_ids` between `start_time` and
+    `end_time`. `end_offset` is None if the run extends to the end of the file. An
+    empty list means that the file holds no relevant rows.
+
+    Returns None if `index` has no posting lists.
+    """
+    if "postings" not in index:
+        return None
+
+    postings = index["postings"]
+    first_block = find_start_block(index, start_time)
+    blocks = set()
+
+    for src_id in src_ids:
+        for (b0, b1) in postings.get(src_id, []):
+            blocks.update(range(max(b0, first_block), b1 + 1))
+
+    block_min = index["block_min"]
+    block_max = index["block_max"]
+    blocks = [b for b in sorted(blocks)
+              if block_min[b] is not None and block_min[b] <= end_time and block_max[b] >= start_time]
+
+    offsets = index["offsets"]
+    block_lines = index["block_lines"]
+    runs = []
+
+    for (b0, b1) in _to_runs(blocks):
+        end_offset = offsets[b1 + 1] if b1 + 1 < len(offsets) else None
+        runs.append((offsets[b0], (b1 - b0 + 1) * block_lines, end_offset))
+
+    return runs
+
+
+def build_table_indexes(table, region=None, block_lines=DEFAULT_BLOCK_LINES, verbose=True):
+    """
+    Builds the index for every partition file in `table`. Returns a list of the
+    index file paths written.
+    """
+    from midas_extract import subsetter
+
+    tableID = subsetter.tableMatch(table.upper())[0]
+    datePattern = subsetter.getDatePattern(tableID)
+    partitionFiles = catalogue.get_partition_files(tableID, region)
+
+    def time_of(line):
+        return subsetter.dateMatch(line, datePattern)
+
+    try:
+        srcidIndex = subsetter.getColumnIndex(tableID, "src_id")
+    except Exception:
+        src_of = None
+    else:
+        def src_of(line):
+            return subsetter.srcIdOf(line, srcidIndex)
+
+    written = []
+
+    for fname in partitionFiles:
+        if compression.is_compressed(fname):
+            if verbose:
+                print(f"Skipping compressed file: {fname}")
+            continue
+
+        if verbose:
+            print(f"Indexing: {fname}")
+
+        build_index(fname, time_of, block_lines=block_lines, src_of=src_of)
+        written.append(get_index_path(fname))
+
+    return written
@@ -0,0 +1,123 @@
+"""
+metrics.py
+==========
+
+Performance metrics of extractions and station searches.
+
+Each `MIDASSubsetter` and `StationIDGetter` run collects a `Metrics` object (kept
+as its `metrics` attribute) holding the time spent in each stage of the run and
+counts of the work done. Stage times are exclusive: time spent in a stage
+entered from within another is only counted once, in the inner stage.
+
+`emit` passes the metrics to a callback or writes them as a JSON document:
+
+    {"kind": "extract", "total_seconds": 1.52,
+     "stages": {"discovery": 0.01, "listing": 0.04, "scan": 1.21, "temp_write": 0.02,
+                "output_write": 0.24},
+     "counts": {"bytes_read": 52428800, "lines_scanned": 700800, "lines_matched": 2920,
+                "files_read": 1, "files_pruned": 2},
+     "peak_rss_bytes": 88342528}
+
+`peak_rss_bytes` is the peak resident memory of the process (or of its largest
+finished worker process) so far.
+
+"""
+
+import sys
+import json
+import time
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size in bytes of this process or its largest
+    finished child process, or None where that is not known.
+    """
+    if resource is None:
+        return None
+
+    # Linux reports kilobytes, macOS bytes
+    scale = 1 if sys.platform == "darwin" else 1024
+
+    return scale * max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                       resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+class Metrics:
+    """
+    Stage timings and counts for one run of kind `kind` (e.g. "extract"). The
+    `stages` and `counters` named are always reported, even if unused.
+    """
+
+    def __init__(self, kind, stages=(), counters=()):
+        self.kind = kind
+        self.timings = dict.fromkeys(stages, 0.0)
+        self.counts = dict.fromkeys(counters, 0)
+
+        self._started = time.perf_counter()
+        self._stopped = None
+        # Time spent in inner stages of each stage that is running
+        self._inner = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        "Context manager that adds the time spent in it to stage `name`."
+        start = time.perf_counter()
+        self._inner.append(0.0)
+
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            inner = self._inner.pop()
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed - inner
+
+            if self._inner:
+                self._inner[-1] += elapsed
+
+    def add(self, counts=None, **kwargs):
+        "Adds the numbers in dictionary `counts` (and keyword arguments) to the counts."
+        for items in (counts or {}, kwargs):
+            for name, value in items.items():
+                self.counts[name] = self.counts.get(name, 0) + value
+
+    def stop(self):
+        "Marks the end of the run."
+        self._stopped = time.perf_counter()
+
+    @property
+    def total(self):
+        "Returns the seconds from the start to the end (or so far) of the run."
+        return (self._stopped or time.perf_counter()) - self._started
+
+    def as_dict(self):
+        return {"kind": self.kind, "total_seconds": round(self.total, 6),
+                "stages": {name: round(seconds, 6) for name, seconds in self.timings.items()},
+                "counts": dict(self.counts), "peak_rss_bytes": peak_rss()}
+
+
+def emit(metrics, stats=None):
+    """
+    Reports `metrics` as requested by `stats`: None (not reported), "json" (written
+    as a JSON document on a line of standard error) or a function, which is called
+    with the dictionary of the metrics.
+    """
+    metrics.stop()
+
+    if stats is None:
+        return
+
+    if callable(stats):
+        stats(metrics.as_dict())
+
+    elif stats == "json":
+        print(json.dumps(metrics.as_dict()), file=sys.stderr, flush=True)
+
+    else:
+        raise Exception(f"Stats output not known: {stats}")
@@ -0,0 +1,111 @@
+"""
+paging.py
+=========
+
+Continuation tokens for extractions that are read a page at a time.
+
+An extraction with a row limit stops as soon as it has written that many rows
+and returns a continuation token (a "cursor") recording the partition file and
+byte offset where it stopped. Passing the cursor to the same request resumes the
+scan at that point, so earlier data are not scanned again.
+
+Cursors are opaque strings. They also record the request and the size and
+modification time of the file, and are refused for a different request or once
+the file has changed. Compressed files cannot seek, so they are decompressed up
+to the offset (but not filtered) to resume.
+
+"""
+
+import os
+import json
+import base64
+
+
+from midas_extract import compression
+
+
+CURSOR_VERSION = 1
+
+# Number of bytes decompressed at a time when skipping to an offset
+_SKIP_BYTES = 1024 ** 2
+
+
+def make_cursor(request_key, filename, offset):
+    """
+    Returns a cursor for resuming request `request_key` (see `cache.make_key`) at
+    byte `offset` of partition file `filename`.
+    """
+    st = os.stat(filename)
+    state = {"v": CURSOR_VERSION, "request": request_key, "file": filename, "offset": offset,
+             "size": st.st_size, "mtime": st.st_mtime_ns}
+
+    return base64.urlsafe_b64encode(json.dumps(state).encode()).decode().rstrip("=")
+
+
+def parse_cursor(cursor, request_key, fileList):
+    """
+    Returns a tuple of (index, offset): the position in `fileList` of the file
+    where `cursor` resumes request `request_key`, and the byte offset in it.
+    Raises an Exception if the cursor is not valid for the request.
+    """
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        filename = state["file"]
+        offset = int(state["offset"])
+    except (ValueError, KeyError, TypeError):
+        raise Exception("Continuation token not understood.")
+
+    if state.get("v") != CURSOR_VERSION or state.get("request") != request_key:
+        raise Exception("Continuation token does not belong to this request.")
+
+    if filename not in fileList:
+        raise Exception(f"Continuation token refers to a file not read by this request: "
+                        f"{filename}")
+
+    st = os.stat(filename)
+    if (st.st_size, st.st_mtime_ns) != (state.get("size"), state.get("mtime")):
+        raise Exception(f"Continuation token is out of date: {filename} has changed.")
+
+    return fileList.index(filename), offset
+
+
+def _skip(reader, nbytes):
+    "Reads and discards `nbytes` bytes from `reader`."
+    while nbytes > 0:
+        data = reader.read(min(nbytes, _SKIP_BYTES))
+
+        if not data:
+            return
+        nbytes -= len(data)
+
+
+def read_lines(filename, runs, offset=0):
+    """
+    Generator that yields a tuple of (line, end) for each line of partition file
+    `filename` in `runs` (see `subsetter.partitionRuns`) from byte `offset` on,
+    where `end` is the byte offset just past the line.
+    """
+    compressed = compression.is_compressed(filename)
+
+    with compression.open_partition(filename, "rb") as reader:
+        pos = 0
+
+        for (start, _, end) in runs:
+            if end is not None and end <= offset:
+                continue
+
+            start = max(start, offset)
+
+            if compressed:
+                _skip(reader, start - pos)
+            elif start != pos:
+                reader.seek(start)
+
+            pos = start
+
+            for raw in reader:
+                pos += len(raw)
+                yield raw.decode(), pos
+
+                if end is not None and pos >= end:
+                    break
@@ -0,0 +1,291 @@
+"""
+planner.py
+==========
+
+Chooses how an extraction is carried out.
+
+`plan_extraction` takes a table, time range, src_ids, columns and conditions and
+returns an `ExtractionPlan` that records, for each partition file:
+
+    * whether it can be skipped entirely: its name lies outside the time range, or
+      its index or columnar copy shows that it holds no matching rows;
+    * the scan engine used to read it (the columnar copy if one is up to date, the
+      subset engine if columns or conditions are applied, otherwise the text or
+      memory-mapped engine);
+    * the part of the file that is read (index seek, station posting lists, row
+      group statistics or a scan from the start of the file), with estimates of the
+      bytes and rows read.
+
+Time and src_id filters are always applied first (using the index or row group
+statistics to skip data where possible); value conditions are then sorted so the
+cheapest and most selective are evaluated first. The plan also sets the number of
+worker processes used.
+
+`ExtractionPlan.explain` returns a text description of the plan, as printed by
+``midas_extract extract --explain``.
+
+"""
+
+import os
+
+
+from midas_extract import indexing
+from midas_extract import columnar
+from midas_extract import compression
+
+
+# Scans that read less than this are run in a single process unless workers are set
+PARALLEL_MIN_BYTES = 64 * 1024 ** 2
+
+# Number of bytes read from the start of a file to estimate its mean line length
+_SAMPLE_BYTES = 65536
+
+
+class FileStep:
+    """
+    The plan for reading one partition file.
+    """
+
+    def __init__(self, filename, engine, access, nbytes, rows):
+        self.filename = filename
+        self.engine = engine
+        self.access = access
+        self.bytes = nbytes
+        self.rows = rows
+
+
+class ExtractionPlan:
+    """
+    The chosen plan for an extraction: the files to read (as `FileStep`s), the files
+    skipped (as a list of (filename, reason) tuples), the predicates in evaluation
+    order and the number of worker processes.
+    """
+
+    def __init__(self, tableID, startTimeLong, endTimeLong, src_ids=None, columnNames=None,
+                 conditions=None, steps=None, pruned=None, workers=1):
+        self.tableID = tableID
+        self.startTimeLong = startTimeLong
+        self.endTimeLong = endTimeLong
+        self.src_ids = src_ids
+        self.columnNames = columnNames
+        self.conditions = conditions
+        self.steps = steps or []
+        self.pruned = pruned or []
+        self.workers = workers
+
+    @property
+    def fileList(self):
+        "Returns a list of the partition files to read, in order."
+        return [step.filename for step in self.steps]
+
+    @property
+    def engines(self):
+        "Returns a dictionary of {<filename>: <engine>}."
+        return {step.filename: step.engine for step in self.steps}
+
+    @property
+    def bytes(self):
+        return sum(step.bytes for step in self.steps)
+
+    @property
+    def rows(self):
+        return sum(step.rows for step in self.steps)
+
+    def predicates(self):
+        "Returns a list of descriptions of the predicates, in evaluation order."
+        predicates = [f"time between {self.startTimeLong} and {self.endTimeLong}"]
+
+        if self.src_ids:
+            predicates.append(f"src_id in {len(self.src_ids)} station(s): " +
+                              ", ".join(str(src_id).strip() for src_id in self.src_ids[:10]) +
+                              (", ..." if len(self.src_ids) > 10 else ""))
+
+        if self.conditions:
+            predicates.extend(self.conditions.describe())
+
+        return predicates
+
+    def explain(self):
+        "Returns a text description of the plan."
+        columns = ", ".join(self.columnNames) if self.columnNames else "all"
+
+        lines = [f"Extraction plan for table: {self.tableID}",
+                 f"  Columns: {columns}",
+                 "  Predicates (in evaluation order):"]
+        lines.extend(f"    {i}. {predicate}" for i, predicate in enumerate(self.predicates(), 1))
+
+        lines.append(f"  Files to read: {len(self.steps)} (skipped: {len(self.pruned)})")
+
+        for step in self.steps:
+            lines.append(f"    {os.path.basename(step.filename)}: engine={step.engine}, "
+                         f"{step.access}, ~{_format_bytes(step.bytes)}, ~{step.rows} rows")
+
+        for (filename, reason) in self.pruned:
+            lines.append(f"    {os.path.basename(filename)}: skipped ({reason})")
+
+        lines.append(f"  Worker processes: {self.workers}")
+        lines.append(f"  Estimated read: {len(self.steps)} file(s), ~{_format_bytes(self.bytes)}, "
+                     f"~{self.rows} rows")
+
+        return "\n".join(lines)
+
+
+def _format_bytes(nbytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if nbytes < 1024 or unit == "GB":
+            return f"{nbytes:.0f} {unit}" if unit == "B" else f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+
+
+def _mean_line_length(filename):
+    """
+    Returns the mean length of the lines at the start of `filename`, in bytes of the
+    file (so compressed bytes, for a compressed file).
+    """
+    (sample, consumed) = compression.sample(filename, _SAMPLE_BYTES)
+
+    nlines = sample.count(b"\n")
+    return consumed / nlines if nlines else max(consumed, 1)
+
+
+def _months(timeLong):
+    "Returns an integer time YYYYMMDDhhmm as a (fractional) number of months."
+    year, month, day = timeLong // 100000000, timeLong // 1000000 % 100, timeLong // 10000 % 100
+    return year * 12 + month - 1 + (day - 1) / 31
+
+
+def _scan_fraction(span, endTimeLong):
+    """
+    Returns the fraction of a partition file covering the months in `span` that is
+    read by a scan from its start that stops once times pass `endTimeLong`.
+    """
+    (startYM, endYM) = span
+    first = _months(startYM * 1000000 + 10000)
+    last = _months(endYM * 1000000 + 10000) + 1
+    return min(max((_months(endTimeLong) - first) / (last - first), 0), 1)
+
+
+def choose_engine(filename, subset=False, engine="auto", use_store=True):
+    """
+    Returns the name of the scan engine to use for partition file `filename`:
+    "columnar" if an up-to-date columnar copy of the file exists, else "subset" if
+    columns or conditions are applied, else `engine` ("mmap" if it is "auto").
+    Compressed files cannot be memory-mapped so are read with the "text" engine.
+    """
+    if use_store and columnar.has_store(filename):
+        return "columnar"
+
+    if subset:
+        return "subset"
+
+    if compression.is_compressed(filename):
+        return "text"
+
+    if engine == "auto":
+        return "mmap"
+
+    return engine
+
+
+def _plan_file(partition, startTimeLong, endTimeLong, src_ids, srcidIndex, subset, engine,
+               use_index, use_store):
+    """
+    Returns a `FileStep` for `partition` (a `catalogue` entry), or a string giving
+    the reason why it need not be read.
+    """
+    filename = partition["path"]
+    engine = choose_engine(filename, subset, engine, use_store)
+
+    if engine == "columnar":
+        (selected, total, rows, nbytes) = columnar.estimate_scan(
+            filename, startTimeLong, endTimeLong, src_ids, srcidIndex)
+
+        if not selected:
+            return "columnar statistics: no matching row groups"
+
+        return FileStep(filename, engine, f"row groups {selected}/{total}", nbytes, rows)
+
+    size = partition["size"]
+    index = indexing.load_index(filename) if use_index else None
+
+    if index:
+        runs = None
+
+        if src_ids:
+            runs = indexing.find_station_runs(index, [str(s).strip() for s in src_ids],
+                                              startTimeLong, endTimeLong)
+            access = "station posting lists"
+
+            if runs == []:
+                return "index: no blocks hold the requested stations in the time range"
+
+        if runs is None:
+            run = indexing.find_time_run(index, startTimeLong, endTimeLong)
+            access = "index seek"
+
+            if run is None:
+                return "index: no blocks hold the time range"
+
+            runs = [run]
+
+        nbytes = sum((size if end is None else end) - offset for (offset, _, end) in runs)
+        access = f"{access} ({len(runs)} run(s))"
+
+    else:
+        nbytes = int(size * _scan_fraction((partition["start"], partition["end"]), endTimeLong))
+        access = "scan from start"
+
+        if partition.get("compression"):
+            access = f"{access} ({partition['compression']} stream)"
+
+    return FileStep(filename, engine, access, nbytes, int(nbytes / _mean_line_length(filename)))
+
+
+def plan_extraction(tableID, partitions, startTimeLong, endTimeLong, src_ids=None,
+                    srcidIndex=None, columnNames=None, conditions=None, subset=False,
+                    use_index=True, use_store=True, engine="auto", workers=None):
+    """
+    Returns an `ExtractionPlan` for extracting rows from `partitions` (a list of
+    entries from the partition catalogue, see `catalogue.get_partitions`) of table
+    `tableID` between `startTimeLong` and `endTimeLong` (integers YYYYMMDDhhmm).
+
+    `srcidIndex` is the index of the src_id column (needed if `src_ids` are given),
+    `columnNames` the names of the selected columns (or None for all) and
+    `conditions` a `conditions.ConditionSet` (which is re-ordered for evaluation).
+    `subset` is True if columns or conditions are applied to the rows.
+
+    `engine` is the scan engine for complete rows ("auto", "text" or "mmap"). If
+    `workers` is None then partition files are filtered in parallel (by up to one
+    process per CPU) only if the estimated read is at least `PARALLEL_MIN_BYTES`.
+    """
+    startYM = startTimeLong // 1000000
+    endYM = endTimeLong // 1000000
+    steps = []
+    pruned = []
+
+    for partition in partitions:
+
+        if partition["end"] < startYM or partition["start"] > endYM:
+            pruned.append((partition["path"], "file name outside time range"))
+            continue
+
+        step = _plan_file(partition, startTimeLong, endTimeLong, src_ids, srcidIndex, subset,
+                          engine, use_index, use_store)
+
+        if isinstance(step, str):
+            pruned.append((partition["path"], step))
+        else:
+            steps.append(step)
+
+    if conditions:
+        conditions.order()
+
+    if workers is None:
+        big = sum(step.bytes for step in steps) >= PARALLEL_MIN_BYTES
+        workers = min(os.cpu_count() or 1, len(steps)) if big else 1
+
+    workers = max(min(int(workers), len(steps)), 1)
+
+    return ExtractionPlan(tableID, startTimeLong, endTimeLong, src_ids=src_ids,
+                          columnNames=columnNames, conditions=conditions, steps=steps,
+                          pruned=pruned, workers=workers)
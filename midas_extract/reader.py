@@ -0,0 +1,188 @@
+"""
+reader.py
+=========
+
+Reads extractions into pandas DataFrames or NumPy structured arrays.
+
+`read_table` takes the same request as `MIDASSubsetter` and converts the rows
+straight from the partition scan (see `subsetter.iter_records`) into typed
+columns, in chunks of at most `chunksize` rows, so no text output is written or
+parsed again.
+
+The columns are named from the table structure (``table_structures/<ID>TB.txt``)
+and typed by `get_column_type`: "datetime" (parsed to ``datetime64[s]``), "int",
+"float" or "str". Empty values are NaT, NaN or (for "int" columns) missing: <NA>
+in pandas or `MISSING_INT` in NumPy.
+
+DataFrames require `pandas`.
+
+"""
+
+import itertools
+
+import numpy as np
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+
+from midas_extract.subsetter import MIDASSubsetter
+
+
+# Types of columns that are not typed by the rules in `get_column_type`
+COLUMN_TYPES = {
+    "src_id": "int", "id": "int", "version_num": "int", "rec_st_ind": "int",
+    "ob_hour_count": "int", "ob_day_cnt": "int", "id_type": "str", "met_domain_name": "str",
+    "ob_end_ctime": "str", "src_opr_type": "int", "midas_stmp_etime": "int",
+}
+
+# Stands for an empty value in an "int" column of a NumPy array
+MISSING_INT = np.iinfo(np.int64).min
+
+DTYPES = {"datetime": "datetime64[s]", "int": np.int64, "float": np.float64, "str": object}
+
+OUTPUTS = ("pandas", "numpy")
+
+
+def get_column_type(name):
+    """
+    Returns the type of the column called `name`: its entry in `COLUMN_TYPES`, else
+    "datetime" for times and dates, "int" for quality codes and ids, "str" for
+    journal flags, otherwise "float" (measurements).
+    """
+    if name in COLUMN_TYPES:
+        return COLUMN_TYPES[name]
+
+    if name.endswith(("_time", "_date")):
+        return "datetime"
+    if name.endswith(("_q", "_id")):
+        return "int"
+    if name.endswith("_j"):
+        return "str"
+
+    return "float"
+
+
+def _convert(name, values, typ):
+    """
+    Returns a tuple of (array, missing) holding text `values` (a NumPy string array)
+    converted to `typ`, where `missing` is a boolean array of the empty values (or
+    None for "datetime" and "str" columns).
+    """
+    if typ == "str":
+        return values.astype(object), None
+
+    try:
+        if typ == "datetime":
+            return values.astype(DTYPES[typ]), None
+
+        missing = values == ""
+
+        if typ == "float":
+            return np.where(missing, "nan", values).astype(np.float64), None
+
+        return np.where(missing, "0", values).astype(np.int64), missing
+
+    except ValueError as exc:
+        raise Exception(f"Cannot read column '{name}' as {typ}: {exc}")
+
+
+def _to_frame(names, columns):
+    data = {}
+
+    for name, (values, missing) in zip(names, columns):
+        if missing is not None:
+            values = pd.arrays.IntegerArray(values, missing)
+        data[name] = values
+
+    return pd.DataFrame(data, columns=names)
+
+
+def _to_array(names, types, columns):
+    dtype = np.dtype([(name, DTYPES[typ]) for name, typ in zip(names, types)])
+    nrows = len(columns[0][0]) if columns else 0
+    array = np.empty(nrows, dtype=dtype)
+
+    for name, (values, missing) in zip(names, columns):
+        if missing is not None:
+            values = np.where(missing, MISSING_INT, values)
+        array[name] = values
+
+    return array
+
+
+def _columns(lines, names, types, chunksize):
+    """
+    Generator that yields the `lines` in chunks of up to `chunksize` rows, each as a
+    list of the (array, missing) tuples of its columns (see `_convert`).
+    """
+    ncols = len(names)
+
+    while True:
+        chunk = list(itertools.islice(lines, chunksize))
+
+        if not chunk:
+            return
+
+        rows = [(line.split(",") + [""] * ncols)[:ncols] for line in chunk]
+        fields = np.char.strip(np.array(rows, dtype=str))
+        yield [_convert(name, fields[:, i], typ)
+               for i, (name, typ) in enumerate(zip(names, types))]
+
+
+def _chunks(lines, names, types, chunksize, output):
+    "Generator that yields the `lines` as typed chunks of up to `chunksize` rows."
+    for columns in _columns(lines, names, types, chunksize):
+        yield _to_frame(names, columns) if output == "pandas" else \
+            _to_array(names, types, columns)
+
+
+def _empty(names, types, output):
+    columns = [_convert(name, np.array([], dtype=str), typ) for name, typ in zip(names, types)]
+    return _to_frame(names, columns) if output == "pandas" else _to_array(names, types, columns)
+
+
+def read_table(table, start=None, end=None, src_ids=None, columns="all", conditions=None,
+               region=None, chunksize=None, output="pandas", dtypes=None, use_index=True,
+               use_store=True):
+    """
+    Reads the rows of an extraction (with the arguments of `MIDASSubsetter`) into a
+    pandas DataFrame, or a NumPy structured array if `output` is "numpy".
+
+    If `chunksize` is given then an iterator of DataFrames (or arrays) of up to that
+    many rows is returned instead, each converted as the rows arrive from the scan.
+    `dtypes` is a dictionary of column names and types ("datetime", "int", "float"
+    or "str") that override those from `get_column_type`.
+    """
+    if output not in OUTPUTS:
+        raise Exception(f"Output type not known: {output}")
+
+    if output == "pandas" and pd is None:
+        raise Exception("Reading DataFrames requires 'pandas' to be installed.")
+
+    if chunksize is not None and int(chunksize) < 1:
+        raise Exception(f"Chunk size must be at least 1: {chunksize}")
+
+    subsetter = MIDASSubsetter(table, None, start, end, columns, conditions, src_ids, region,
+                               verbose=False, use_index=use_index, use_store=use_store,
+                               run=False)
+    names = subsetter.rowHeaders
+    types = [(dtypes or {}).get(name) or get_column_type(name) for name in names]
+
+    for name, typ in zip(names, types):
+        if typ not in DTYPES:
+            raise Exception(f"Column type not known for '{name}': {typ}")
+
+    chunks = _chunks(subsetter.iterLines(), names, types,
+                     int(chunksize) if chunksize else None, output)
+
+    if chunksize:
+        return chunks
+
+    # Without a chunk size all the rows are read as one chunk
+    for chunk in chunks:
+        return chunk
+
+    return _empty(names, types, output)
@@ -0,0 +1,245 @@
+"""
+server.py
+=========
+
+A long-running extraction server.
+
+``midas_extract serve`` listens on a Unix socket (``MIDAS_SERVER_SOCKET``) and runs
+extraction and station jobs in a bounded pool of worker threads. Because the
+process stays up, the partition catalogues, indexes and station database (with
+its capability arrays) stay loaded between jobs, and each request skips
+interpreter start-up.
+
+Protocol: the client sends one JSON line:
+
+    {"command": <"ping"|"extract"|"stations">, "args": {...}}
+
+and the server replies with one JSON line, either ``{"status": "ok", ...}`` or
+``{"status": "error", "message": <text>}``. For a successful "extract" or
+"stations" job the header is followed by the output of the job, streamed in
+chunks (the rows of an extraction as they are scanned), until the server closes
+the connection. See `midas_extract.client`.
+
+"""
+
+import os
+import json
+import socket
+import contextlib
+import itertools
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+
+
+from midas_extract import settings
+from midas_extract import catalogue
+from midas_extract import stationdb
+from midas_extract.subsetter import MIDASSubsetter, nameDict
+from midas_extract.stations import StationIDGetter
+
+
+PROTOCOL_VERSION = 1
+DEFAULT_JOBS = 4
+
+# Environment variables that must match between a client and the server
+ENVIRONMENT = ("MIDAS_DATA_DIR", "MIDAS_METADATA_DIR", "MIDAS_INDEX_DIR", "MIDAS_COLUMNAR_DIR",
+               "MIDAS_CATALOGUE_DIR", "MIDAS_STATIONS_DB", "MIDAS_CACHE_DIR",
+               "MIDAS_CACHE_BYTES")
+
+_CHUNK_BYTES = 1024 ** 2
+
+
+def get_environment():
+    "Returns a dictionary of the settings that determine the results of a job."
+    return {name: os.environ.get(name) for name in ENVIRONMENT}
+
+
+def _ping(args):
+    return {"version": PROTOCOL_VERSION, "pid": os.getpid(), "environment": get_environment()}, b""
+
+
+def _extract(args):
+    """
+    Runs an extraction. If no output file is given then the rows are streamed back
+    to the client as they are scanned (see `_stream`). If "explain" is set then the
+    plan is returned as the output, and nothing is printed by the server.
+    """
+    args = dict(args)
+    explain = args.pop("explain", False)
+    outputPath = args.pop("output_filepath", None)
+    stream = outputPath in (None, "display")
+
+    if stream and (args.get("compress") or args.get("output_format") not in (None, "text")):
+        raise Exception("Compressed or binary output must be written to an output file.")
+
+    subsetter = MIDASSubsetter(args.pop("table"), "display" if stream else outputPath,
+                               args.pop("start", None), args.pop("end", None), verbose=False,
+                               run=not (stream or explain), **args)
+
+    if explain:
+        return {}, (subsetter.plan.explain() + "\n").encode()
+
+    if stream:
+        return _stream(subsetter)
+
+    return {"output": subsetter.outputPath, "cursor": subsetter.next_cursor}, b""
+
+
+def _stream(subsetter):
+    """
+    Starts the scan of `subsetter` (a planned extraction) and returns a tuple of
+    (header, output) where output is an iterator of chunks of bytes: the header
+    line then the rows, with the requested delimiter (only the header line if there
+    are none, as for local output to the display). The first row is read here so
+    that errors opening the files are reported in the header.
+
+    A page of rows (see `paging`) is read in full first, as its continuation token
+    goes in the header.
+    """
+    lines = subsetter.iterLines()
+
+    if subsetter._isPaged():
+        lines = iter(list(lines))
+
+    first = next(lines, None)
+    rows = itertools.chain([first], lines) if first is not None else iter(())
+
+    return {"cursor": subsetter.next_cursor}, _chunks(subsetter, rows)
+
+
+def _chunks(subsetter, lines):
+    "Generator that yields the output of `subsetter` in chunks of about `_CHUNK_BYTES`."
+    chunk = [", ".join(subsetter.rowHeaders) + "\n"]
+    size = 0
+
+    for line in lines:
+        chunk.append(line + "\n")
+        size += len(line) + 1
+
+        if size >= _CHUNK_BYTES:
+            yield "".join(subsetter._reFormatDelimiters(chunk, subsetter.delimiter)).encode()
+            chunk, size = [], 0
+
+    if chunk:
+        yield "".join(subsetter._reFormatDelimiters(chunk, subsetter.delimiter)).encode()
+
+
+def _stations(args):
+    results = StationIDGetter.query_many(args["queries"])
+    return {}, "".join(json.dumps(result) + "\n" for result in results).encode()
+
+
+JOBS = {"ping": _ping, "extract": _extract, "stations": _stations}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    Handles one request: runs the job in the server's pool and streams its output.
+    """
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            job = JOBS[request["command"]]
+        except (ValueError, KeyError, TypeError):
+            return self._send_header({"status": "error", "message": "Request not understood."})
+
+        try:
+            (header, output) = self.server.pool.submit(job, request.get("args") or {}).result()
+        except Exception as exc:
+            return self._send_header({"status": "error", "message": str(exc)})
+
+        self._send_header(dict(header, status="ok"))
+
+        if isinstance(output, bytes):
+            self.wfile.write(output)
+            return
+
+        # The rest of the scan also runs in the pool
+        self.server.pool.submit(self._send_chunks, output).result()
+
+    def _send_chunks(self, chunks):
+        try:
+            for chunk in chunks:
+                self.wfile.write(chunk)
+        finally:
+            chunks.close()
+
+    def _send_header(self, header):
+        self.wfile.write((json.dumps(header) + "\n").encode())
+
+
+class ExtractionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves extraction and station jobs on Unix socket `socket_path`, running at most
+    `jobs` of them at once.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path=None, jobs=DEFAULT_JOBS):
+        self.socket_path = socket_path or settings.get_server_socket()
+
+        if os.path.exists(self.socket_path):
+            _remove_stale_socket(self.socket_path)
+
+        self.pool = ThreadPoolExecutor(max_workers=jobs)
+        socketserver.UnixStreamServer.__init__(self, self.socket_path, _Handler)
+
+        # Only the user running the server may connect
+        os.chmod(self.socket_path, 0o600)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        self.pool.shutdown(wait=False)
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+def _remove_stale_socket(socket_path):
+    "Removes `socket_path` unless a server is listening on it."
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        os.unlink(socket_path)
+    else:
+        raise Exception(f"A server is already listening on: {socket_path}")
+    finally:
+        sock.close()
+
+
+def warm():
+    """
+    Loads the partition catalogue of every table and the station database so that
+    the first jobs do not pay for them. Anything that cannot be loaded is skipped.
+    """
+    for tableID in sorted({shortname[:2] for shortname in nameDict}):
+        try:
+            catalogue.load_catalogue(tableID)
+        except Exception:
+            pass
+
+    try:
+        with contextlib.closing(stationdb.connect()) as conn:
+            stationdb.load_capabilities(conn)
+    except Exception:
+        pass
+
+
+def serve(socket_path=None, jobs=DEFAULT_JOBS):
+    """
+    Runs the server until it is interrupted.
+    """
+    server = ExtractionServer(socket_path, jobs=jobs)
+    warm()
+
+    print(f"Serving on: {server.socket_path} (jobs: {jobs})")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -10,6 +10,7 @@ __license__ = "BSD - see LICENSE file in top-level package directory"
 
 import os
 import datetime
+import tempfile
 
 
 def _now():
@@ -36,3 +37,51 @@ def get_metadata_dir():
 
     return metadata_dir
 
+
+
+def get_index_dir():
+    """
+    Returns the directory in which sidecar index files are kept, or None if they
+    should be written alongside the partition files they describe.
+    """
+    return os.environ.get('MIDAS_INDEX_DIR', None)
+
+
+def get_columnar_dir():
+    """
+    Returns the directory in which the columnar (Parquet) copies of the partition
+    files are kept, or None if they should be written to a "columnar" directory
+    alongside each table's "yearly_files" directory.
+    """
+    return os.environ.get('MIDAS_COLUMNAR_DIR', None)
+
+
+def get_catalogue_dir():
+    """
+    Returns the directory in which partition catalogues are kept, or None if each
+    should be written alongside its table's "yearly_files" directory.
+    """
+    return os.environ.get('MIDAS_CATALOGUE_DIR', None)
+
+
+def get_cache_dir():
+    """
+    Returns the directory in which extraction results are cached, or None if they
+    should not be cached.
+    """
+    return os.environ.get('MIDAS_CACHE_DIR', None)
+
+
+def get_cache_bytes():
+    """
+    Returns the maximum size in bytes of the result cache, or None for the default.
+    """
+    return os.environ.get('MIDAS_CACHE_BYTES', None)
+
+
+def get_server_socket():
+    """
+    Returns the path of the Unix socket on which the extraction server listens.
+    """
+    default = os.path.join(tempfile.gettempdir(), f'midas_extract-{os.getuid()}.sock')
+    return os.environ.get('MIDAS_SERVER_SOCKET', default)
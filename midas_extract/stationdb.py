@@ -0,0 +1,381 @@
+"""
+stationdb.py
+============
+
+A SQLite copy of the MIDAS station metadata used by `StationIDGetter`.
+
+The source (SRCE), geographic area (GEAR) and source capability (SRCC) tables are
+read from the metadata directory once and written to a SQLite file with typed
+columns:
+
+    source(src_id, lat, lon, loc_geog_area_id, lat_cell, lon_cell)
+    geog_area(area_id, area_type, area_name)
+    src_capability(src_id, id_type, bgn_date, end_date)
+
+Latitudes and longitudes are stored as REAL (NULL if they cannot be read) and
+capability dates as INTEGER of the form YYYYMMDDhhmm. There are indexes on
+`src_id`, (lat, lon), `loc_geog_area_id`, area names and the capability dates, so
+station queries are indexed lookups. Rows keep the order of the source files (as
+`rowid`).
+
+The source capabilities are also loaded (once per process) into NumPy arrays by
+`load_capabilities`, so `filter_capabilities` can filter large lists of stations
+by data type and time range with vectorised masks.
+
+Stations are also indexed on a grid of `GRID_DEGREES` cells (`lat_cell`,
+`lon_cell`) so that `find_in_bbox` only visits the cells a bounding box covers.
+
+The database records the size and modification time of each file it was built
+from and is rebuilt automatically when any of them change.
+
+The database is written to ``stations.sqlite`` in the metadata directory unless
+the ``MIDAS_STATIONS_DB`` environment variable gives its path. If it cannot be
+written there it is built in memory for the life of the process.
+
+"""
+
+import os
+import math
+import sqlite3
+import json
+
+import numpy as np
+
+
+from midas_extract import settings
+from midas_extract import indexing
+from midas_extract import bbox_utils
+
+
+DB_VERSION = "2"
+DB_NAME = "stations.sqlite"
+
+# Size (in degrees) of the cells of the spatial grid
+GRID_DEGREES = 1.0
+
+# Source files: {<table>: (<data file>, <columns file>)}, relative to the metadata directory
+SOURCE_FILES = {"SOURCE": (("SRCE", "SRCE.DATA.COMMAS_REMOVED"), ("table_structures", "SRTB.txt")),
+                "GEOG": (("GEAR", "GEAR.DATA"), ("table_structures", "GEOGRAPHIC_AREA.txt")),
+                "SRCC": (("SRCC", "SRCC.DATA"), ("table_structures", "SCTB.txt"))}
+
+_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+
+CREATE TABLE source (src_id TEXT, lat REAL, lon REAL, loc_geog_area_id TEXT,
+                     lat_cell INTEGER, lon_cell INTEGER);
+CREATE INDEX source_src_id ON source (src_id);
+CREATE INDEX source_lat_lon ON source (lat, lon);
+CREATE INDEX source_grid ON source (lat_cell, lon_cell);
+CREATE INDEX source_area ON source (loc_geog_area_id);
+
+CREATE TABLE geog_area (area_id TEXT, area_type TEXT, area_name TEXT);
+CREATE INDEX geog_area_name ON geog_area (area_name);
+
+CREATE TABLE src_capability (src_id TEXT, id_type TEXT, bgn_date INTEGER, end_date INTEGER);
+CREATE INDEX src_capability_src_id ON src_capability (src_id);
+CREATE INDEX src_capability_bgn_date ON src_capability (bgn_date);
+CREATE INDEX src_capability_end_date ON src_capability (end_date);
+"""
+
+# In-memory databases for metadata directories where the file cannot be written
+_memory_dbs = {}
+
+# Source capabilities as arrays: {<signature>: <capabilities>}
+_capabilities = {}
+
+# Open-ended capability dates
+_NO_BEGIN = np.iinfo(np.int64).min
+_NO_END = np.iinfo(np.int64).max
+
+
+def get_db_path():
+    """
+    Returns the path of the station database.
+    """
+    return os.environ.get("MIDAS_STATIONS_DB") or os.path.join(settings.get_metadata_dir(), DB_NAME)
+
+
+def get_source_paths():
+    """
+    Returns a dictionary of {<table>: (<data_file>, <columns_file>)} of the metadata
+    files the database is built from.
+    """
+    metadata_dir = settings.get_metadata_dir()
+    return {table: tuple(os.path.join(metadata_dir, *path) for path in paths)
+            for table, paths in SOURCE_FILES.items()}
+
+
+def _signature():
+    "Returns a string that changes whenever any of the source files change."
+    paths = sorted(path for pair in get_source_paths().values() for path in pair)
+    return ";".join(f"{path}:{size}:{mtime_ns}" for path in paths
+                    for (size, mtime_ns) in [indexing.file_signature(path)])
+
+
+def clean_rows(rows):
+    """
+    Returns rows that should have removed any odd SQL headers or footers.
+    """
+    new_rows = []
+
+    for row in rows:
+        if row.find("[") > -1 or row.find("SQL") > -1 or row.find("Oracle") > -1:
+            continue
+
+        if row.find(",") > -1:
+            new_rows.append(row)
+
+    return new_rows
+
+
+def _read_table(data_file, columns_file, names):
+    """
+    Generator that yields a tuple of the (stripped) values of the columns `names`
+    for each row of `data_file`.
+    """
+    columns = [col.strip() for col in open(columns_file).readlines()]
+    indexes = [columns.index(name) for name in names]
+
+    with open(data_file) as reader:
+        for row in clean_rows(reader):
+            items = [item.strip() for item in row.split(",")]
+            yield tuple(items[i] if i < len(items) else "" for i in indexes)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _cell(degrees):
+    return math.floor(degrees / GRID_DEGREES)
+
+
+def _source_row(src_id, lat, lon, area_id):
+    "Returns a row of the source table, with the grid cell of the station."
+    lat, lon = _to_float(lat), _to_float(lon)
+
+    if lat is None or lon is None:
+        return (src_id, lat, lon, area_id, None, None)
+
+    return (src_id, lat, lon, area_id, _cell(lat), _cell(lon))
+
+
+def _grid_ranges(n, w, s, e):
+    """
+    Returns a list of [lat_cell, first_lon_cell, last_lon_cell] ranges of grid cells
+    that cover every position `bbox_utils.is_in_bbox` could accept for the box. A
+    longitude is accepted if it, or it shifted by 360 degrees, is in [w, e].
+    """
+    lonRanges = sorted([_cell(w + shift), _cell(e + shift)] for shift in (-360, 0, 360))
+
+    # Merge overlapping ranges so that no station is returned twice
+    merged = [lonRanges[0]]
+    for (first, last) in lonRanges[1:]:
+        if first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+
+    return [[latCell, first, last] for latCell in range(_cell(s), _cell(n) + 1)
+            for (first, last) in merged]
+
+
+def find_in_bbox(conn, n, w, s, e):
+    """
+    Returns a list of the src_ids of the stations in bounding box (n, w, s, e), in
+    the order of the source file. Only the stations in the grid cells covering the
+    box are read; they are then checked with `bbox_utils.is_in_bbox_array`.
+    """
+    bbox_utils.validate_bbox(n, w, s, e)
+
+    rows = conn.execute(
+        "SELECT source.src_id, source.lat, source.lon FROM json_each(?) AS cells "
+        "JOIN source ON source.lat_cell = json_extract(cells.value, '$[0]') "
+        "AND source.lon_cell BETWEEN json_extract(cells.value, '$[1]') "
+        "AND json_extract(cells.value, '$[2]') ORDER BY source.rowid",
+        (json.dumps(_grid_ranges(n, w, s, e)),)).fetchall()
+
+    if not rows:
+        return []
+
+    (src_ids, lats, lons) = zip(*rows)
+    inside = bbox_utils.is_in_bbox_array(lats, lons, n, w, s, e)
+
+    return [src_id for (src_id, keep) in zip(src_ids, inside) if keep]
+
+
+def find_in_counties(conn, counties):
+    """
+    Returns a list of the src_ids of the stations in the (upper case) `counties`, in
+    the order of the source file.
+    """
+    rows = conn.execute(
+        "SELECT src_id FROM source WHERE loc_geog_area_id IN "
+        "(SELECT area_id FROM geog_area WHERE area_name IN (SELECT value FROM json_each(?)) "
+        "AND upper(area_type) = 'COUNTY') ORDER BY rowid", (json.dumps(counties),))
+
+    return [src_id for (src_id,) in rows]
+
+
+def _ingest(conn, signature):
+    "Creates the tables in `conn` and loads them from the metadata files."
+    from midas_extract.stations import date_match, _date_pattern
+
+    paths = get_source_paths()
+    conn.executescript(_SCHEMA)
+
+    conn.executemany(
+        "INSERT INTO source VALUES (?, ?, ?, ?, ?, ?)",
+        (_source_row(*row) for row in
+         _read_table(*paths["SOURCE"], ["SRC_ID", "HIGH_PRCN_LAT", "HIGH_PRCN_LON", "LOC_GEOG_AREA_ID"])))
+
+    conn.executemany(
+        "INSERT INTO geog_area VALUES (?, ?, ?)",
+        _read_table(*paths["GEOG"], ["WTHN_GEOG_AREA_ID", "GEOG_AREA_TYPE", "GEOG_AREA_NAME"]))
+
+    conn.executemany(
+        "INSERT INTO src_capability VALUES (?, ?, ?, ?)",
+        ((src_id, id_type, date_match(bgn, _date_pattern), date_match(end, _date_pattern))
+         for (src_id, id_type, bgn, end) in
+         _read_table(*paths["SRCC"], ["SRC_ID", "ID_TYPE", "SRC_CAP_BGN_DATE", "SRC_CAP_END_DATE"])))
+
+    conn.executemany("INSERT INTO meta VALUES (?, ?)",
+                     [("version", DB_VERSION), ("signature", signature)])
+    conn.commit()
+
+
+def _is_current(db_path, signature):
+    "Returns True if the database at `db_path` was built from the current source files."
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    except sqlite3.Error:
+        return False
+
+    try:
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+    except sqlite3.Error:
+        return False
+    finally:
+        conn.close()
+
+    return meta.get("version") == DB_VERSION and meta.get("signature") == signature
+
+
+def build_db(db_path=None):
+    """
+    (Re)builds the station database at `db_path` (default: `get_db_path()`) from the
+    metadata files. Returns the path.
+    """
+    db_path = db_path or get_db_path()
+    tmp_path = f"{db_path}.{os.getpid()}.tmp"
+
+    if os.path.isfile(tmp_path):
+        os.unlink(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        _ingest(conn, _signature())
+    finally:
+        conn.close()
+
+    # Build under a temporary name then rename so readers never see a partial database
+    os.replace(tmp_path, db_path)
+    return db_path
+
+
+def connect():
+    """
+    Returns a read-only connection to an up-to-date station database, building or
+    rebuilding it first if needed. The caller closes it (for example with
+    `contextlib.closing`).
+    """
+    db_path = get_db_path()
+    signature = _signature()
+
+    if not _is_current(db_path, signature):
+        try:
+            build_db(db_path)
+        except (OSError, sqlite3.Error):
+            return _connect_memory(signature)
+
+    return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+
+
+def _connect_memory(signature):
+    """
+    Returns a connection to a copy of the in-memory station database for the current
+    metadata. The database is built once and copied, so each caller can close its
+    own connection.
+    """
+    metadata_dir = settings.get_metadata_dir()
+    cached = _memory_dbs.get(metadata_dir)
+
+    if not cached or cached[0] != signature:
+        master = sqlite3.connect(":memory:", check_same_thread=False)
+        _ingest(master, signature)
+
+        cached = _memory_dbs[metadata_dir] = (signature, master)
+
+    conn = sqlite3.connect(":memory:")
+    cached[1].backup(conn)
+    return conn
+
+
+def load_capabilities(conn):
+    """
+    Returns the source capabilities in the station database `conn` as a dictionary
+    of NumPy arrays, in the order of the SRCC file:
+        {"src_id": <str>, "type_code": <int>, "bgn_date": <int64>, "end_date": <int64>,
+         "types": <str>}
+
+    where `types` holds the (lower case) data type of each `type_code`. Missing dates
+    are open-ended. The arrays are cached until the metadata files change.
+    """
+    signature = dict(conn.execute("SELECT key, value FROM meta"))["signature"]
+
+    if signature in _capabilities:
+        return _capabilities[signature]
+
+    rows = conn.execute("SELECT src_id, lower(id_type), bgn_date, end_date FROM src_capability "
+                        "ORDER BY rowid").fetchall()
+    (src_ids, id_types, bgn_dates, end_dates) = zip(*rows) if rows else ((), (), (), ())
+
+    types, type_codes = np.unique(np.array(id_types, dtype=str), return_inverse=True)
+
+    capabilities = {
+        "src_id": np.array(src_ids, dtype=str),
+        "type_code": type_codes,
+        "bgn_date": np.array([_NO_BEGIN if d is None else d for d in bgn_dates], dtype=np.int64),
+        "end_date": np.array([_NO_END if d is None else d for d in end_dates], dtype=np.int64),
+        "types": types}
+
+    _capabilities.clear()
+    _capabilities[signature] = capabilities
+    return capabilities
+
+
+def filter_capabilities(capabilities, src_ids, data_types=None, start_time=None, end_time=None):
+    """
+    Returns the list of the `src_ids` that have a capability (in `capabilities`, from
+    `load_capabilities`) of one of `data_types` (if given) that overlaps the time
+    range. Stations are listed once, in the order they first appear in the SRCC file.
+    """
+    mask = np.isin(capabilities["src_id"], np.array(list(src_ids), dtype=str))
+
+    if data_types:
+        codes = np.flatnonzero(np.isin(capabilities["types"], [t.lower() for t in data_types]))
+        mask &= np.isin(capabilities["type_code"], codes)
+
+    if start_time:
+        mask &= capabilities["end_date"] >= start_time
+
+    if end_time:
+        mask &= capabilities["bgn_date"] <= end_time
+
+    matches = capabilities["src_id"][mask]
+    _, first = np.unique(matches, return_index=True)
+
+    return matches[np.sort(first)].tolist()
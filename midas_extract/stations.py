@@ -10,11 +10,12 @@ Holds StationIDGetter class for finding a list of station ID based on a set of f
 import os
 import re
 import sys
-import glob
+import contextlib
 
 
-from midas_extract import bbox_utils
 from midas_extract import settings
+from midas_extract import stationdb
+from midas_extract import metrics as metrics_mod
 
 
 # Set up global variables
@@ -46,16 +47,90 @@ def date_match(line, pattern):
     return
 
 
+def parse_time(value):
+    """
+    Returns a time given as an integer, a "YYYYMMDDhhmm" string or a
+    "YYYY-MM-DD[Thh:mm]" string as an integer of the form YYYYMMDDhhmm (or None).
+    """
+    if value is None or value == "":
+        return None
+
+    if isinstance(value, str):
+        if value.isdigit():
+            return int(value)
+
+        return date_match(value.replace("T", " "), _date_pattern)
+
+    return int(value)
+
+
+def parse_bbox(bbox):
+    """
+    Returns a bounding box given as a list or a comma-separated string of N, W, S, E
+    as a tuple of floats, with north and south reversed if necessary.
+    """
+    if isinstance(bbox, str):
+        bbox = bbox.split(",")
+
+    n, w, s, e = [float(_) for _ in bbox]
+
+    # Reverse north and south if necessary
+    if n < s:
+        n, s = s, n
+
+    return n, w, s, e
+
+
+def write_station_list(st_list, output_file=None, quiet=None):
+    """
+    Prints the list of stations found, or writes it to `output_file`.
+    """
+    print("Number of stations found: {}\n".format(len(st_list)))
+
+    if not quiet:
+        print("SRC IDs follow:\n==================")
+
+    if not output_file:
+        if not quiet:
+            for row in st_list:
+                print(row)
+    else:
+        with open(output_file, "w") as output:
+            for row in st_list:
+                output.write(row + "\r\n")
+
+        print("Output written to '{}'".format(output_file))
+
+
+def _as_list(value):
+    "Returns a list given as a list or a comma-separated string."
+    if not value:
+        return []
+
+    if isinstance(value, str):
+        return value.split(",")
+
+    return list(value)
+
+
 class StationIDGetter:
     """
     Class to generate lists of station names from arguments.
     """
 
     def __init__(self, counties, bbox, start_time, end_time, data_type=None, 
-                 output_file=None, quiet=None):
+                 output_file=None, quiet=None, stats=None):
         """
         Sets up instance variables and calls relevant methods.
+
+        The time spent in each stage and the numbers of stations found are kept in
+        `self.metrics` and reported as requested by `stats` (see
+        `midas_extract.metrics.emit`).
         """
+        self.metrics = metrics_mod.Metrics(
+            "stations", stages=("load", "search", "filter", "output_write"),
+            counters=("stations_found", "stations_selected"))
+
         # Set up directories
         self._setup_dirs()
 
@@ -65,45 +140,72 @@ class StationIDGetter:
             self.data_type = [dtype.lower() for dtype in data_type]
 
         # fix times to ensure correct formats (integers)
-        if type(start_time) == type("str"):
-            start_time = start_time.replace("T", " ")
-            start_time = date_match(start_time, _date_pattern)
+        self.start_time = parse_time(start_time)
+        self.end_time = parse_time(end_time)
+
+        # Open the station metadata database
+        with self.metrics.stage("load"):
+            self.build_tables()
+
+        with contextlib.closing(self.db):
+            # Do spatial search to get a load of SRC_IDs
+            with self.metrics.stage("search"):
+                if counties == []:
+                    st_list = self._get_by_bbox(bbox)
+                else:
+                    counties = [county.upper() for county in counties]
+                    st_list = self._get_by_county(counties)
 
-        if type(end_time) == type("str"):
-            end_time = end_time.replace("T", " ")
-            end_time = date_match(end_time, _date_pattern)
+            # Now do extra filtering
+            with self.metrics.stage("filter"):
+                self.st_list = self._filter_by_src_caps(st_list)
 
-        self.start_time = start_time
-        self.end_time = end_time
+        self.metrics.add(stations_found=len(st_list), stations_selected=len(self.st_list))
 
-        # Read in tables
-        self.build_tables()
+        with self.metrics.stage("output_write"):
+            write_station_list(self.st_list, output_file, quiet)
 
-        # Do spatial search to get a load of SRC_IDs
-        if counties == []:
-            st_list = self._get_by_bbox(bbox)
-        else:
-            counties = [county.upper() for county in counties]
-            st_list = self._get_by_county(counties)
+        metrics_mod.emit(self.metrics, stats)
 
-        # Now do extra filtering
-        self.st_list = self._filter_by_src_caps(st_list)
+    @classmethod
+    def query_many(cls, queries):
+        """
+        Answers many station queries at once and returns a list holding the list of
+        SRC IDs found for each. Each query is a dictionary with the keys of the
+        `stations` command: "county" and/or "bbox" (lists, or comma-separated
+        strings), and optionally "start", "end" and "data_type".
 
-        print("Number of stations found: {}\n".format(len(self.st_list)))
+        The station database and the source capability arrays are loaded once and
+        shared by all queries, and nothing is printed.
+        """
+        capabilities = None
+        results = []
+
+        with contextlib.closing(stationdb.connect()) as db:
+            for query in queries:
+                counties = [county.upper() for county in _as_list(query.get("county"))]
+                data_type = [dtype.lower() for dtype in _as_list(query.get("data_type"))]
+                start_time = parse_time(query.get("start"))
+                end_time = parse_time(query.get("end"))
+
+                if counties:
+                    st_list = stationdb.find_in_counties(db, counties)
+                elif query.get("bbox"):
+                    st_list = stationdb.find_in_bbox(db, *parse_bbox(query["bbox"]))
+                else:
+                    raise Exception(f"Query must give either a list of counties or a bbox: "
+                                    f"{query}")
 
-        if not quiet:
-            print("SRC IDs follow:\n==================")
+                if data_type or start_time or end_time:
+                    if capabilities is None:
+                        capabilities = stationdb.load_capabilities(db)
 
-        if not output_file:
-            if not quiet:
-                for row in self.st_list:
-                    print(row)
-        else:
-            with open(output_file, "w") as output:
-                for row in self.st_list:
-                    output.write(row + "\r\n")
+                    st_list = stationdb.filter_capabilities(capabilities, st_list, data_type,
+                                                            start_time, end_time)
 
-            print("Output written to '{}'".format(output_file))
+                results.append(st_list)
+
+        return results
 
     def _setup_dirs(self):
         metadata_dir = settings.get_metadata_dir()
@@ -128,41 +230,10 @@ class StationIDGetter:
         Returns all stations within a bounding box described as
         [N, W, S, E].
         """
-        n, w, s, e = [float(_) for _ in bbox]
+        n, w, s, e = parse_bbox(bbox)
         print(f"Searching within a box of (N - S) {n} - {s} and (W - E) {w} - {e}...")
 
-        # Reverse north and south if necessary
-        if n < s:
-            ntemp = n
-            n = s
-            s = ntemp
-
-        source = self.tables["SOURCE"]
-        sourceCols = source["columns"]
-        latCol = self._get_column_index(sourceCols, "HIGH_PRCN_LAT")
-        lonCol = self._get_column_index(sourceCols, "HIGH_PRCN_LON")
-        srcIDCol = self._get_column_index(sourceCols, "SRC_ID")
-
-        matchingStations = []
-        for station in source["rows"]:
-            station_list = [item.strip() for item in station.split(",")]
-
-            try:
-                lat = float(station_list[latCol])
-                lon = float(station_list[lonCol])
-            except:
-                try:
-                    lat = float(station_list[latCol] + 1)
-                    lon = float(station_list[lonCol] + 1)
-                except:
-                    print(station)
-
-            src_id = station_list[srcIDCol]
-
-            if bbox_utils.is_in_bbox(lat, lon, n, w, s, e):
-                matchingStations.append(src_id)
-
-        return matchingStations
+        return stationdb.find_in_bbox(self.db, n, w, s, e)
 
     def _filter(self, rows, term):
         """
@@ -182,42 +253,7 @@ class StationIDGetter:
         """
         print("\nCOUNTIES to filter on: {}".format(counties))
 
-        source = self.tables["SOURCE"]
-        sourceCols = source["columns"]
-        geog = self.tables["GEOG"]
-        geogCols = geog["columns"]
-
-        area_type_col = self._get_column_index(geogCols, "GEOG_AREA_TYPE")
-        areaIDCol = self._get_column_index(geogCols, "WTHN_GEOG_AREA_ID")
-        area_name_col = self._get_column_index(geogCols, "GEOG_AREA_NAME")
-
-        sourceAreaIDCol = self._get_column_index(sourceCols, "LOC_GEOG_AREA_ID")
-        srcIDCol = self._get_column_index(sourceCols, "SRC_ID")
-
-        countyCodes = []
-        countyMatches = []
- 
-        for area in geog["rows"]:
-
-            area_list = [a.strip() for a in area.split(",")]
-            areaID = area_list[areaIDCol]
-
-            area_type = area_list[area_type_col]
-            area_name = area_list[area_name_col]
-
-            if area_type.upper() == "COUNTY" and area_name in counties:
-
-                countyCodes.append(areaID)
-
-        matchingStations = []
-
-        for station in source["rows"]:
-
-            items = [item.strip() for item in station.split(",")]
-            if items[sourceAreaIDCol] in countyCodes:
-                matchingStations.append(items[0])
-
-        return matchingStations
+        return stationdb.find_in_counties(self.db, counties)
 
     def _filter_by_src_caps(self, st_list):
         """
@@ -235,55 +271,9 @@ class StationIDGetter:
         if self.end_time:
             print("To: {}".format(self.end_time))
 
-        new_list = []
-
-        srcc = self.tables["SRCC"]
-        srccRows = srcc["rows"]
-        srccCols = srcc["columns"]
-
-        idTypeCol = self._get_column_index(srccCols, "ID_TYPE")
-        srcIDCol = self._get_column_index(srccCols, "SRC_ID")
-
-        startCol = self._get_column_index(srccCols, "SRC_CAP_BGN_DATE")
-        endCol = self._get_column_index(srccCols, "SRC_CAP_END_DATE")
-
-        for row in srccRows:
-
-            items = [item.strip() for item in row.split(",")]
-            srcID = items[srcIDCol]
-
-            if srcID in st_list:
-
-                # Check if this data type includes this source id
-                data_type_allowed = False
-
-                if self.data_type:
-                    dataType = items[idTypeCol]
-
-                    if dataType.lower() in self.data_type:
-                        data_type_allowed = True
-
-                else:
-                    data_type_allowed = True
-
-                # Check if this time window is available for this source id
-                time_allowed = True
-
-                if self.start_time:
-                    endOfMeasuring = date_match(items[endCol], _date_pattern)
-
-                    if self.start_time > endOfMeasuring:
-                        time_allowed = False
-
-                if self.end_time:
-                    startOfMeasuring = date_match(items[startCol], _date_pattern)
-
-                    if self.end_time < startOfMeasuring:
-                        time_allowed = False
-
-                if data_type_allowed and time_allowed:
-                    if srcID not in new_list:
-                        new_list.append(srcID)
+        # Capabilities without an end (or start) date are treated as open-ended
+        new_list = stationdb.filter_capabilities(stationdb.load_capabilities(self.db), st_list,
+                                                 self.data_type, self.start_time, self.end_time)
 
         print("Original list length: {}".format(len(st_list)))
         print("Selected after SRCC filtering: {}".format(len(new_list)))
@@ -308,31 +298,13 @@ class StationIDGetter:
 
     def build_tables(self):
         """
-        Builds some dictionaries to house the tables in the form:
-        self.tables["SOURCE"] = {"columns"=["src_id", ...]
-                               "rows"=["23942309423.,234,2342","234...]}
+        Opens the station metadata database (see `midas_extract.stationdb`), building
+        it from the metadata files first if it is missing or out of date.
         """
-        self.tables = {}
-
-        self.tables["SOURCE"] = {"columns": [i.strip() for i in open(self.source_cols_file).readlines()],
-                                 "rows": [i.strip() for i in self._clean_rows(open(self.source_file).readlines())]}
-        self.tables["GEOG"] = {"columns": [i.strip() for i in open(self.geog_area_cols_file).readlines()],
-                               "rows": [i.strip() for i in self._clean_rows(open(self.geog_area_file).readlines())]}
-        self.tables["SRCC"] = {"columns": [i.strip() for i in open(self.source_caps_cols_file).readlines()],
-                               "rows": [i.strip() for i in self._clean_rows(open(self.source_capabilities_file).readlines())]}
+        self.db = stationdb.connect()
 
     def _clean_rows(self, rows):
         """
         Returns rows that should have removed any odd SQL headers or footers.
         """
-        new_rows = []
-
-        for row in rows:
-            if row.find("[") > -1 or row.find("SQL") > -1 or row.find("Oracle") > -1:
-                continue
-
-            if row.find(",") > -1:
-                new_rows.append(row)
-
-        return new_rows
-
+        return stationdb.clean_rows(rows)
@@ -16,7 +16,9 @@ The MIDASSubsetter class needs to be able to see the file 'midas_structure.txt'
 is essentially a description of the table contents in a text file. This is parsed each
 time this script is called.
 
-There is hard-coded limit of 100,000 lines that can currently be extracted.
+The number of rows extracted can be limited (`limit`, or ``--max-rows``); the
+extraction then stops early and returns a continuation token (`--cursor`) from
+which the next page is read (see `midas_extract.paging`).
 
 Usage:
 ======
@@ -33,7 +35,9 @@ Where:
     -s          - provide the start date/time
     -e          - provide the end date/time
     -c          - provide a comma-separated list of required columns
-    -n          - provide a list of comma-separated list of conditions in the form:
+    -n          - provide a list of comma-separated list of conditions in the form
+                  [<column>:]<condition>=<value> (without a column, a condition applies
+                  to each of the columns selected with -c). Conditions are:
                     * range=<low>:<high>     [<low> and <high> are values]
                     * greater_than=<value>
                     * less_than=<value>
@@ -62,28 +66,63 @@ cli.py filter -t RS -s 200401010000 -e 200401011000 -i 214,926 -d tab
 
 # Import required modules
 import sys
-import subprocess as sp
 import os
 import tempfile
 import re
-import glob
 import time
+import itertools
+import shutil
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 
 
 from midas_extract import settings
+from midas_extract import indexing
+from midas_extract import catalogue
+from midas_extract import compression
+from midas_extract import formats
+from midas_extract import cache
+from midas_extract import metrics as metrics_mod
+from midas_extract import paging
+from midas_extract import columnar
+from midas_extract import conditions as conditions_mod
+from midas_extract import planner
 
 
 # Set up global variables
 #metadata_dir = settings.get_metadata_dir()
 #data_dir = settings.get_data_dir()
 
-# Set up global variables
-base_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
-
 #midasStructureTable = os.path.join(metadata_dir, "allTablePartitionNames.txt")
 
-# partition regex pattern
-_partitionPattern = re.compile(r"\w+_[a-zA-Z\-]+_(\d{6})-(\d{6})\.txt")
+# Approximate number of bytes of rows written to the output file at a time
+_OUTPUT_CHUNK_BYTES = 2 ** 20
+
+# Smallest chunk of rows whose conditions are evaluated at once in a paged scan
+_MIN_PAGE_CHUNK = 1000
+
+NO_DATA_MESSAGE = """Your extraction request has run successfully, but no 
+data have been found matching your request.
+
+Please use the MIDAS station search pages on the CEDA website 
+(http://archive.ceda.ac.uk/midas_stations/) to check your station 
+reporting periods and message types to ensure that your selected 
+stations report message types containing the data elements you 
+require within your selected period.
+
+Additional information about data outages/known issues/instrument 
+failure can also be found on station records.
+
+If you have completed these checks and believe the data should be 
+available please contact the CEDA helpdesk for further assistance 
+(support@ceda.ac.uk), providing full details of the extractions 
+you are trying to submit."""
+
+# bytes treated as whitespace by bytes.strip()
+_WHITESPACE = frozenset(b" \t\n\r\x0b\x0c")
+_NEWLINE = ord("\n")
 
 # Define nameDict globally
 nameDict = {'STXX': 'SOIL_TEMP_OB', 'SRCC': 'SRC_CAPABILITY', 'GLXX': 'GBL_WX_OB',
@@ -98,10 +137,23 @@ globalWXCodes = {"1": "glblwx-africa", "2": "glblwx-asia",
                  "7": "glblwx-antarctic"}
 
 
-def countLines(fname):
-    "Returns a count of the lines in a files."
-    args = 'wc -l {}'.format(fname).split()
-    return int(sp.run(args, stdout=sp.PIPE, stderr=sp.PIPE).stdout.split()[0])
+def _progress(filename, nbytes):
+    """
+    Returns a description of the progress of a scan that has read `nbytes` bytes of
+    partition file `filename`, estimated from the size of the file.
+    """
+    if compression.is_compressed(filename):
+        return f"{nbytes} bytes"
+
+    size = os.path.getsize(filename)
+    return f"{nbytes} bytes, ~{100 * nbytes / max(size, 1):.0f}% of the file"
+
+
+def _addStats(stats, nbytes, nlines):
+    "Adds the bytes and lines read by a scan to the `stats` dictionary, if given."
+    if stats is not None:
+        stats["bytes_read"] = stats.get("bytes_read", 0) + nbytes
+        stats["lines_scanned"] = stats.get("lines_scanned", 0) + nlines
 
 
 def dateMatch(line, pattern):
@@ -188,19 +240,603 @@ def getColumnIndex(tableID, colName):
                     (colName, tableID))
 
 
+def srcIdOf(line, srcidIndex):
+    """
+    Returns the src_id field of `line` as a stripped string, or None if the line
+    has too few fields.
+    """
+    fields = line.split(",", srcidIndex + 1)
+
+    if len(fields) > srcidIndex:
+        return fields[srcidIndex].strip()
+
+    return
+
+
+def makeSrcIdFilter(src_ids, srcidIndex):
+    """
+    Returns a function that takes a line and returns True if its src_id is one of
+    `src_ids`. The field is split out once per line and looked up in a set, so the
+    cost does not grow with the number of stations requested.
+    """
+    wanted = frozenset(str(src_id).strip() for src_id in src_ids)
+
+    def srcIdFilter(line):
+        return srcIdOf(line, srcidIndex) in wanted
+
+    return srcIdFilter
+
+
+def parseTableStructure(region=None):
+    """
+    Returns a dictionary of:
+        {<table_name>: {"partitionList": [<file_path>, ...]}}
+
+    for every table, from the partition catalogue (see `midas_extract.catalogue`).
+    If `region` is set then only partitions of that GLOBAL region are included.
+    """
+    tableDict = {}
+
+    for tableName in nameDict.values():
+
+        if tableName in ["SRC_CAPABILITY", "SOURCE", "TEMP_MIN_SOIL_OB", "MARINE_OB"]:
+            continue
+
+        tableID = tableMatch(tableName)[0]
+        tableDict[tableName] = {"partitionList": catalogue.get_partition_files(tableID, region)}
+
+    return tableDict
+
+
+def getDatePattern(tableID):
+    """
+    Returns the required Date regex pattern based on the table ID. 
+    """
+    try:
+        timeIndex = getColumnIndex(tableID, "ob_time")
+    except:
+        try:
+            timeIndex = getColumnIndex(tableID, "ob_date")
+        except:
+            timeIndex = getColumnIndex(tableID, "ob_end_time")
+
+    date_pattern = re.compile(r"([^,]+, ){%s}(\d{4})-(\d{2})-(\d{2})\s+(\d{2}):(\d{2})" % timeIndex)
+    return date_pattern
+
+
+def partitionRuns(filename, startTimeLong, endTimeLong, src_ids=None, use_index=True, verbose=True):
+    """
+    Returns a list of (byte_offset, line_count, end_offset) tuples describing the
+    parts of a partition file that may hold rows in the requested time range. A
+    `line_count` and `end_offset` of None mean "to the end of the file".
+
+    If `use_index` is True and an up-to-date index exists then only the blocks that
+    can hold the time range are included (an empty list means that none can). If
+    `src_ids` are also given and the index holds station posting lists then only the
+    blocks holding those stations are included.
+    """
+    index = indexing.load_index(filename) if use_index else None
+
+    if not index:
+        return [(0, None, None)]
+
+    runs = None
+    if src_ids:
+        runs = indexing.find_station_runs(index, [str(s).strip() for s in src_ids],
+                                          startTimeLong, endTimeLong)
+
+    if runs is None:
+        run = indexing.find_time_run(index, startTimeLong, endTimeLong)
+
+        if verbose:
+            if run is None:
+                print('\tUsing index: no blocks hold the requested time range')
+            else:
+                print(f'\tUsing index: seeking to byte offset {run[0]}')
+
+        return [run] if run else []
+
+    if verbose:
+        print(f'\tUsing index: reading {len(runs)} block run(s) holding the requested stations')
+
+    return runs
+
+
+def readPartition(filename, startTimeLong, endTimeLong, src_ids=None, use_index=True, verbose=True):
+    """
+    Generator that yields the lines of a partition file that may hold rows in the
+    requested time range (see `partitionRuns`).
+    """
+    runs = partitionRuns(filename, startTimeLong, endTimeLong, src_ids,
+                         use_index=use_index, verbose=verbose)
+
+    with compression.open_partition(filename) as fh:
+
+        for (offset, nlines, _) in runs:
+            # Compressed files are only read from the start
+            if offset:
+                fh.seek(offset)
+
+            if nlines is None:
+                yield from fh
+            else:
+                yield from itertools.islice(fh, nlines)
+
+
+def matchPartition(filename, datePattern, startTimeLong, endTimeLong, src_ids=None,
+                   srcidIndex=None, use_index=True, verbose=True, stats=None):
+    """
+    Generator that yields the (stripped) lines of partition file `filename` that fall
+    between `startTimeLong` and `endTimeLong` (and belong to one of `src_ids`, if given).
+
+    If `stats` is a dictionary then the number of bytes (characters, after any
+    decompression) and lines read are added to its "bytes_read" and "lines_scanned".
+    """
+    srcIdFilter = makeSrcIdFilter(src_ids, srcidIndex) if src_ids else None
+    lcount = 0
+    nbytes = 0
+
+    if verbose:
+        print(f'\nFiltering file "{filename}" ({os.path.getsize(filename)} bytes).')
+
+    try:
+        for line in readPartition(filename, startTimeLong, endTimeLong, src_ids,
+                                  use_index=use_index, verbose=verbose):
+
+            lcount = lcount + 1
+            nbytes += len(line)
+            if verbose and lcount % 100000 == 0:
+                print(f'\tRead {lcount} lines ({_progress(filename, nbytes)})...')
+
+            line = line.strip()
+            dmatch = dateMatch(line, datePattern)
+
+            # Check if datetime has gone past the selected range
+            if dmatch and dmatch > endTimeLong:
+                if verbose:
+                    print("Breaking out of read loop because time past end time!")
+                break
+
+            # Now check if src ids need to match
+            if dmatch and (srcIdFilter is None or srcIdFilter(line)):
+
+                if startTimeLong <= dmatch <= endTimeLong:
+                    yield line
+
+    finally:
+        _addStats(stats, nbytes, lcount)
+
+
+def filterPartition(filename, output, datePattern, startTimeLong, endTimeLong, src_ids=None,
+                    srcidIndex=None, use_index=True, verbose=True, stats=None):
+    """
+    Writes the complete rows of partition file `filename` that fall between
+    `startTimeLong` and `endTimeLong` (and belong to one of `src_ids`, if given) to
+    the open file `output`. Returns the number of rows written. `stats` is as for
+    `matchPartition`.
+    """
+    count = 0
+
+    for line in matchPartition(filename, datePattern, startTimeLong, endTimeLong, src_ids,
+                               srcidIndex, use_index=use_index, verbose=verbose, stats=stats):
+        output.write(line + "\n")
+        count += 1
+
+    return count
+
+
+def filterPartitionSubset(filename, output, datePattern, startTimeLong, endTimeLong, src_ids=None,
+                          srcidIndex=None, use_index=True, verbose=True, columns=None,
+                          conditions=None, stats=None):
+    """
+    As `filterPartition` but only writes the rows that meet `conditions` (a
+    `conditions.ConditionSet`) and, if `columns` is given, only the columns with
+    those (0-based) indexes. Rows are evaluated in chunks of `conditions.CHUNK_ROWS`.
+    Returns the number of rows written.
+    """
+    lines = matchPartition(filename, datePattern, startTimeLong, endTimeLong, src_ids,
+                           srcidIndex, use_index=use_index, verbose=verbose, stats=stats)
+    count = 0
+
+    while True:
+        chunk = list(itertools.islice(lines, conditions_mod.CHUNK_ROWS))
+
+        if not chunk:
+            return count
+
+        count += _writeSubsetChunk(chunk, output, columns, conditions)
+
+
+def _writeSubsetChunk(lines, output, columns=None, conditions=None):
+    """
+    Evaluates `conditions` on a chunk of lines and writes the selected `columns` of
+    those that pass to `output`. Returns the number of rows written.
+    """
+    lines = _subsetChunk(lines, columns, conditions)
+
+    if lines:
+        output.write("\n".join(lines) + "\n")
+
+    return len(lines)
+
+
+def _subsetChunk(lines, columns=None, conditions=None):
+    """
+    Evaluates `conditions` on a chunk of lines and returns a list of the selected
+    `columns` (as lines) of those that pass.
+    """
+    if columns is None and not conditions:
+        return lines
+
+    rows = [line.split(",") for line in lines]
+
+    if conditions:
+        mask = _conditionMask(rows, conditions)
+
+        lines = list(itertools.compress(lines, mask))
+        rows = list(itertools.compress(rows, mask))
+
+    if columns is None:
+        return lines
+
+    return [", ".join(row[i].strip() if i < len(row) else "" for i in columns) for row in rows]
+
+
+def iterPartition(filename, engine, datePattern, startTimeLong, endTimeLong, src_ids=None,
+                  srcidIndex=None, use_index=True, verbose=True, columns=None, conditions=None,
+                  stats=None):
+    """
+    Generator that yields the rows (as lines of text, without newlines) that the
+    `engine` scan of partition file `filename` would write, as they are read. Rows
+    are evaluated against `conditions` in chunks that grow from `_MIN_PAGE_CHUNK`
+    to `conditions.CHUNK_ROWS` rows, so the first rows arrive quickly.
+    """
+    args = (filename, datePattern, startTimeLong, endTimeLong, src_ids, srcidIndex)
+    kwargs = {"use_index": use_index, "verbose": verbose, "stats": stats}
+
+    if engine == "columnar":
+        for lines in columnar.iterStore(*args, columns=columns, conditions=conditions, **kwargs):
+            yield from lines
+        return
+
+    # The other engines all give the rows of the text scan
+    lines = matchPartition(*args, **kwargs)
+
+    if columns is None and not conditions:
+        yield from lines
+        return
+
+    size = _MIN_PAGE_CHUNK
+
+    while True:
+        chunk = list(itertools.islice(lines, size))
+
+        if not chunk:
+            return
+
+        yield from _subsetChunk(chunk, columns, conditions)
+        size = min(size * 2, conditions_mod.CHUNK_ROWS)
+
+
+def _conditionMask(rows, conditions):
+    "Returns a boolean array: True for each of `rows` (lists of fields) meeting `conditions`."
+    chunk = {index: np.array([row[index].strip() if index < len(row) else "" for row in rows],
+                             dtype=object)
+             for index in conditions.columns}
+
+    return conditions.evaluate(chunk, len(rows))
+
+
+def pagePartition(filename, datePattern, startTimeLong, endTimeLong, src_ids=None,
+                  srcidIndex=None, use_index=True, offset=0, verbose=True, stats=None):
+    """
+    Generator that yields a tuple of (line, end) for each (stripped) line of
+    partition file `filename` that `matchPartition` would yield, starting at byte
+    `offset`, where `end` is the byte offset just past the line.
+    """
+    srcIdFilter = makeSrcIdFilter(src_ids, srcidIndex) if src_ids else None
+    runs = partitionRuns(filename, startTimeLong, endTimeLong, src_ids,
+                         use_index=use_index, verbose=verbose)
+    lcount = 0
+    nbytes = 0
+
+    if verbose:
+        print(f'\nFiltering file "{filename}" from byte offset {offset}.')
+
+    try:
+        for (line, end) in paging.read_lines(filename, runs, offset):
+            lcount += 1
+            nbytes += len(line)
+
+            line = line.strip()
+            dmatch = dateMatch(line, datePattern)
+
+            # Check if datetime has gone past the selected range
+            if dmatch and dmatch > endTimeLong:
+                break
+
+            if dmatch and (srcIdFilter is None or srcIdFilter(line)):
+
+                if startTimeLong <= dmatch <= endTimeLong:
+                    yield line, end
+
+    finally:
+        _addStats(stats, nbytes, lcount)
+
+
+def _getLinePattern(datePattern, srcidIndex=None):
+    """
+    Returns a tuple of (pattern, dateGroups, srcGroup) where `pattern` is a multi-line
+    bytes version of `datePattern` that matches a whole line, skipping any leading
+    whitespace. Group 1 is the line (less leading whitespace and the newline) and
+    `dateGroups` are the numbers of the date and time field groups.
+
+    If `srcidIndex` is given then group `srcGroup` is the src_id field (with any
+    leading spaces removed), or None if the line is too short to have one.
+    """
+    timeIndex = int(re.match(r"\(\[\^,\]\+, \)\{(\d+)\}", datePattern.pattern).group(1))
+    field = rb"[^,\n]+, "
+    dateTime = rb"(\d{4})-(\d{2})-(\d{2})[^\S\n]+(\d{2}):(\d{2})"
+    dateGroups = (2, 3, 4, 5, 6)
+    srcGroup = None
+
+    if srcidIndex is None:
+        line = field * timeIndex + dateTime + rb"[^\n]*"
+
+    elif srcidIndex < timeIndex:
+        line = (field * srcidIndex + rb" *([^,\n]+), " + field * (timeIndex - srcidIndex - 1) +
+                dateTime + rb"[^\n]*")
+        dateGroups = (3, 4, 5, 6, 7)
+        srcGroup = 2
+
+    else:
+        line = (field * timeIndex + dateTime + rb"[^,\n]*" +
+                rb"(?:,[^,\n]*)" * (srcidIndex - timeIndex - 1) + rb"(?:, *([^,\n]*))?[^\n]*")
+        srcGroup = 7
+
+    return re.compile(rb"(?m)^[^\S\n]*(" + line + rb")"), dateGroups, srcGroup
+
+
+def filterPartitionMmap(filename, output, datePattern, startTimeLong, endTimeLong, src_ids=None,
+                        srcidIndex=None, use_index=True, verbose=True, stats=None):
+    """
+    Bytes-level equivalent of `filterPartition`. The partition file is memory-mapped
+    and lines are matched in place, without decoding them to `str`. Matching lines
+    are written to the binary file `output` as slices of the map, with runs of
+    consecutive matching lines written in a single call. Returns the number of
+    rows written. `stats` is as for `matchPartition`.
+    """
+    if os.path.getsize(filename) == 0:
+        return 0
+
+    # Compressed files cannot be memory-mapped: read them as text
+    if compression.is_compressed(filename):
+        count = 0
+        for line in matchPartition(filename, datePattern, startTimeLong, endTimeLong, src_ids,
+                                   srcidIndex, use_index=use_index, verbose=verbose, stats=stats):
+            output.write((line + "\n").encode())
+            count += 1
+        return count
+
+    linePattern, dateGroups, srcGroup = _getLinePattern(datePattern, srcidIndex if src_ids else None)
+
+    # Times are compared as tuples of fixed-width digit strings to avoid int conversion
+    startKey = _timeKey(startTimeLong)
+    endKey = _timeKey(endTimeLong)
+
+    if src_ids:
+        wanted = frozenset(str(src_id).strip().encode() for src_id in src_ids)
+
+    runs = partitionRuns(filename, startTimeLong, endTimeLong, src_ids,
+                         use_index=use_index, verbose=verbose)
+    count = 0
+    nbytes = 0
+    nlines = 0
+
+    if verbose:
+        print(f'\nFiltering file "{filename}" ({os.path.getsize(filename)} bytes).')
+
+    with open(filename, "rb") as fh, \
+            mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+            memoryview(mm) as view:
+
+        size = len(mm)
+        # The pending span of output: consecutive matching lines written in one go
+        spanStart = spanEnd = 0
+
+        for (pos, _, endPos) in runs:
+            pastEnd = False
+            stop = size if endPos is None else endPos
+
+            for match in linePattern.finditer(mm, pos, stop):
+                nlines += 1
+                key = match.group(*dateGroups)
+
+                # Check if datetime has gone past the selected range
+                if key > endKey:
+                    if verbose:
+                        print("Breaking out of read loop because time past end time!")
+                    pastEnd = True
+                    stop = match.end()
+                    break
+
+                if key < startKey:
+                    continue
+
+                if src_ids:
+                    src_id = match.group(srcGroup)
+
+                    if src_id is None or (src_id not in wanted and src_id.strip() not in wanted):
+                        continue
+
+                # Equivalent of str.strip() on the end of the line
+                start, end = match.span(1)
+                while mm[end - 1] in _WHITESPACE:
+                    end -= 1
+
+                count += 1
+
+                if end < size and mm[end] == _NEWLINE:
+                    if start == spanEnd:
+                        spanEnd = end + 1
+                        continue
+
+                    if spanEnd > spanStart:
+                        output.write(view[spanStart:spanEnd])
+
+                    spanStart, spanEnd = start, end + 1
+                    continue
+
+                if spanEnd > spanStart:
+                    output.write(view[spanStart:spanEnd])
+
+                spanStart = spanEnd = 0
+                output.write(view[start:end])
+                output.write(b"\n")
+
+            nbytes += stop - pos
+
+            if pastEnd:
+                break
+
+        if spanEnd > spanStart:
+            output.write(view[spanStart:spanEnd])
+
+    _addStats(stats, nbytes, nlines)
+    return count
+
+
+def _timeKey(timeLong):
+    "Returns an integer time YYYYMMDDhhmm as a tuple of bytes to compare with date fields."
+    t = b"%012d" % timeLong
+    return (t[:4], t[4:6], t[6:8], t[8:10], t[10:12])
+
+
+SCAN_ENGINES = {"text": filterPartition, "mmap": filterPartitionMmap}
+
+# The columnar engine is used automatically for files that have an up-to-date store,
+# and the subset engine for extractions with column selections or conditions
+_ALL_SCAN_ENGINES = dict(SCAN_ENGINES, columnar=columnar.filterStore, subset=filterPartitionSubset)
+
+
+def _filterPartitionToFile(filename, outputPath, engine, *args, **kwargs):
+    """
+    Worker process entry point: runs the `engine` scan of a partition file with
+    its output going to a new file at `outputPath`. Returns a tuple of (the number
+    of rows written, the dictionary of scan statistics).
+    """
+    mode = "wb" if engine == "mmap" else "w"
+    kwargs["stats"] = {}
+
+    with open(outputPath, mode) as output:
+        return _ALL_SCAN_ENGINES[engine](filename, output, *args, **kwargs), kwargs["stats"]
+
+
 class MIDASSubsetter:
     """
     Subsetting class to manage extractions from large text files holding MIDAS data.
     """
 
     def __init__(self, table, outputPath, startTime=None, endTime=None, columns="all", conditions=None,
-                 src_ids=None, region=None, delimiter="default", tmp_dir=None, verbose=True):
+                 src_ids=None, region=None, delimiter="default", tmp_dir=None, verbose=True,
+                 use_index=True, workers=None, engine="auto", use_store=True, explain=False,
+                 run=True, compress=None, compress_level=None, compress_background=False,
+                 output_format="text", stats=None, limit=None, cursor=None):
         """
         Initialisation of instance sets up the rules and calls various methods.
+
+        The extraction is planned by `midas_extract.planner`, which chooses the files
+        to read, the scan engine for each and how much of each file to read. If
+        `explain` is True then the plan is printed (and kept as `self.plan`) but
+        nothing is extracted.
+
+        If `use_index` is True then any up-to-date sidecar index files (see
+        `midas_extract.indexing`) are used to skip to the start time in each file.
+
+        If `workers` is greater than 1 then partition files are filtered in parallel
+        by that many worker processes. If it is None then the planner chooses.
+
+        `columns` can be "all", a comma-separated string, or a list of column names or
+        (1-based) column numbers. `conditions` are described in
+        `midas_extract.conditions`.
+
+        `engine` selects how complete rows are scanned: "text" (line by line as `str`),
+        "mmap" (memory-mapped, matched and written as bytes) or "auto" (chosen by the
+        planner). All give identical output.
+
+        If `use_store` is True then partition files that have an up-to-date columnar
+        copy (see `midas_extract.columnar`) are read from that instead.
+
+        If a result cache is set up (see `midas_extract.cache`) then the rows of an
+        identical earlier extraction are reused where the partition files are unchanged.
+
+        If `compress` is "gzip" or "zstd" then the output file is compressed as it is
+        written (at `compress_level`, in a background thread if `compress_background`
+        is True) and the suffix of the format is added to its name if missing.
+
+        `output_format` is "text" (the default) or one of the typed binary formats
+        "parquet", "feather" or "netcdf" (see `midas_extract.formats`), which are
+        compressed internally with `compress`.
+
+        If `run` is False then the extraction is planned but not run; the batch
+        executor (see `midas_extract.batch`) uses this to scan files for many
+        extractions at once.
+
+        The time spent in each stage of the run and counts of the bytes and lines
+        read are kept in `self.metrics` (see `midas_extract.metrics`) and reported
+        as requested by `stats`: "json" (written to standard error) or a function
+        called with a dictionary of them.
+
+        If `limit` is given then at most that many rows are extracted, and the scan
+        stops as soon as they are found. If there may be more rows then a
+        continuation token is kept as `self.next_cursor`: pass it as `cursor` to the
+        same request to extract the next page, resuming the scan where this one
+        stopped (see `midas_extract.paging`). Paged extractions read the text
+        partition files in a single process, in time order.
         """
+        self.metrics = metrics_mod.Metrics(
+            "extract", stages=("discovery", "listing", "scan", "temp_write", "output_write"),
+            counters=("bytes_read", "lines_scanned", "lines_matched", "files_read",
+                      "files_pruned"))
         self.region = region
         self.verbose = verbose
 
+        if limit is not None and int(limit) < 1:
+            raise Exception(f"Row limit must be at least 1: {limit}")
+
+        self.limit = None if limit is None else int(limit)
+        self.cursor = cursor
+        self.next_cursor = None
+        self.use_index = use_index
+        self.workers = workers
+
+        if engine != "auto" and engine not in SCAN_ENGINES:
+            raise Exception(f"Scan engine not known: {engine}")
+
+        self.engine = engine
+        self.use_store = use_store
+
+        output_format = output_format or "text"
+
+        if output_format not in formats.OUTPUT_FORMATS:
+            raise Exception(f"Output format not known: {output_format}")
+
+        if output_format != "text" and outputPath == "display":
+            raise Exception(f"Output in {output_format} format must be written to an output file.")
+
+        if compress:
+            if outputPath == "display":
+                raise Exception("Compressed output must be written to an output file.")
+
+            if output_format == "text":
+                outputPath = compression.get_output_path(outputPath, compress)
+
+        self.output_format = output_format
+
+        self.compress = compress
+        self.compress_level = compress_level
+        self.compress_background = compress_background
+
         if not startTime:
             startTime = settings.START_DEFAULT
         
@@ -214,380 +850,546 @@ class MIDASSubsetter:
 
         table = table.upper()
 
-        if type(columns) == type([]):
-            # convert to list of ints if appropriate
-            try:
-                columns = [int(i) for i in columns]
-            except:
-                pass
-
-        # Get full list of all tables and partitions
-        tableDict = self._parseTableStructure()
-
         (tableID, tableName) = tableMatch(table)
 
-        self.rowHeaders = self._getRowHeaders(tableID)
+        self.rowHeaders = self._getRowHeaders(tableID, columns)
         if self.verbose:
             print("Got row headers...")
 
-        partitionFiles = tableDict[tableName]["partitionList"]
+        # Look up the table's partitions in the catalogue
+        with self.metrics.stage("discovery"):
+            partitions = catalogue.get_partitions(tableID, self.region)
 
         if self.verbose:
             print("Got partition files...")
 
+        columnIndexes = self._getColumnIndexes(tableID, columns)
+        conditionSet = conditions_mod.ConditionSet(conditions, self._getRowHeaders(tableID),
+                                                   columnIndexes)
+
         if self.verbose:
-            print("Getting file list...")
+            print("Planning extraction...")
+
+        with self.metrics.stage("listing"):
+            self.plan = self._getPlan(tableID, partitions, startTime, endTime, src_ids,
+                                      columnIndexes, conditionSet)
+
+        self.metrics.add(files_read=len(self.plan.steps), files_pruned=len(self.plan.pruned))
+
+        if explain or self.verbose:
+            print(self.plan.explain())
+
+        self.tableID = tableID
+        self.startTime, self.endTime = startTime, endTime
+        self.src_ids = src_ids
+        self.columnIndexes = columnIndexes
+        self.conditionSet = conditionSet
+        self.outputPath = outputPath
+        self.delimiter = delimiter
+
+        if explain:
+            metrics_mod.emit(self.metrics, stats)
+
+        if explain or not run:
+            return
+
+        # Typed formats are written straight from the scan, unless results are cached
+        if self.output_format != "text" and not settings.get_cache_dir():
+            with self.metrics.stage("output_write"):
+                self._writeFormatted(self.iterLines(), outputPath)
+
+        else:
+            # Pages are not cached
+            if settings.get_cache_dir() and not self._isPaged():
+                with self.metrics.stage("scan"):
+                    key = self._getCacheKey(partitions)
+                    dataFile = cache.fetch(key, self._extractRows, self.tmp_dir)
+            else:
+                dataFile = self._extractRows()
 
-        fileList = self._getFileList(
-            tableName, startTime, endTime, partitionFiles)
+            with self.metrics.stage("output_write"):
+                self._writeOutputFile(dataFile, outputPath, delimiter)
 
-        if columns == "all" and conditions == None:
+        if self.next_cursor and self.verbose:
+            print(f"More rows may be available. To extract the next {self.limit}, use the "
+                  f"continuation token:\n{self.next_cursor}\n")
+
+        metrics_mod.emit(self.metrics, stats)
+
+    def iterLines(self):
+        """
+        Generator that yields the rows of the planned extraction (as lines of text,
+        without newlines, as in the output file but without the header or a
+        changed delimiter) as they are scanned, with no temporary file. Files are
+        read in time order, in this process. Stopping early stops the scan.
+
+        A paged extraction (see `limit` and `cursor`) yields only its page, and sets
+        `next_cursor` once the page has been read.
+        """
+        datePattern = self._get_date_regex(self.tableID)
+        srcidIndex = getColumnIndex(self.tableID, "src_id") if self.src_ids else None
+        scanStats = {}
+
+        if self._isPaged():
+            for lines in self._iterPage(self.plan.fileList, datePattern, self.plan.startTimeLong,
+                                        self.plan.endTimeLong, self.src_ids, srcidIndex,
+                                        use_index=self.use_index, verbose=self.verbose,
+                                        columns=self.columnIndexes,
+                                        conditions=self.conditionSet or None):
+                yield from lines
+            return
+
+        try:
+            for filename in self.plan.fileList:
+                yield from iterPartition(filename, self.plan.engines[filename], datePattern,
+                                         self.plan.startTimeLong, self.plan.endTimeLong,
+                                         self.src_ids, srcidIndex, use_index=self.use_index,
+                                         verbose=self.verbose, columns=self.columnIndexes,
+                                         conditions=self.conditionSet or None, stats=scanStats)
+        finally:
+            self.metrics.add(scanStats)
+
+    def _isPaged(self):
+        "Returns True if the extraction is limited to a page of rows."
+        return self.limit is not None or bool(self.cursor)
+
+    def _getRequestKey(self):
+        "Returns a key identifying the request (but not the data), for continuation tokens."
+        return cache.make_key(self.tableID, self.plan.startTimeLong, self.plan.endTimeLong,
+                              self.src_ids, self.columnIndexes, self.conditionSet, self.region)
+
+    def _extractRows(self):
+        """
+        Runs the planned extraction and returns the path of a temporary file holding
+        the rows extracted.
+        """
+        (tableID, startTime, endTime) = (self.tableID, self.startTime, self.endTime)
+        fileList = self.plan.fileList
+
+        if self.columnIndexes is None and not self.conditionSet:
             if self.verbose:
                 file_list_string = "\t"+"\n\t".join(fileList)
                 print(f'\nExtracting all rows: {tableID}\nFrom files: {file_list_string}\n' \
                       f'Between: {startTime} and {endTime}\n')
 
             dataFile = self._getCompleteRows(
-                tableID, fileList, startTime, endTime, src_ids=src_ids)
+                tableID, fileList, startTime, endTime, src_ids=self.src_ids)
 
         else:
             if self.verbose:
                 print(f'\nExtracting row subsets for: {tableID}\nFrom files: {fileList}\n' \
                       f'Between: {startTime} and {endTime}\n')
             dataFile = self._getRowSubsets(
-                tableID, fileList, startTime, endTime, columns, conditions)
+                tableID, fileList, startTime, endTime, self.columnIndexes, self.conditionSet,
+                src_ids=self.src_ids)
 
         if self.verbose:
             print("\nData extracted to temporary file(s)...")
 
-        self._writeOutputFile(dataFile, outputPath, delimiter)
+        return dataFile
+
+    def _getCacheKey(self, partitions):
+        """
+        Returns the result cache key (see `midas_extract.cache`) of the request. Only
+        the `partitions` whose names overlap the time range are part of the key.
+        """
+        startYM = self.plan.startTimeLong // 1000000
+        endYM = self.plan.endTimeLong // 1000000
+        partitions = [partition for partition in partitions
+                      if partition["end"] >= startYM and partition["start"] <= endYM]
+
+        return cache.make_key(self.tableID, self.plan.startTimeLong, self.plan.endTimeLong,
+                              self.src_ids, self.columnIndexes, self.conditionSet, self.region,
+                              partitions)
 
     def _parseTableStructure(self):
-###, structureFile=midasStructureTable):
         """
         Parses the table structure text file to return a list of [<files>, <columns>]
         where <files> is a list of [<file_name>, <start_time>, <end_time>].
         """
-        data_dir = settings.get_data_dir()
-        tableDict = {}
-
-        fpatt = re.compile(r"\w+_([a-zA-Z\-]+)_(\d{6})-(\d{6}).txt")
-        tableList = nameDict.values()
-
-        for tableName in tableList:  
-
-            if tableName in ["SRC_CAPABILITY", "SOURCE", "TEMP_MIN_SOIL_OB", "MARINE_OB"]:
-                continue
-
-            tableID = tableMatch(tableName)[0]
-            tableDict[tableName] = {"partitionList": []}
-
-            partitionDir = os.path.join(data_dir, tableID, 'yearly_files')
-
-            if not os.path.isdir(partitionDir): continue
-
-            os.chdir(partitionDir)
-
-            partitionFiles = glob.glob("*.txt")
-            partitionFiles.sort()
-
-            for pfile in partitionFiles:
+        return parseTableStructure(self.region)
 
-                pmatch = fpatt.match(pfile)
-
-                if pmatch:
-                    # Deal with non-matching regions if global used...
-                    if self.region:
-
-                        regionName = globalWXCodes[self.region]
-                        if pmatch.groups()[0] != regionName:
-                            continue
-
-                    ppath = os.path.join(partitionDir, pfile)
-                    tableDict[tableName]["partitionList"].append(ppath)
-
-            os.chdir(base_dir)
-
-        return tableDict
-
-    def _getFileList(self, table, startTime, endTime, partitionFiles, pattern=_partitionPattern):
+    def _getPlan(self, tableID, partitions, startTime, endTime, src_ids=None,
+                 columnIndexes=None, conditionSet=None):
         """
-        Returns a list of files required for reading based on the request.
+        Returns the `planner.ExtractionPlan` for the request.
         """
-        startYM = int(startTime[:6])
-        endYM = int(endTime[:6])
-        filePathList = []
+        srcidIndex = getColumnIndex(tableID, "src_id") if src_ids else None
+        columnNames = [self._getRowHeaders(tableID)[i] for i in columnIndexes] \
+            if columnIndexes is not None else None
 
-        for fname in partitionFiles:
-           
-            print(f'Working on input file: {fname}')
-            (nameStart, nameEnd) = pattern.search(fname).groups()
-
-            if int(nameEnd) < int(startYM) or int(nameStart) > int(endYM):
-                pass
-            else:
-                filePathList.append(fname)
-
-        return filePathList
+        return planner.plan_extraction(
+            tableID, partitions, int(pad_time(startTime, 'start')),
+            int(pad_time(endTime, 'end')), src_ids=src_ids, srcidIndex=srcidIndex,
+            columnNames=columnNames, conditions=conditionSet,
+            subset=columnIndexes is not None or bool(conditionSet), use_index=self.use_index,
+            use_store=self.use_store, engine=self.engine, workers=self.workers)
 
     def _get_date_regex(self, tableID):
         """
         Returns the required Date regex pattern based on the table ID. 
         """
-        try:
-            timeIndex = getColumnIndex(tableID, "ob_time")
-        except:
-            try:
-                timeIndex = getColumnIndex(tableID, "ob_date")
-            except:
-                timeIndex = getColumnIndex(tableID, "ob_end_time")
-
-        date_pattern = re.compile(r"([^,]+, ){%s}(\d{4})-(\d{2})-(\d{2})\s+(\d{2}):(\d{2})" % timeIndex)
-        return date_pattern
+        return getDatePattern(tableID)
 
     def _getCompleteRows(self, tableID, fileList, startTime, endTime, src_ids=None):
         """
         Returns a list of complete rows from the database.
         """
+        return self._scanFiles(tableID, fileList, startTime, endTime, src_ids)
+
+    def _getRowSubsets(self, tableID, fileList, startTime, endTime, columns=None, conditions=None,
+                       src_ids=None):
+        """
+        Returns a list of rows after sub-setting according to columns (a list of
+        0-based column indexes, or None for all) and conditions (a
+        `conditions.ConditionSet`).
+        """
+        return self._scanFiles(tableID, fileList, startTime, endTime, src_ids,
+                               subset={"columns": columns, "conditions": conditions})
+
+    def _scanFiles(self, tableID, fileList, startTime, endTime, src_ids=None, subset=None):
+        """
+        Scans the files in `fileList` and writes the matching rows to a temporary file.
+        If `subset` is given it is a dictionary of the `columns` and `conditions` to
+        apply to each row. Returns the path of the temporary file.
+        """
         _datePattern = self._get_date_regex(tableID)
+        engines = self.plan.engines
+        parallel = self.plan.workers > 1 and len(fileList) > 1
 
+        # The mmap engine writes bytes, and parallel results are merged as bytes
+        # A unique name so that concurrent extractions (e.g. in the server) do not collide
         now = time.strftime("%Y%m%d.%H%M%S", time.localtime(time.time()))
-        tempFilePath = os.path.join(self.tmp_dir, "temp_%s" % (now))
-        tempFile = open(tempFilePath, "w")
+        fd, tempFilePath = tempfile.mkstemp(prefix="temp_%s_" % (now), dir=self.tmp_dir)
+        binary = not self._isPaged() and (parallel or "mmap" in engines.values())
+        tempFile = os.fdopen(fd, "wb" if binary else "w")
+        scanStats = {}
 
         startTimeLong = int(pad_time(startTime, 'start'))
         endTimeLong = int(pad_time(endTime, 'end'))
 
-        getAllSrcIds = False
-        # Set up srcId pattern finders
+        # Set up the src_id filter
+        srcidIndex = None
         if src_ids:
-            selectedRows = []
-            print("Now extracting station ids provided...")
+            if self.verbose:
+                print("Now extracting station ids provided...")
             srcidIndex = getColumnIndex(tableID, "src_id")
 
-            # reg ex module has a limit of 9999 items that can be in a "|" separated match option
-            # somewhere on web says it can be set at 7500
-            # For safety I'll split them into 5000 batches
-            n = 0
-            srcIdPatternsList = []
+        filterArgs = (_datePattern, startTimeLong, endTimeLong)
+        filterKwargs = {"src_ids": src_ids, "srcidIndex": srcidIndex,
+                        "use_index": self.use_index, "verbose": self.verbose}
+        filterKwargs.update(subset or {})
 
-            while n <= (len(src_ids) - 1):
-                srcIdPatternsList.append(re.compile(
-                    r"([^,]+, ){%s}(%s)," % (srcidIndex, "|".join(src_ids[n: (n + 5000)]))))
-                n += 5000
+        with self.metrics.stage("scan"):
+            if self._isPaged():
+                count = self._scanPage(fileList, tempFile, *filterArgs, **filterKwargs)
 
-        else:
-            getAllSrcIds = True
+            elif parallel:
+                count = self._filterInParallel(fileList, tempFile, engines, *filterArgs,
+                                               **filterKwargs)
 
-        count = 0
-        for filename in fileList:
+            else:
+                count = 0
+                filterKwargs["stats"] = scanStats
 
-            lcount = 0
-            if self.verbose:
-                print(f'\nFiltering file "{filename}" containing {countLines(filename)} lines.')
+                for filename in fileList:
+                    count += _ALL_SCAN_ENGINES[engines[filename]](filename, tempFile,
+                                                                  *filterArgs, **filterKwargs)
+                self.metrics.add(scanStats)
 
-            f = open(filename)
-            line = f.readline()
+        with self.metrics.stage("temp_write"):
+            tempFile.close()
 
-            while line:
- 
-                lcount = lcount + 1
-                if self.verbose and lcount % 100000 == 0:
-                    print(f'\tRead {lcount} lines...')
+        self.metrics.add(lines_matched=count)
 
-                line = line.strip()
-                dmatch = dateMatch(line, _datePattern)
+        if self.verbose:
+            print(f'Lines to filter: {count}')
 
-                # Check if datetime has gone past the selected range
-                if dmatch and dmatch > endTimeLong:
-                    print("Breaking out of read loop because time past end time!")
-                    break
+        return tempFilePath
 
-                # Now check if src ids need to match
-                idmatch = None
+    def _scanPage(self, fileList, output, *args, **kwargs):
+        """
+        Writes up to `self.limit` matching rows to `output` (see `_iterPage`) and
+        returns the number of rows written.
+        """
+        count = 0
 
-                if src_ids:
-                    for _srcidPattern in srcIdPatternsList:
-                        if _srcidPattern.match(line):
-                            idmatch = 1
-                            break
+        for lines in self._iterPage(fileList, *args, **kwargs):
+            output.write("\n".join(lines) + "\n")
+            count += len(lines)
 
-                if dmatch and (idmatch or getAllSrcIds):
+        return count
 
-                    if startTimeLong <= dmatch <= endTimeLong:
-                        tempFile.write(line.strip() + "\n")
-                        count += 1
+    def _iterPage(self, fileList, datePattern, startTimeLong, endTimeLong, src_ids=None,
+                  srcidIndex=None, use_index=True, verbose=True, columns=None, conditions=None):
+        """
+        Generator that yields chunks (lists of lines) of up to `self.limit` matching
+        rows, reading the files in `fileList` in order from the position given by
+        `self.cursor` and stopping as soon as the limit is reached, when
+        `self.next_cursor` is set.
+        """
+        requestKey = self._getRequestKey()
+        (first, offset) = (0, 0)
 
-                line = f.readline()
+        if self.cursor:
+            (first, offset) = paging.parse_cursor(self.cursor, requestKey, fileList)
 
-            f.close()
+        remaining = self.limit
+        scanStats = {}
 
-        tempFile.close()
+        try:
+            for filename in fileList[first:]:
+                lines = pagePartition(filename, datePattern, startTimeLong, endTimeLong, src_ids,
+                                      srcidIndex, use_index=use_index, offset=offset,
+                                      verbose=verbose, stats=scanStats)
+                offset = 0
+
+                try:
+                    while remaining is None or remaining > 0:
+                        # Without conditions every row matched is kept, so none are read ahead
+                        if remaining is None:
+                            size = conditions_mod.CHUNK_ROWS
+                        elif conditions:
+                            size = min(conditions_mod.CHUNK_ROWS, max(remaining, _MIN_PAGE_CHUNK))
+                        else:
+                            size = remaining
+
+                        chunk = list(itertools.islice(lines, size))
+
+                        if not chunk:
+                            break
 
-        if self.verbose:
-            print(f'Lines to filter: {countLines(tempFilePath)}')
+                        if conditions:
+                            mask = _conditionMask([line.split(",") for (line, _) in chunk],
+                                                  conditions)
+                            chunk = list(itertools.compress(chunk, mask))
 
-        return tempFilePath 
+                        if remaining is not None:
+                            chunk = chunk[:remaining]
+                            remaining -= len(chunk)
 
-    def _getRowHeaders(self, tableID, columns="all"):
-        """
-        Reads in the dictionary to get the headers for each column.
-        """
-        metadata_dir = settings.get_metadata_dir()
+                        if chunk:
+                            end = chunk[-1][1]
+                            yield _subsetChunk([line for (line, _) in chunk], columns)
 
-        inputFile = os.path.join(metadata_dir, "table_structures/%sTB.txt" % tableID)
+                finally:
+                    lines.close()
 
-        rowHeaders = [rh.strip().lower() for rh in open(inputFile).readlines()]
-        return rowHeaders
+                if remaining == 0:
+                    self.next_cursor = paging.make_cursor(requestKey, filename, end)
+                    break
 
-    def _getRowSubsets(self, tableID, fileList, startTime, endTime, columns="all", conditions=None):
+        finally:
+            self.metrics.add(scanStats)
+
+    def _getColumnIndexes(self, tableID, columns="all"):
         """
-        Returns a list of rows after sub-setting according to columns and conditions.
+        Returns a list of the (0-based) indexes of `columns` in the table, or None for
+        all columns. `columns` can be "all", a comma-separated string, or a list of
+        column names or (1-based) column numbers.
         """
-        _datePattern = self._get_date_regex(tableID)
-
-        now = time.strftime("%Y%m%d.%H%M%S", time.localtime(time.time()))
-        tempFilePath = os.path.join(self.tmp_dir, "temp_%s" % (now))
-        tempFile = open(tempFilePath, "w")
+        if columns in (None, "all"):
+            return None
 
-        startTimeLong = int(pad_time(startTime, 'start'))
-        endTimeLong = int(pad_time(endTime, 'end'))
+        if isinstance(columns, str):
+            columns = columns.split(",")
 
-        count = 0
+        headers = self._getRowHeaders(tableID)
+        indexes = []
 
-        for filename in fileList:
+        for column in columns:
+            column = str(column).strip().lower()
 
-            fout = open(filename)
-            line = fout.readline()
+            if column.isdigit() and 0 < int(column) <= len(headers):
+                indexes.append(int(column) - 1)
+            elif column in headers:
+                indexes.append(headers.index(column))
+            else:
+                raise Exception("Cannot find column name '%s' in table '%s'" % (column, tableID))
 
-            while line:
-                line = line.strip()
-                match = dateMatch(line, _datePattern)
+        return indexes
 
-                if match:
-                    dataTimeLong = int(match)
+    def _filterInParallel(self, fileList, tempFile, engines, *args, **kwargs):
+        """
+        Runs the scan engine given in the dictionary `engines` on each file in
+        `fileList` in a pool of worker processes, each writing to its own temporary
+        file. The results are appended to the binary file `tempFile` in the order of
+        `fileList` so the output is identical to a serial run. Returns the number of
+        rows written. The scan statistics of the workers are added to `self.metrics`.
+        """
+        partPaths = []
+        futures = []
+        count = 0
 
-                    if startTimeLong < match < endTimeLong:
-                        if type(columns) == type([]):
+        if self.verbose:
+            print(f'Filtering {len(fileList)} files with {self.plan.workers} worker processes.')
 
-                            new_line = None
-                            splitLine = re.split(r",\s+", line)
+        try:
+            with ProcessPoolExecutor(max_workers=self.plan.workers) as pool:
 
-                            for i in columns:
-                                i = i - 1
+                for filename in fileList:
+                    fd, partPath = tempfile.mkstemp(prefix="temp_part_", dir=self.tmp_dir)
+                    os.close(fd)
+                    partPaths.append(partPath)
 
-                                if new_line == None:
-                                    new_line = "%s, " % splitLine[i]
-                                else:
-                                    new_line = "%s%s, " % (
-                                        new_line, splitLine[i])
+                    futures.append(pool.submit(_filterPartitionToFile, filename, partPath,
+                                               engines[filename], *args, **kwargs))
 
-                            tempFile.write(new_line)
+                # Merge each result as soon as it (and all earlier files) are done
+                for future, partPath in zip(futures, partPaths):
+                    (partCount, partStats) = future.result()
+                    count += partCount
+                    self.metrics.add(partStats)
 
-                        count = count+1
-                line = fout.readline()
+                    with self.metrics.stage("temp_write"), open(partPath, "rb") as part:
+                        shutil.copyfileobj(part, tempFile)
 
-            fout.close()
-            tempFile.close()
+        finally:
+            for partPath in partPaths:
+                if os.path.isfile(partPath):
+                    os.unlink(partPath)
 
-        return tempFilePath
+        return count
 
-    def _writeOutputFile(self, tempDataFile, outputPath, delimiter="default"):
+    def _getRowHeaders(self, tableID, columns="all"):
         """
-        Writes the output file and returns 1 if successful, if delimiter is not "default"
-        it modifies each output line accordingly to include chosen delimiter.
+        Reads in the dictionary to get the headers for each column (or just for the
+        selected `columns`).
         """
-        headerLine = ", ".join(self.rowHeaders)+"\n"
+        metadata_dir = settings.get_metadata_dir()
 
-        print("Getting size of temporary output file.")
-        size = os.path.getsize(tempDataFile)
+        inputFile = os.path.join(metadata_dir, "table_structures/%sTB.txt" % tableID)
 
-        if size > (10**6)*200:
-            print("File is bigger than 200MB so I'm not going to try filtering it.")
+        rowHeaders = [rh.strip().lower() for rh in open(inputFile).readlines()]
 
-            if outputPath == "display":
-                print("This file is too big to display so data has been saved to:")
+        if columns not in (None, "all"):
+            rowHeaders = [rowHeaders[i] for i in self._getColumnIndexes(tableID, columns)]
 
-                now = time.strftime(
-                    "%Y%m%d.%H%M%S", time.localtime(time.time()))
-                outputPath = os.path.join(tempfile.gettempdir(), "out_%s.txt" % now)
+        return rowHeaders
 
-            outputFile = open(outputPath, "w")
-            outputFile.write(headerLine)
+    def _writeFormatted(self, lines, outputPath):
+        """
+        Writes the rows in `lines` to `outputPath` in the typed output format (see
+        `midas_extract.formats`), reading them once.
+        """
+        count = formats.write_output(lines, outputPath, self.rowHeaders, self.output_format,
+                                     self.compress, self.compress_level)
 
-            dataFile = open(tempDataFile)
-            line = dataFile.readline()
+        if self.verbose:
+            print(f'{count} records written to: {outputPath}\n===\n')
 
-            while line:
-                outputFile.write(line)
-                line = dataFile.readline()
+    def _writeOutputFile(self, tempDataFile, outputPath, delimiter="default"):
+        """
+        Writes the rows in `tempDataFile` below a header line to `outputPath` (or to
+        standard output if it is "display") and returns 1. If delimiter is not
+        "default" it modifies each output line accordingly to include chosen delimiter.
 
-            dataFile.close()
-            outputFile.close()
+        The rows are streamed in chunks of about `_OUTPUT_CHUNK_BYTES`, so the memory
+        used does not depend on the size of the output.
+        """
+        if self.output_format != "text":
+            with open(tempDataFile) as dataFile:
+                self._writeFormatted(dataFile, outputPath)
 
-            print("\t{}".format(outputPath))
             os.unlink(tempDataFile)
-            return
-        else:
-            print("Can sort and filter since file is small.")
-
-        with open(tempDataFile) as dataFile:
-            rows = dataFile.readlines()
+            return 1
 
-        rows.insert(0, headerLine)
-
-        if delimiter != "default":
-            rows = self._reFormatDelimiters(rows, delimiter)
+        headerLine = ", ".join(self.rowHeaders)+"\n"
+        delimiter = self._getDelimiter(delimiter)
 
-        data = "".join(rows)
-        
         if outputPath == "display":
             print("Output data follows:\n")
-            print(data + "\n")
+            output = sys.stdout
 
-        else:
-            if len(rows) == 1:
+        elif os.path.getsize(tempDataFile) == 0:
+            if self.verbose:
                 print("===\nNo data found.\n===\n")
 
-                data = (
-"""Your extraction request has run successfully, but no 
-data have been found matching your request.
+            with self._openOutputFile(outputPath) as output:
+                output.write(NO_DATA_MESSAGE)
 
-Please use the MIDAS station search pages on the CEDA website 
-(http://archive.ceda.ac.uk/midas_stations/) to check your station 
-reporting periods and message types to ensure that your selected 
-stations report message types containing the data elements you 
-require within your selected period.
+            os.unlink(tempDataFile)
+            return 1
 
-Additional information about data outages/known issues/instrument 
-failure can also be found on station records.
+        else:
+            output = self._openOutputFile(outputPath)
 
-If you have completed these checks and believe the data should be 
-available please contact the CEDA helpdesk for further assistance 
-(support@ceda.ac.uk), providing full details of the extractions 
-you are trying to submit."""
-)
+        count = 0
 
-            output = open(outputPath, "w")
-            output.write(data)
-            output.close()
+        try:
+            output.write(self._reFormatDelimiters([headerLine], delimiter)[0])
+
+            with open(tempDataFile) as dataFile:
+                while True:
+                    lines = dataFile.readlines(_OUTPUT_CHUNK_BYTES)
+
+                    if not lines:
+                        break
 
-            if len(rows) > 1:
-                print(f'{len(rows)} records written to: {outputPath}\n===\n')
+                    count += len(lines)
+                    output.write("".join(self._reFormatDelimiters(lines, delimiter)))
+
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        if output is sys.stdout:
+            output.write("\n\n")
+        elif self.verbose:
+            # The count includes the header line
+            print(f'{count + 1} records written to: {outputPath}\n===\n')
 
         os.unlink(tempDataFile)
         return 1
 
+    def _openOutputFile(self, outputPath):
+        "Opens the output file for writing text, compressing it if requested."
+        return compression.open_output(outputPath, self.compress, self.compress_level,
+                                       background=self.compress_background)
+
+    def _getDelimiter(self, delimiter):
+        """
+        Returns the string that replaces ", " between output fields, or "default" if
+        they are left unchanged.
+        """
+        if delimiter in ("default", "comma", ","):
+            return "default"
+        elif delimiter == "tab":
+            return "\t"
+
+        return delimiter
+
     def _reFormatDelimiters(self, rows, delimiter):
         """
         Returns a list of rows with delimiters as requested.
         """
-        if delimiter in ("comma", ","):
+        delimiter = self._getDelimiter(delimiter)
+
+        if delimiter == "default":
             return rows
-        elif delimiter == "tab":
-            delimiter = "\t"
 
-        newRows = [delimiter.join(row.split(", ")) for row in rows]
-        return newRows
+        return [row.replace(", ", delimiter) for row in rows]
+
 
+def iter_records(table, start=None, end=None, src_ids=None, columns="all", conditions=None,
+                 region=None, as_dict=False, use_index=True, use_store=True):
+    """
+    Generator that yields the records of an extraction lazily, straight from the
+    scan of the partition files: nothing is written to disk and the scan stops
+    when the caller stops reading. The arguments are as for `MIDASSubsetter`.
 
+    Each record is a list of the (stripped) values of the selected columns, or a
+    dictionary of them keyed by column name if `as_dict` is True. For example:
+
+        for record in iter_records("TD", "201701010000", "201712312359", src_ids=["214"],
+                                   columns="ob_end_time,max_air_temp", as_dict=True):
+            ...
+    """
+    subsetter = MIDASSubsetter(table, None, start, end, columns, conditions, src_ids, region,
+                               verbose=False, use_index=use_index, use_store=use_store,
+                               run=False)
+    names = subsetter.rowHeaders
+
+    for line in subsetter.iterLines():
+        values = [value.strip() for value in line.split(",")]
+        yield dict(zip(names, values)) if as_dict else values
@@ -0,0 +1,198 @@
+"""
+synthetic.py
+============
+
+Writes a synthetic MIDAS archive for testing and benchmarking.
+
+`generate_archive` writes yearly partition files (in the
+``<data_dir>/<table>/yearly_files/midas_<name>_YYYYMM-YYYYMM.txt`` layout) for
+the daily temperature (TD) and daily rain (RD) tables, with their
+``table_structures`` files and the SRCE, GEAR and SRCC station metadata, for a
+configurable number of stations, years and observations per day. Rows are in
+time order, as in the archive. The same arguments (including `seed`) always
+write the same archive.
+
+Point ``MIDAS_DATA_DIR`` and ``MIDAS_METADATA_DIR`` at the directories it returns
+to use the archive. `read_stations` reads the stations of an archive written
+earlier back from its metadata.
+
+"""
+
+import os
+import random
+import datetime
+
+
+# Columns and file name of each table written
+TABLES = {
+    "TD": {"name": "tmpdrnl", "id_type": "DCNN",
+           "columns": ["ob_end_time", "id_type", "id", "ob_hour_count", "version_num",
+                       "met_domain_name", "src_id", "rec_st_ind", "max_air_temp",
+                       "min_air_temp", "min_grss_temp", "min_conc_temp"]},
+    "RD": {"name": "raindrnl", "id_type": "RAIN",
+           "columns": ["id", "id_type", "ob_date", "version_num", "met_domain_name",
+                       "ob_end_ctime", "ob_day_cnt", "src_id", "rec_st_ind", "prcp_amt",
+                       "ob_day_cnt_q", "prcp_amt_q", "prcp_amt_j"]},
+}
+
+COUNTIES = ["CORNWALL", "DEVON", "DORSET", "SOMERSET", "KENT", "ESSEX", "NORFOLK", "SUFFOLK",
+            "CUMBRIA", "NORTHUMBERLAND", "POWYS", "GWYNEDD", "FIFE", "HIGHLAND", "ANTRIM",
+            "SHETLAND"]
+
+# Extent of the station locations: (north, west, south, east)
+UK_BBOX = (60.8, -8.2, 49.9, 1.8)
+
+_SQL_HEADER = ["SQL*Plus: Release 11.2.0.4.0 Production [Oracle]", ""]
+
+
+def _write_lines(path, lines):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "w") as writer:
+        writer.write("\n".join(lines) + "\n")
+
+
+def _stations(nstations, rng, src_ids=None):
+    """
+    Returns a list of (src_id, lat, lon, geog_area_id) tuples for `nstations`
+    stations (or those with `src_ids`) scattered over the UK.
+    """
+    (n, w, s, e) = UK_BBOX
+
+    if src_ids:
+        src_ids = sorted(int(src_id) for src_id in src_ids)
+    else:
+        src_ids = sorted(rng.sample(range(1, nstations * 20 + 1), nstations))
+
+    return [(src_id, round(rng.uniform(s, n), 4), round(rng.uniform(w, e), 4),
+             100 + rng.randrange(len(COUNTIES))) for src_id in src_ids]
+
+
+def _obs_times(day, obs_per_day):
+    "Returns the observation times of `day`, spread evenly from 09:00."
+    step = 24 * 60 // obs_per_day
+    start = datetime.datetime(day.year, day.month, day.day, 9)
+    return [start + datetime.timedelta(minutes=step * i) for i in range(obs_per_day)]
+
+
+def _td_line(tm, src_id, rng):
+    max_temp = round(rng.gauss(18 if 5 <= tm.month <= 9 else 9, 4), 1)
+    min_grss = "" if rng.random() < 0.3 else f"{max_temp - 12:.1f}"
+
+    return (f"{tm:%Y-%m-%d %H:%M}, DCNN, {src_id * 3}, 12, 1, DLY3208, {src_id}, 1001, "
+            f"{max_temp}, {max_temp - rng.uniform(4, 10):.1f}, {min_grss}, "
+            f"{max_temp - 9:.1f}")
+
+
+def _rd_line(tm, src_id, rng):
+    rain = 0.0 if rng.random() < 0.55 else round(rng.expovariate(0.3), 1)
+
+    return (f"{src_id * 7}, RAIN, {tm:%Y-%m-%d %H:%M}, 1, DLY3208, 0900, 1, {src_id}, 1001, "
+            f"{rain}, 1, 0, ")
+
+
+_LINE_WRITERS = {"TD": _td_line, "RD": _rd_line}
+
+
+def _write_partition(path, tableID, stations, year, obs_per_day, rng):
+    "Writes one yearly partition file. Returns the number of rows written."
+    writeLine = _LINE_WRITERS[tableID]
+    day = datetime.date(year, 1, 1)
+    count = 0
+
+    with open(path, "w") as writer:
+        while day.year == year:
+            for tm in _obs_times(day, obs_per_day):
+                writer.write("".join(writeLine(tm, src_id, rng) + "\n"
+                                     for (src_id, _, _, _) in stations))
+                count += len(stations)
+
+            day += datetime.timedelta(days=1)
+
+    return count
+
+
+def _write_metadata(metadata_dir, stations, tables, years, rng):
+    "Writes the table structures and the SRCE, GEAR and SRCC metadata files."
+    structures = os.path.join(metadata_dir, "table_structures")
+
+    for tableID in tables:
+        _write_lines(os.path.join(structures, f"{tableID}TB.txt"), TABLES[tableID]["columns"])
+
+    _write_lines(os.path.join(structures, "SRTB.txt"),
+                 ["SRC_ID", "SRC_NAME", "HIGH_PRCN_LAT", "HIGH_PRCN_LON", "LOC_GEOG_AREA_ID"])
+    _write_lines(os.path.join(metadata_dir, "SRCE", "SRCE.DATA.COMMAS_REMOVED"), _SQL_HEADER + [
+        f"{src_id}, STATION {src_id}, {lat}, {lon}, {area}"
+        for (src_id, lat, lon, area) in stations])
+
+    _write_lines(os.path.join(structures, "GEOGRAPHIC_AREA.txt"),
+                 ["WTHN_GEOG_AREA_ID", "GEOG_AREA_NAME", "GEOG_AREA_TYPE"])
+    _write_lines(os.path.join(metadata_dir, "GEAR", "GEAR.DATA"), _SQL_HEADER + [
+        f"{100 + i}, {county}, COUNTY" for (i, county) in enumerate(COUNTIES)])
+
+    # Each station reports each table's message type over a period overlapping the data
+    _write_lines(os.path.join(structures, "SCTB.txt"),
+                 ["SRC_ID", "ID_TYPE", "SRC_CAP_BGN_DATE", "SRC_CAP_END_DATE"])
+    capabilities = []
+
+    for (src_id, _, _, _) in stations:
+        for tableID in tables:
+            begin = rng.randint(years[0] - 30, years[-1])
+            end = "" if rng.random() < 0.5 else f"{rng.randint(begin, years[-1] + 5)}-12-31 00:00"
+            capabilities.append(f"{src_id}, {TABLES[tableID]['id_type']}, "
+                                f"{begin}-01-01 00:00, {end}")
+
+    _write_lines(os.path.join(metadata_dir, "SRCC", "SRCC.DATA"), _SQL_HEADER + capabilities)
+
+
+def read_stations(metadata_dir):
+    """
+    Returns the list of (src_id, lat, lon, geog_area_id) tuples of the stations of
+    the archive with metadata in `metadata_dir`, as returned by `generate_archive`.
+    """
+    stations = []
+
+    with open(os.path.join(metadata_dir, "SRCE", "SRCE.DATA.COMMAS_REMOVED")) as reader:
+        for line in reader.readlines()[len(_SQL_HEADER):]:
+            if line.strip():
+                (src_id, _, lat, lon, area) = [field.strip() for field in line.split(",")]
+                stations.append((int(src_id), float(lat), float(lon), int(area)))
+
+    return stations
+
+
+def generate_archive(root, stations=100, years=2, obs_per_day=1, start_year=2017,
+                     tables=("TD", "RD"), seed=0, src_ids=None):
+    """
+    Writes a synthetic archive under directory `root` with `stations` stations
+    reporting `obs_per_day` observations a day for `years` years from `start_year`
+    in each of `tables`. If `src_ids` are given then the stations have those ids
+    (and `stations` is ignored). Returns a dictionary of:
+
+        {"data_dir": <path>, "metadata_dir": <path>, "files": [<partition file>, ...],
+         "rows": <number of rows>, "bytes": <size of the partition files>,
+         "stations": [(<src_id>, <lat>, <lon>, <geog_area_id>), ...]}
+    """
+    rng = random.Random(seed)
+    data_dir = os.path.join(root, "data")
+    metadata_dir = os.path.join(root, "metadata")
+    yearList = list(range(start_year, start_year + years))
+
+    stationList = _stations(stations, rng, src_ids)
+    _write_metadata(metadata_dir, stationList, tables, yearList, rng)
+
+    files = []
+    rows = 0
+
+    for tableID in tables:
+        partition_dir = os.path.join(data_dir, tableID, "yearly_files")
+        os.makedirs(partition_dir, exist_ok=True)
+
+        for year in yearList:
+            path = os.path.join(partition_dir,
+                                f"midas_{TABLES[tableID]['name']}_{year}01-{year}12.txt")
+            rows += _write_partition(path, tableID, stationList, year, obs_per_day, rng)
+            files.append(path)
+
+    return {"data_dir": data_dir, "metadata_dir": metadata_dir, "files": files, "rows": rows,
+            "bytes": sum(os.path.getsize(path) for path in files), "stations": stationList}
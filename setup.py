@@ -26,7 +26,14 @@ with open("README.md") as readme_file:
     _long_description = readme_file.read()
 
 
-requirements = ['Click>=6.0', ]
+requirements = ['Click>=6.0', 'numpy', ]
+
+extras_requirements = {
+    'columnar': ['pyarrow'],
+    'zstd': ['zstandard'],
+    'netcdf': ['pyarrow', 'netCDF4'],
+    'pandas': ['pandas'],
+}
 
 setup_requirements = ['pytest-runner', ]
 
@@ -76,6 +83,7 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require=extras_requirements,
     long_description=_long_description,
     long_description_content_type='text/markdown',
 
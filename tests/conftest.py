@@ -4,7 +4,9 @@ import shutil
 import pytest
 from pathlib import Path
 
+from midas_extract import synthetic
 from midas_extract.testing import get_file_path
+from midas_extract.subsetter import MIDASSubsetter
 
 home = Path.home()
 mini_ceda_archive = opj(home.as_posix(), '.mini_ceda_archive', 'archive')
@@ -52,3 +54,100 @@ def midas_metadata():
     return resp
 
 
+
+_SRC_IDS = [30, 214, 926, 1001]
+
+
+@pytest.fixture
+def synthetic_archive(tmp_path, monkeypatch):
+    """
+    Writes a small synthetic archive (see `midas_extract.synthetic`): the TD and RD
+    tables for 2017-2019, with twice-daily obs (at 09:00 and 21:00) for 4 stations,
+    and points the settings at it. Returns the paths of the TD partition files.
+    """
+    archive = synthetic.generate_archive(tmp_path.as_posix(), years=3, obs_per_day=2,
+                                         src_ids=_SRC_IDS)
+
+    monkeypatch.setenv('MIDAS_DATA_DIR', archive['data_dir'])
+    monkeypatch.setenv('MIDAS_METADATA_DIR', archive['metadata_dir'])
+    monkeypatch.delenv('MIDAS_INDEX_DIR', raising=False)
+    monkeypatch.delenv('MIDAS_COLUMNAR_DIR', raising=False)
+    monkeypatch.delenv('MIDAS_CATALOGUE_DIR', raising=False)
+    monkeypatch.delenv('MIDAS_CACHE_DIR', raising=False)
+    monkeypatch.delenv('MIDAS_STATIONS_DB', raising=False)
+    monkeypatch.setenv('MIDAS_SERVER_SOCKET', (tmp_path / 'server.sock').as_posix())
+    return [path for path in archive['files'] if '/TD/' in path]
+
+
+class Extraction:
+    "The `MIDASSubsetter` of an extraction run by the `extract` fixture and its output file."
+
+    def __init__(self, subsetter):
+        self.subsetter = subsetter
+        self.path = Path(subsetter.outputPath)
+
+    @property
+    def text(self):
+        return self.path.read_text()
+
+    @property
+    def lines(self):
+        return self.text.splitlines()
+
+
+@pytest.fixture
+def extract(tmp_path):
+    """
+    Returns a function that extracts from `table` (with the other arguments of
+    `MIDASSubsetter`) to the file `name` in `tmp_path` and returns an `Extraction`.
+    """
+    def _extract(name, table='TD', startTime=None, endTime=None, **kwargs):
+        kwargs.setdefault('verbose', False)
+        subsetter = MIDASSubsetter(table, (tmp_path / name).as_posix(), startTime, endTime,
+                                   tmp_dir=tmp_path.as_posix(), **kwargs)
+        return Extraction(subsetter)
+
+    return _extract
+
+
+_SOURCE = [('214', 50.2, -5.1, '11'), ('30', 50.7, -3.5, '12'), ('926', 51.4, 0.3, '13'),
+           ('1001', 60.1, -1.2, '14'), ('77', 'x', 'y', '12')]
+_GEOG = [('11', 'COUNTY', 'CORNWALL'), ('12', 'COUNTY', 'DEVON'), ('13', 'county', 'KENT'),
+         ('14', 'REGION', 'SHETLAND')]
+_SRCC = [('30', 'RAIN', '1990-01-01 00:00', '2010-12-31 00:00'),
+         ('214', 'DCNN', '1950-01-01 00:00', '2020-12-31 00:00'),
+         ('30', 'DCNN', '1980-01-01 00:00', '2030-12-31 00:00'),
+         ('926', 'RAIN', '2005-06-01 00:00', '2030-12-31 00:00'),
+         ('1001', 'RAIN', '2000-01-01 00:00', '')]
+
+
+def _write(path, lines):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as writer:
+        writer.write('\n'.join(lines) + '\n')
+
+
+@pytest.fixture
+def station_metadata(tmp_path, monkeypatch):
+    "Writes a small set of station metadata files."
+    metadata_dir = tmp_path / 'metadata'
+    header = ['SQL*Plus: Release 11 [Oracle]', '']
+
+    _write(metadata_dir / 'table_structures' / 'SRTB.txt',
+           ['SRC_ID', 'SRC_NAME', 'HIGH_PRCN_LAT', 'HIGH_PRCN_LON', 'LOC_GEOG_AREA_ID'])
+    _write(metadata_dir / 'SRCE' / 'SRCE.DATA.COMMAS_REMOVED', header + [
+        f'{src_id}, STATION {src_id}, {lat}, {lon}, {area}' for (src_id, lat, lon, area) in _SOURCE])
+
+    _write(metadata_dir / 'table_structures' / 'GEOGRAPHIC_AREA.txt',
+           ['WTHN_GEOG_AREA_ID', 'GEOG_AREA_NAME', 'GEOG_AREA_TYPE'])
+    _write(metadata_dir / 'GEAR' / 'GEAR.DATA', header + [
+        f'{area}, {name}, {area_type}' for (area, area_type, name) in _GEOG])
+
+    _write(metadata_dir / 'table_structures' / 'SCTB.txt',
+           ['SRC_ID', 'ID_TYPE', 'SRC_CAP_BGN_DATE', 'SRC_CAP_END_DATE'])
+    _write(metadata_dir / 'SRCC' / 'SRCC.DATA', header + [', '.join(row) for row in _SRCC])
+
+    monkeypatch.setenv('MIDAS_METADATA_DIR', metadata_dir.as_posix())
+    monkeypatch.delenv('MIDAS_STATIONS_DB', raising=False)
+    monkeypatch.setenv('MIDAS_SERVER_SOCKET', (tmp_path / 'server.sock').as_posix())
+    return metadata_dir
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `midas_extract.batch`."""
+
+__author__ = """Ag Stephens"""
+__contact__ = 'ag.stephens@stfc.ac.uk'
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__version__ = "0.1.0"
+
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from midas_extract import batch
+from midas_extract import cli
+from midas_extract import indexing
+from midas_extract.subsetter import MIDASSubsetter
+
+
+JOBS = [
+    {'table': 'TD', 'start': '201712200000', 'end': '201801102359'},
+    {'table': 'TD', 'start': '201801050000', 'end': '201803312359', 'src_ids': '214,926'},
+    {'table': 'TD', 'start': '201802010000', 'end': '201802282359',
+     'columns': 'src_id,ob_end_time,max_air_temp', 'conditions': 'max_air_temp:greater_than=12'},
+    {'table': 'TD', 'start': '201906010000', 'end': '201906022359', 'delimiter': 'tab'},
+]
+
+
+def _run_alone(job, path, tmp_path):
+    args = batch.parse_job(dict(job, output_filepath=path))
+    MIDASSubsetter(verbose=False, tmp_dir=tmp_path.as_posix(), **args)
+
+
+@pytest.mark.parametrize('use_index', [False, True])
+def test_batch_matches_separate_extractions(synthetic_archive, tmp_path, monkeypatch, use_index):
+    if use_index:
+        indexing.build_table_indexes('TD', block_lines=50, verbose=False)
+
+    scanned = []
+    scan_file = batch.scan_file
+    monkeypatch.setattr(batch, 'scan_file',
+                        lambda filename, *args, **kwargs: scanned.append(filename) or
+                        scan_file(filename, *args, **kwargs))
+
+    jobs = [dict(job, output_filepath=(tmp_path / f'batch_{i}.txt').as_posix())
+            for (i, job) in enumerate(JOBS)]
+    counts = batch.run_batch(jobs, tmp_dir=tmp_path.as_posix(), use_index=use_index, verbose=False)
+
+    # Each file is read once, however many jobs need it
+    assert scanned == synthetic_archive
+
+    for (i, job) in enumerate(JOBS):
+        alone = tmp_path / f'alone_{i}.txt'
+        _run_alone(job, alone.as_posix(), tmp_path)
+
+        output = (tmp_path / f'batch_{i}.txt').read_text()
+        assert output == alone.read_text()
+        assert output.count('\n') == counts[i] + 1
+
+    assert counts[:2] == [22 * 2 * 4, 86 * 2 * 2] and counts[2] > 0
+
+
+def test_batch_cli(synthetic_archive, tmp_path):
+    jobs = tmp_path / 'jobs.jsonl'
+    jobs.write_text(''.join(json.dumps(dict(job, output_filepath=(tmp_path / f'{i}.txt').as_posix()))
+                            + '\n' for (i, job) in enumerate(JOBS[:2])))
+
+    result = CliRunner().invoke(cli.main, ['extract', '--batch', jobs.as_posix(),
+                                           '-p', tmp_path.as_posix()])
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / '1.txt').read_text().count('\n') == 1 + 86 * 2 * 2
+
+    jobs.write_text(json.dumps({'table': 'TD', 'stations': '214'}) + '\n')
+    result = CliRunner().invoke(cli.main, ['extract', '--batch', jobs.as_posix()])
+    assert result.exit_code != 0 and 'Batch job keys not known: stations' in result.output
+
+
+def test_batch_cli_rejects_other_options(synthetic_archive, tmp_path):
+    jobs = tmp_path / 'jobs.jsonl'
+    jobs.write_text(json.dumps(JOBS[0]) + '\n')
+
+    result = CliRunner().invoke(cli.main, ['extract', '--batch', jobs.as_posix(), '-t', 'RD',
+                                           '--format', 'parquet'])
+    assert result.exit_code == 2
+    assert '--batch cannot be combined with --table, --format' in result.output
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `midas_extract.bbox_utils`."""
+
+__author__ = """Ag Stephens"""
+__contact__ = 'ag.stephens@stfc.ac.uk'
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__version__ = "0.1.0"
+
+import numpy as np
+import pytest
+
+from midas_extract import bbox_utils
+
+
+BBOXES = [(50, -200, 20, -150), (-30, -10, -60, 15), (-30, 45, -80, 160),
+          (54, 0, 52, 3), (90, -360, -90, 360), (10, -5, 10, -5)]
+
+
+@pytest.mark.parametrize('bbox', BBOXES)
+def test_is_in_bbox_array_matches_scalar(bbox):
+    lats, lons = np.meshgrid(np.arange(-90, 91, 2.5), np.arange(-360, 361, 2.5))
+    lats, lons = lats.ravel(), lons.ravel()
+
+    expected = [bbox_utils.is_in_bbox(lat, lon, *bbox) for lat, lon in zip(lats, lons)]
+    assert bbox_utils.is_in_bbox_array(lats, lons, *bbox).tolist() == expected
+
+
+def test_is_in_bbox_array_validates_box():
+    with pytest.raises(ValueError):
+        bbox_utils.is_in_bbox_array([], [], 10, 5, 20, 6)
+
+    with pytest.raises(ValueError):
+        bbox_utils.is_in_bbox_array([], [], 10, 5, 0, -6)
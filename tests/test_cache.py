@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `midas_extract.cache`."""
+
+__author__ = """Ag Stephens"""
+__contact__ = 'ag.stephens@stfc.ac.uk'
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__version__ = "0.1.0"
+
+import os
+import time
+import threading
+
+import pytest
+
+from midas_extract import cache
+from midas_extract.conditions import ConditionSet
+from midas_extract.subsetter import MIDASSubsetter
+
+
+REQUEST = dict(table='TD', startTime='201802010000', endTime='201802102359',
+               src_ids=['926', '214'])
+
+
+@pytest.fixture
+def cache_dir(synthetic_archive, tmp_path, monkeypatch):
+    path = tmp_path / 'cache'
+    monkeypatch.setenv('MIDAS_CACHE_DIR', path.as_posix())
+    return path
+
+
+@pytest.fixture
+def scans(monkeypatch):
+    "Counts the extractions that scan the partition files."
+    calls = []
+    extractRows = MIDASSubsetter._extractRows
+
+    def _extractRows(self):
+        calls.append(self.tableID)
+        time.sleep(0.2)
+        return extractRows(self)
+
+    monkeypatch.setattr(MIDASSubsetter, '_extractRows', _extractRows)
+    return calls
+
+
+def test_repeated_extraction_uses_cache(cache_dir, scans, extract):
+    first = extract('a.txt', **REQUEST).text
+    assert extract('b.txt', **dict(REQUEST, src_ids=['214', '926']), delimiter='tab').text == \
+        first.replace(', ', '\t')
+    assert len(scans) == 1 and len(list(cache_dir.glob('*.rows'))) == 1
+
+    # Different columns are a different request
+    extract('c.txt', **REQUEST, columns='src_id,max_air_temp')
+    assert len(scans) == 2
+
+
+def test_changed_partition_file_is_not_served_from_cache(cache_dir, scans, extract,
+                                                         synthetic_archive):
+    first = extract('a.txt', **REQUEST).text
+
+    with open(synthetic_archive[1], 'a') as writer:
+        writer.write('\n')
+
+    assert extract('b.txt', **REQUEST).text == first
+    assert len(scans) == 2
+
+
+def test_concurrent_requests_are_coalesced(cache_dir, scans, extract, tmp_path):
+    threads = [threading.Thread(target=extract, args=(f'{i}.txt',), kwargs=REQUEST)
+               for i in range(4)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(scans) == 1
+    assert len({(tmp_path / f'{i}.txt').read_text() for i in range(4)}) == 1
+
+
+def test_evict_least_recently_used(tmp_path):
+    for (i, name) in enumerate(['a', 'b', 'c']):
+        path = tmp_path / f'{name}.rows'
+        path.write_bytes(b'x' * 100)
+        os.utime(path, ns=(i * 10 ** 9, i * 10 ** 9))
+
+    # Reading an entry makes it the most recently used
+    os.unlink(cache._checkout((tmp_path / 'a.rows').as_posix(), tmp_path.as_posix()))
+
+    assert cache.evict(tmp_path.as_posix(), 250) == 1
+    assert sorted(path.name for path in tmp_path.glob('*.rows')) == ['a.rows', 'c.rows']
+
+
+@pytest.mark.parametrize('conditions', [
+    ('max_air_temp:greater_than=25.5', 'max_air_temp:greater_than=25.500001'),
+    ('src_id:range=1234567:1234999', 'src_id:range=1234568:1234999'),
+])
+def test_key_uses_exact_condition_values(conditions):
+    columns = ['src_id', 'max_air_temp']
+    keys = {cache.make_key('TD', 201801010000, 201812312359,
+                           conditions=ConditionSet(conds, columns)) for conds in conditions}
+    assert len(keys) == 2
+
+
+def test_different_requests_do_not_wait(cache_dir, tmp_path):
+    (started, release) = (threading.Event(), threading.Event())
+
+    def _rows(name, wait=False):
+        if wait:
+            started.set()
+            release.wait(5)
+        path = tmp_path / name
+        path.write_text(name)
+        return path.as_posix()
+
+    # Keys that shared a lock stripe before each key had its own lock
+    (slow_key, fast_key) = ('a' * 64, 'b' + 'a' * 63)
+    thread = threading.Thread(target=cache.fetch, args=(slow_key, lambda: _rows('slow', True)))
+    thread.start()
+    started.wait(5)
+
+    try:
+        assert open(cache.fetch(fast_key, lambda: _rows('fast'))).read() == 'fast'
+        assert not release.is_set() and thread.is_alive()
+    finally:
+        release.set()
+        thread.join()
+
+    # Lock files are removed with their entries
+    assert len(list(cache_dir.glob('locks/*.lock'))) == 2
+    cache.evict(cache_dir.as_posix(), 0)
+    assert list(cache_dir.glob('*.rows')) == list(cache_dir.glob('locks/*.lock')) == []
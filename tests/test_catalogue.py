@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `midas_extract.catalogue`."""
+
+__author__ = """Ag Stephens"""
+__contact__ = 'ag.stephens@stfc.ac.uk'
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__version__ = "0.1.0"
+
+import json
+import os
+
+from midas_extract import catalogue
+
+
+def test_catalogue_lists_partitions(synthetic_archive):
+    partitions = catalogue.get_partitions('TD')
+
+    assert [p['path'] for p in partitions] == synthetic_archive
+    assert (partitions[0]['start'], partitions[0]['end']) == (201701, 201712)
+    assert partitions[0]['size'] == os.path.getsize(synthetic_archive[0])
+    assert catalogue.get_partitions('WH') == []
+
+    with open(catalogue.get_catalogue_path('TD')) as reader:
+        assert len(json.load(reader)['partitions']) == 3
+
+
+def test_saved_catalogue_is_used(synthetic_archive, monkeypatch):
+    catalogue.get_partitions('TD')
+    catalogue._catalogues.clear()
+
+    def fail(partition_dir):
+        raise AssertionError('directory was listed')
+
+    monkeypatch.setattr(catalogue, 'build_catalogue', fail)
+    assert catalogue.get_partition_files('TD') == synthetic_archive
+
+
+def test_catalogue_rebuilt_when_directory_changes(synthetic_archive):
+    catalogue.get_partitions('TD')
+
+    partition_dir = os.path.dirname(synthetic_archive[0])
+    new_file = os.path.join(partition_dir, 'midas_tmpdrnl_202001-202012.txt')
+    open(new_file, 'w').close()
+
+    # Make sure the directory mtime changes on coarse-grained filesystems
+    st = os.stat(partition_dir)
+    os.utime(partition_dir, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    assert catalogue.get_partition_files('TD') == synthetic_archive + [new_file]
+
+
+def test_catalogue_dir_setting(synthetic_archive, tmp_path, monkeypatch):
+    monkeypatch.setenv('MIDAS_CATALOGUE_DIR', (tmp_path / 'catalogues').as_posix())
+    catalogue._catalogues.clear()
+
+    catalogue.get_partitions('TD')
+    assert os.listdir(tmp_path / 'catalogues') == ['TD_partition_catalogue.json']
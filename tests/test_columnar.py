@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `midas_extract.columnar`."""
+
+__author__ = """Ag Stephens"""
+__contact__ = 'ag.stephens@stfc.ac.uk'
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__version__ = "0.1.0"
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+
+from midas_extract import columnar
+
+
+def test_convert_table_types(synthetic_archive):
+    written = columnar.convert_table('TD', row_group_size=500, verbose=False)
+    assert len(written) == 3
+    assert all(columnar.has_store(f) for f in synthetic_archive)
+
+    schema = pq.read_schema(written[0])
+    assert pa.types.is_timestamp(schema.field('ob_end_time').type)
+    assert schema.field('src_id').type == pa.int64()
+    assert schema.field('max_air_temp').type == pa.float64()
+    assert schema.field('id_type').type == pa.string()
+    assert pq.ParquetFile(written[0]).num_row_groups > 1
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'startTime': '201712150000', 'endTime': '201801152100'},
+    {'startTime': '201703010000', 'endTime': '201905010000', 'src_ids': ['214', '0030', '30']},
+    {'startTime': '201703010000', 'endTime': '201905010000', 'src_ids': ['926'], 'workers': 2},
+])
+def test_extract_from_store_matches_text(synthetic_archive, extract, kwargs):
+    expected = extract('text.txt', use_store=False, **kwargs).text
+
+    columnar.convert_table('TD', row_group_size=500, verbose=False)
+    assert extract('store.txt', **kwargs).text == expected
+
+
+def test_iter_records_from_store(synthetic_archive):
+    from midas_extract.subsetter import iter_records
+
+    kwargs = {'start': '201712150000', 'end': '201801152100', 'src_ids': ['214'],
+              'columns': 'ob_end_time,max_air_temp'}
+    expected = list(iter_records('TD', use_store=False, **kwargs))
+
+    columnar.convert_table('TD', row_group_size=500, verbose=False)
+    assert list(iter_records('TD', **kwargs)) == expected
+    assert len(expected) == 2 * 32
+
+
+def test_stale_store_is_ignored(synthetic_archive):
+    columnar.convert_table('TD', verbose=False)
+
+    with open(synthetic_archive[0], 'a') as writer:
+        writer.write('\n')
+
+    assert not columnar.has_store(synthetic_archive[0])
+    assert columnar.has_store(synthetic_archive[1])
+
+
+def test_measurements_are_stored_as_floats(synthetic_archive):
+    written = columnar.convert_table('TD', verbose=False)
+    schema = pq.read_schema(written[0])
+
+    for name in ('max_air_temp', 'min_air_temp', 'min_grss_temp', 'min_conc_temp'):
+        assert schema.field(name).type == pa.float64()
+
+    assert pq.read_schema(columnar.convert_table('RD', verbose=False)[0]).field(
+        'prcp_amt').type == pa.float64()
+
+
+@pytest.mark.parametrize('table', ['TD', 'RD'])
+def test_synthetic_archive_round_trips(synthetic_archive, extract, table):
+    kwargs = {'startTime': '201712150000', 'endTime': '201801152100'}
+    expected = extract('text.txt', table=table, use_store=False, **kwargs).text
+
+    assert len(columnar.convert_table(table, verbose=False)) == 3
+    assert extract('store.txt', table=table, **kwargs).text == expected
+
+
+def test_failed_conversion_raises(synthetic_archive):
+    with open(synthetic_archive[0], 'a') as writer:
+        writer.write('2017-12-31 21:00, DCNN, 3\n')
+
+    with pytest.raises(Exception, match='Could not convert 1 of 3'):
+        columnar.convert_table('TD', verbose=False)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `midas_extract.compression`."""
+
+__author__ = """Ag Stephens"""
+__contact__ = 'ag.stephens@stfc.ac.uk'
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__version__ = "0.1.0"
+
+import bz2
+import gzip
+import lzma
+import os
+
+import pytest
+
+from midas_extract import batch
+from midas_extract import catalogue
+from midas_extract import compression
+from midas_extract.subsetter import MIDASSubsetter
+
+
+START, END = '201712250000', '201801102359'
+
+COMPRESSORS = {'.gz': gzip.compress, '.bz2': bz2.compress, '.xz': lzma.compress}
+
+if compression.zstandard is not None:
+    COMPRESSORS['.zst'] = compression.zstandard.ZstdCompressor().compress
+
+
+def _compress(path, suffix, keep=False):
+    with open(path, 'rb') as reader:
+        data = reader.read()
+
+    with open(path + suffix, 'wb') as writer:
+        writer.write(COMPRESSORS[suffix](data))
+
+    if not keep:
+        os.unlink(path)
+
+    catalogue._catalogues.clear()
+    return path + suffix
+
+
+@pytest.mark.parametrize('suffix', sorted(COMPRESSORS))
+def test_extract_from_compressed_files(synthetic_archive, tmp_path, extract, suffix):
+    kwargs = [{}, {'src_ids': ['214']}, {'columns': 'src_id,max_air_temp'}]
+    expected = [extract(f'plain_{i}.txt', 'TD', START, END, **args).text
+                for (i, args) in enumerate(kwargs)]
+
+    compressed = [_compress(path, suffix) for path in synthetic_archive[:2]]
+    partitions = catalogue.get_partitions('TD')
+
+    assert [p['path'] for p in partitions] == compressed + synthetic_archive[2:]
+    assert partitions[0]['compression'] == compression.COMPRESSION_SUFFIXES[suffix]
+
+    for (i, args) in enumerate(kwargs):
+        assert extract(f'compressed_{i}.txt', 'TD', START, END, engine='mmap',
+                       **args).text == expected[i]
+
+    jobs = [dict(args, table='TD', start=START, end=END,
+                 output_filepath=(tmp_path / f'batch_{i}.txt').as_posix())
+            for (i, args) in enumerate(kwargs)]
+    batch.run_batch(jobs, tmp_dir=tmp_path.as_posix(), verbose=False)
+
+    assert [(tmp_path / f'batch_{i}.txt').read_text() for i in range(3)] == expected
+
+
+def test_uncompressed_file_is_preferred(synthetic_archive):
+    _compress(synthetic_archive[0], '.gz', keep=True)
+    assert catalogue.get_partition_files('TD') == synthetic_archive
+
+
+def test_prefetch_reader_stops_early(synthetic_archive, monkeypatch):
+    monkeypatch.setattr(compression, 'CHUNK_BYTES', 1024)
+    path = _compress(synthetic_archive[0], '.gz', keep=True)
+
+    with compression.open_partition(path) as reader:
+        first = reader.readline()
+
+    with open(synthetic_archive[0]) as plain:
+        assert first == plain.readline()
+
+    (data, consumed) = compression.sample(path, 4096)
+    assert len(data) == 4096 and 0 < consumed < os.path.getsize(path)
+
+
+@pytest.mark.parametrize('compress', ['gzip', 'zstd'])
+@pytest.mark.parametrize('background', [False, True])
+def test_compressed_output(synthetic_archive, tmp_path, extract, compress, background):
+    if compress == 'zstd' and compression.zstandard is None:
+        pytest.skip('zstandard is not installed')
+
+    expected = extract('plain.txt', 'TD', START, END, delimiter='tab').text
+    subsetter = extract('out.txt', 'TD', START, END, delimiter='tab', compress=compress,
+                        compress_level=1, compress_background=background).subsetter
+
+    suffix = compression.OUTPUT_SUFFIXES[compress]
+    assert subsetter.outputPath == (tmp_path / 'out.txt').as_posix() + suffix
+
+    # The output can be read back as a compressed partition file
+    with compression.open_partition(subsetter.outputPath) as reader:
+        assert reader.read() == expected
+
+    with pytest.raises(Exception, match='output file'):
+        MIDASSubsetter('TD', 'display', verbose=False, compress=compress)
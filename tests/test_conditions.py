@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `midas_extract.conditions`."""
+
+__author__ = """Ag Stephens"""
+__contact__ = 'ag.stephens@stfc.ac.uk'
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__version__ = "0.1.0"
+
+import numpy as np
+import pytest
+
+from midas_extract import columnar
+from midas_extract.conditions import ConditionSet, parse_conditions
+
+
+COLUMNS = ['ob_time', 'src_id', 'temp', 'flag']
+
+START, END = '201801010000', '201803312359'
+
+
+def test_parse_conditions():
+    assert parse_conditions('temp:range=1:5,greater_than=3') == [
+        ('temp', 'range', '1:5'), (None, 'greater_than', '3')]
+    assert parse_conditions({'exact': 'A'}) == [(None, 'exact', 'A')]
+
+    with pytest.raises(Exception):
+        parse_conditions('temp:between=1:5')
+
+
+def test_condition_set_evaluate():
+    chunk = {2: np.array(['1.5', '', '7', 'x', '3'], dtype=object),
+             3: np.array(['A', 'B', 'AB', 'A', 'BA'], dtype=object)}
+
+    conds = ConditionSet('temp:range=1:5', COLUMNS)
+    assert conds.evaluate(chunk, 5).tolist() == [True, False, False, False, True]
+
+    conds = ConditionSet('temp:greater_than=1.5,flag:pattern=^A', COLUMNS)
+    assert conds.evaluate(chunk, 5).tolist() == [False, False, True, False, False]
+
+    conds = ConditionSet('exact=A', COLUMNS, defaultColumns=[3])
+    assert conds.evaluate(chunk, 5).tolist() == [True, False, False, True, False]
+    assert conds.numericColumns == set()
+
+    with pytest.raises(Exception):
+        ConditionSet('less_than=3', COLUMNS)
+
+
+def test_extract_with_conditions(synthetic_archive, extract):
+    rows = extract('out.txt', 'TD', START, END, columns='ob_end_time,src_id,max_air_temp',
+                   conditions='max_air_temp:greater_than=15.5,src_id:exact=214').lines
+
+    assert rows[0] == 'ob_end_time, src_id, max_air_temp'
+    assert len(rows) > 1
+    for row in rows[1:]:
+        (_, src_id, max_air_temp) = row.split(', ')
+        assert src_id == '214' and float(max_air_temp) > 15.5
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'columns': [7, 9], 'conditions': 'range=20:28'},
+    {'conditions': 'id_type:pattern=^DC,max_air_temp:less_than=3', 'src_ids': ['30', '926']},
+])
+def test_conditions_match_across_engines(synthetic_archive, extract, kwargs):
+    pytest.importorskip('pyarrow')
+    expected = extract('text.txt', 'TD', START, END, use_store=False, **kwargs).lines
+
+    columnar.convert_table('TD', row_group_size=100, verbose=False)
+    assert extract('store.txt', 'TD', START, END, **kwargs).lines == expected
+    assert extract('parallel.txt', 'TD', START, END, use_store=False, workers=2,
+                   **kwargs).lines == expected
+    assert len(expected) > 1
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `midas_extract.formats`."""
+
+__author__ = """Ag Stephens"""
+__contact__ = 'ag.stephens@stfc.ac.uk'
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__version__ = "0.1.0"
+
+import datetime
+
+import pytest
+
+from midas_extract import formats
+from midas_extract import reader
+from midas_extract.subsetter import MIDASSubsetter
+
+pa = pytest.importorskip('pyarrow')
+
+
+REQUEST = dict(table='TD', startTime='201712250000', endTime='201801102359',
+               src_ids=['214', '30'])
+
+
+def _text_rows(extract, **kwargs):
+    lines = extract('out.txt', **REQUEST, **kwargs).lines
+    return lines[0].split(', '), [line.split(', ') for line in lines[1:]]
+
+
+def _read(output_format, path):
+    if output_format == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_table(path)
+
+    with pa.memory_map(path.as_posix()) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+@pytest.mark.parametrize('output_format', ['parquet', 'feather'])
+@pytest.mark.parametrize('compress', [None, 'zstd'])
+def test_arrow_formats_match_text(synthetic_archive, extract, monkeypatch, output_format,
+                                  compress):
+    # Several batches (row groups) per output file
+    monkeypatch.setattr(formats, 'DEFAULT_BATCH_ROWS', 25)
+
+    (names, rows) = _text_rows(extract)
+    path = extract(f'out.{output_format}', **REQUEST, output_format=output_format,
+                   compress=compress).path
+    table = _read(output_format, path)
+
+    assert table.column_names == names and table.num_rows == len(rows) == 17 * 2 * 2
+    # Parquet has no second resolution so stores times in milliseconds
+    assert pa.types.is_timestamp(table.schema.types[0])
+    assert [str(typ) for typ in table.schema.types[1:]] == \
+        ['string', 'int64', 'int64', 'int64', 'string', 'int64', 'int64', 'double', 'double',
+         'double', 'double']
+
+    first = table.slice(0, 1).to_pylist()[0]
+    assert first['ob_end_time'] == datetime.datetime(2017, 12, 25, 9, 0)
+    assert first['src_id'] == int(rows[0][6]) and first['max_air_temp'] == float(rows[0][8])
+    assert first['min_grss_temp'] == (float(rows[0][10]) if rows[0][10] else None)
+    assert table.column('min_grss_temp').null_count == sum(1 for row in rows if not row[10])
+
+    if output_format == 'parquet':
+        import pyarrow.parquet as pq
+        assert pq.ParquetFile(path).num_row_groups == 3
+
+
+def test_types_match_read_table(synthetic_archive, extract):
+    import pyarrow.parquet as pq
+
+    request = dict(startTime='201703010000', endTime='201703312359')
+    table = pq.read_table(extract('rd.parquet', table='RD', output_format='parquet',
+                                  **request).path)
+    types = dict(zip(table.column_names, map(str, table.schema.types)))
+
+    assert types['prcp_amt'] == 'double' and types['ob_day_cnt'] == 'int64'
+    assert types['ob_end_ctime'] == types['prcp_amt_j'] == 'string'
+    assert pa.types.is_timestamp(table.schema.field('ob_date').type)
+
+    array = reader.read_table('RD', start=request['startTime'], end=request['endTime'],
+                              output='numpy')
+    assert table.num_rows == len(array) == 31 * 2 * 4
+    assert table.column('prcp_amt').to_pylist() == array['prcp_amt'].tolist()
+    assert table.column('src_id').to_pylist() == array['src_id'].tolist()
+
+
+def test_parquet_row_groups_and_columns(synthetic_archive, extract):
+    import pyarrow.parquet as pq
+
+    (names, rows) = _text_rows(extract, columns='src_id,max_air_temp')
+    path = extract('out.parquet', **REQUEST, output_format='parquet',
+                   columns='src_id,max_air_temp').path
+
+    table = pq.read_table(path)
+    assert table.column_names == names == ['src_id', 'max_air_temp']
+    assert table.to_pydict()['src_id'] == [int(row[0]) for row in rows]
+
+
+def test_netcdf_format(synthetic_archive, extract):
+    netCDF4 = pytest.importorskip('netCDF4')
+
+    (names, rows) = _text_rows(extract)
+    path = extract('out.nc', **REQUEST, output_format='netcdf').path
+
+    with netCDF4.Dataset(path) as dataset:
+        assert list(dataset.variables) == names
+        assert list(dataset['src_id'][:]) == [int(row[6]) for row in rows]
+        assert dataset['ob_end_time'].units.startswith('seconds since 1970')
+
+
+def test_binary_format_needs_output_file(synthetic_archive):
+    with pytest.raises(Exception, match='must be written to an output file'):
+        MIDASSubsetter('TD', 'display', verbose=False, output_format='parquet')
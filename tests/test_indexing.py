@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `midas_extract.indexing`."""
+
+__author__ = """Ag Stephens"""
+__contact__ = 'ag.stephens@stfc.ac.uk'
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__version__ = "0.1.0"
+
+import os
+
+from midas_extract import indexing
+
+
+def test_build_and_load_index(synthetic_archive):
+    written = indexing.build_table_indexes('TD', block_lines=100, verbose=False)
+    assert len(written) == 3
+
+    index = indexing.load_index(synthetic_archive[0])
+    assert index['block_lines'] == 100
+    assert index['offsets'][0] == 0
+    assert index['prefix_max'] == sorted(index['prefix_max'])
+
+
+def test_index_seek_offset(synthetic_archive):
+    indexing.build_table_indexes('TD', block_lines=100, verbose=False)
+    fpath = synthetic_archive[1]
+    index = indexing.load_index(fpath)
+
+    offset = indexing.find_start_offset(index, 201807010000)
+    assert offset > 0
+
+    with open(fpath) as reader:
+        head = reader.read(offset)
+        rest = reader.read()
+
+    assert '2018-07-01 09:00' not in head
+    assert rest.startswith('2018-06')
+
+
+def test_stale_index_is_ignored(synthetic_archive):
+    indexing.build_table_indexes('TD', block_lines=100, verbose=False)
+    fpath = synthetic_archive[0]
+
+    with open(fpath, 'a') as writer:
+        writer.write('\n')
+
+    assert indexing.load_index(fpath) is None
+
+
+def test_index_dir_setting(synthetic_archive, tmp_path, monkeypatch):
+    index_dir = tmp_path / 'indexes'
+    monkeypatch.setenv('MIDAS_INDEX_DIR', index_dir.as_posix())
+
+    indexing.build_table_indexes('TD', verbose=False)
+    assert sorted(os.listdir(index_dir)) == sorted(
+        os.path.basename(f) + '.idx' for f in synthetic_archive)
+
+
+def test_extract_with_index_matches_full_scan(synthetic_archive, extract):
+    kwargs = {'startTime': '201805151200', 'endTime': '201902012359'}
+    expected = extract('full.txt', use_index=False, **kwargs).text
+
+    indexing.build_table_indexes('TD', block_lines=50, verbose=False)
+    assert extract('indexed.txt', **kwargs).text == expected
+    assert '2018-05-16 09:00' in expected
+
+
+def test_station_postings(synthetic_archive):
+    indexing.build_table_indexes('TD', block_lines=100, verbose=False)
+    index = indexing.load_index(synthetic_archive[0])
+
+    assert sorted(index['postings']) == ['1001', '214', '30', '926']
+    assert indexing.find_station_runs(index, ['99999'], 201701010000, 201712312359) == []
+
+    runs = indexing.find_station_runs(index, ['214'], 201703010000, 201703312359)
+    assert 0 < sum(nlines for (_, nlines, _) in runs) <= 400 < len(index['offsets']) * 100
+
+
+def test_extract_stations_with_index_matches_full_scan(synthetic_archive, extract):
+    kwargs = {'startTime': '201712200000', 'endTime': '201801102359', 'src_ids': ['214', '30']}
+    expected = extract('full.txt', use_index=False, **kwargs).text
+
+    indexing.build_table_indexes('TD', block_lines=7, verbose=False)
+    assert extract('indexed.txt', **kwargs).text == expected
+    assert ', 926, ' not in expected and ', 214, ' in expected
+
+
+def test_extract_integer_src_ids_with_index(synthetic_archive, extract):
+    from midas_extract.subsetter import iter_records
+
+    kwargs = {'startTime': '201801010000', 'endTime': '201812312359'}
+    expected = extract('strings.txt', src_ids=['214'], **kwargs).text
+
+    indexing.build_table_indexes('TD', block_lines=7, verbose=False)
+    assert extract('ints.txt', src_ids=[214], **kwargs).text == expected
+    assert len(list(iter_records('TD', '201801010000', '201812312359', src_ids=[214]))) == 365 * 2
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `midas_extract.metrics`."""
+
+__author__ = """Ag Stephens"""
+__contact__ = 'ag.stephens@stfc.ac.uk'
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__version__ = "0.1.0"
+
+import os
+import json
+import time
+
+import pytest
+from click.testing import CliRunner
+
+from midas_extract import cli
+from midas_extract import columnar
+from midas_extract import metrics
+from midas_extract.stations import StationIDGetter
+
+
+def test_stage_times_are_exclusive():
+    m = metrics.Metrics('test', stages=('outer', 'inner', 'unused'))
+
+    with m.stage('outer'):
+        time.sleep(0.02)
+        with m.stage('inner'):
+            time.sleep(0.05)
+
+    assert 0.02 <= m.timings['outer'] < 0.05
+    assert m.timings['inner'] >= 0.05
+    assert m.timings['unused'] == 0.0
+    assert m.total >= m.timings['outer'] + m.timings['inner']
+
+
+def test_emit():
+    m = metrics.Metrics('test', counters=('lines',))
+    m.add({'lines': 2}, lines=3)
+
+    received = []
+    metrics.emit(m, received.append)
+
+    assert received[0]['counts'] == {'lines': 5}
+    assert received[0]['kind'] == 'test'
+
+    with pytest.raises(Exception):
+        metrics.emit(m, 'xml')
+
+
+def _stats(extract, **kwargs):
+    "Returns the metrics of an extraction."
+    received = []
+    extract('out.txt', stats=received.append, **kwargs)
+    return received[0]
+
+
+@pytest.mark.parametrize('kwargs', [{'engine': 'text'}, {'engine': 'mmap'},
+                                    {'columns': 'src_id,max_air_temp'}, {'workers': 2}])
+def test_extraction_metrics(synthetic_archive, extract, kwargs):
+    stats = _stats(extract, startTime='201801010000', endTime='201812312359',
+                   src_ids=['214'], **kwargs)
+    counts = stats['counts']
+
+    assert set(stats['stages']) == {'discovery', 'listing', 'scan', 'temp_write',
+                                    'output_write'}
+    assert counts['lines_matched'] == 365 * 2
+    assert counts['files_read'] == 1
+    assert counts['files_pruned'] == 2
+
+    # The whole of the 2018 file is scanned
+    with open(synthetic_archive[1]) as reader:
+        assert counts['lines_scanned'] == len(reader.readlines())
+    assert counts['bytes_read'] == os.path.getsize(synthetic_archive[1])
+
+    if stats['peak_rss_bytes'] is not None:
+        assert stats['peak_rss_bytes'] > 0
+
+
+def test_station_metrics(station_metadata):
+    received = []
+    StationIDGetter([], [61, -6, 50, 1], None, None, data_type=['rain'], quiet=True,
+                    stats=received.append)
+
+    assert set(received[0]['stages']) == {'load', 'search', 'filter', 'output_write'}
+    assert received[0]['counts'] == {'stations_found': 4, 'stations_selected': 3}
+
+
+def test_cli_stats_json(synthetic_archive, tmp_path):
+    output = tmp_path / 'out.txt'
+    result = CliRunner().invoke(cli.main, ['extract', '-t', 'TD', '-s', '201901010000',
+                                           '-e', '201901312359', '--stats', 'json',
+                                           '-o', output.as_posix()])
+    assert result.exit_code == 0
+
+    stats = json.loads(result.stderr.strip().splitlines()[-1])
+    assert stats['kind'] == 'extract'
+    assert stats['counts']['lines_matched'] == 31 * 2 * 4
+
+
+def test_columnar_store_metrics(synthetic_archive, extract):
+    pytest.importorskip('pyarrow')
+    columnar.convert_table('TD', row_group_size=500, verbose=False)
+
+    stats = _stats(extract, startTime='201801010000', endTime='201801312359')
+
+    # Only the row groups that can hold January are read
+    assert stats['counts']['lines_matched'] == 31 * 2 * 4
+    assert 31 * 2 * 4 <= stats['counts']['lines_scanned'] <= 31 * 2 * 4 + 1000
+    assert stats['counts']['bytes_read'] > 0
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `midas_extract.paging`."""
+
+__author__ = """Ag Stephens"""
+__contact__ = 'ag.stephens@stfc.ac.uk'
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__version__ = "0.1.0"
+
+import gzip
+import os
+
+import pytest
+from click.testing import CliRunner
+
+from midas_extract import catalogue
+from midas_extract import cli
+from midas_extract import indexing
+
+
+START, END = '201712010000', '201902282359'
+
+
+def _pages(extract, limit, **kwargs):
+    "Returns the rows of each page of the extraction."
+    pages = []
+    cursor = None
+
+    while True:
+        page = extract(f'page_{len(pages)}.txt', 'TD', START, END, limit=limit, cursor=cursor,
+                       **kwargs)
+        lines = page.lines
+        # An empty last page holds the "no data" message
+        pages.append([] if lines[0].startswith('Your extraction') else lines[1:])
+        cursor = page.subsetter.next_cursor
+
+        if not cursor:
+            return pages
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'src_ids': ['214', '926']},
+                                    {'columns': 'src_id,max_air_temp',
+                                     'conditions': 'max_air_temp:greater_than=20'}])
+@pytest.mark.parametrize('use_index', [False, True])
+def test_pages_match_full_extraction(synthetic_archive, extract, kwargs, use_index):
+    if use_index:
+        indexing.build_table_indexes('TD', block_lines=50, verbose=False)
+
+    expected = extract('full.txt', 'TD', START, END, **kwargs).lines
+    pages = _pages(extract, 700, **kwargs)
+
+    assert all(len(page) == 700 for page in pages[:-1])
+    assert [expected[0]] + [row for page in pages for row in page] == expected
+
+
+def test_page_stops_early(synthetic_archive, extract):
+    received = []
+    page = extract('page.txt', 'TD', START, END, limit=10, stats=received.append)
+
+    assert len(page.lines) == 11
+    assert page.subsetter.next_cursor
+    # Only the first file is read, and only up to the tenth matching row
+    assert received[0]['counts']['bytes_read'] < os.path.getsize(synthetic_archive[0])
+
+
+def test_pages_of_compressed_files(synthetic_archive, extract):
+    expected = extract('full.txt', 'TD', START, END, src_ids=['30']).lines
+
+    for path in synthetic_archive:
+        with open(path, 'rb') as reader, gzip.open(path + '.gz', 'wb') as writer:
+            writer.write(reader.read())
+        os.unlink(path)
+
+    catalogue._catalogues.clear()
+    pages = _pages(extract, 333, src_ids=['30'])
+
+    assert [expected[0]] + [row for page in pages for row in page] == expected
+
+
+def test_cursor_is_checked(synthetic_archive, extract):
+    cursor = extract('page.txt', 'TD', START, END, limit=10).subsetter.next_cursor
+
+    with pytest.raises(Exception, match='does not belong'):
+        extract('other.txt', 'TD', START, END, limit=10, cursor=cursor, src_ids=['30'])
+
+    with pytest.raises(Exception, match='not understood'):
+        extract('bad.txt', 'TD', START, END, limit=10, cursor='not-a-cursor')
+
+    with open(synthetic_archive[0], 'a') as writer:
+        writer.write('\n')
+
+    catalogue._catalogues.clear()
+    with pytest.raises(Exception, match='out of date'):
+        extract('stale.txt', 'TD', START, END, limit=10, cursor=cursor)
+
+    with pytest.raises(Exception):
+        extract('zero.txt', 'TD', START, END, limit=0)
+
+
+def test_cli_max_rows(synthetic_archive, tmp_path, extract):
+    output = tmp_path / 'page.txt'
+    args = ['extract', '-t', 'TD', '-s', START, '-e', END, '--max-rows', '5',
+            '-o', output.as_posix()]
+
+    result = CliRunner().invoke(cli.main, args)
+    assert result.exit_code == 0
+    first = output.read_text().splitlines()
+
+    cursor = result.output.strip().splitlines()[-1]
+    result = CliRunner().invoke(cli.main, args + ['--cursor', cursor])
+    assert result.exit_code == 0
+    second = output.read_text().splitlines()
+
+    expected = extract('full.txt', 'TD', START, END).lines
+    assert first + second[1:] == expected[:11]
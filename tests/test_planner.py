@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `midas_extract.planner`."""
+
+__author__ = """Ag Stephens"""
+__contact__ = 'ag.stephens@stfc.ac.uk'
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__version__ = "0.1.0"
+
+import os
+
+from midas_extract import catalogue
+from midas_extract import indexing
+from midas_extract.conditions import ConditionSet
+from midas_extract.planner import plan_extraction
+from midas_extract.subsetter import MIDASSubsetter
+
+
+def _plan(start, end, **kwargs):
+    return plan_extraction('TD', catalogue.get_partitions('TD'), start, end, use_store=False,
+                           **kwargs)
+
+
+def test_plan_prunes_files_by_name(synthetic_archive):
+    plan = _plan(201805010000, 201806302359)
+
+    assert plan.fileList == [synthetic_archive[1]]
+    assert [reason for (_, reason) in plan.pruned] == ['file name outside time range'] * 2
+    assert plan.steps[0].engine == 'mmap' and plan.workers == 1
+
+    # A scan from the start of the file reads about half of it
+    size = os.path.getsize(synthetic_archive[1])
+    assert 0.4 * size < plan.bytes < 0.6 * size
+
+
+def test_plan_uses_index(synthetic_archive):
+    indexing.build_table_indexes('TD', block_lines=50, verbose=False)
+    plan = _plan(201805010000, 201806302359, src_ids=['214'], srcidIndex=6)
+
+    assert plan.steps[0].access.startswith('station posting lists')
+    assert plan.bytes < os.path.getsize(synthetic_archive[1]) / 4
+
+    plan = _plan(201805010000, 201806302359, src_ids=['99'], srcidIndex=6)
+    assert plan.fileList == []
+    assert 'stations' in dict(plan.pruned)[synthetic_archive[1]]
+
+
+def test_plan_orders_conditions(synthetic_archive):
+    names = ['ob_end_time', 'id_type', 'id', 'ob_hour_count', 'version_num', 'met_domain_name',
+             'src_id', 'rec_st_ind', 'max_air_temp', 'min_air_temp', 'min_grss_temp',
+             'min_conc_temp']
+    conditions = ConditionSet('id_type:pattern=^D,max_air_temp:greater_than=3,'
+                              'min_air_temp:range=0:5,src_id:exact=30', names)
+
+    plan = _plan(201701010000, 201912312359, conditions=conditions,
+                 subset=True, workers=8)
+
+    assert plan.predicates()[1:] == ['src_id exact=30', 'min_air_temp range=0:5',
+                                     'max_air_temp greater_than=3', 'id_type pattern=^D']
+    assert plan.workers == 3
+    assert {step.engine for step in plan.steps} == {'subset'}
+
+
+def test_explain_does_not_extract(synthetic_archive, tmp_path, capsys):
+    output = tmp_path / 'out.txt'
+    subsetter = MIDASSubsetter('TD', output.as_posix(), '201801010000', '201801312359',
+                               tmp_dir=tmp_path.as_posix(), verbose=False, explain=True)
+
+    assert not output.exists()
+    assert subsetter.plan.fileList == [synthetic_archive[1]]
+    assert 'Estimated read: 1 file(s)' in capsys.readouterr().out
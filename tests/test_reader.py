@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `midas_extract.reader`."""
+
+__author__ = """Ag Stephens"""
+__contact__ = 'ag.stephens@stfc.ac.uk'
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__version__ = "0.1.0"
+
+import numpy as np
+import pytest
+
+from midas_extract import reader
+from midas_extract.subsetter import iter_records
+
+
+START, END = '201712250000', '201801102359'
+
+
+def test_column_types():
+    assert reader.get_column_type('ob_end_time') == 'datetime'
+    assert reader.get_column_type('ob_date') == 'datetime'
+    assert reader.get_column_type('src_id') == 'int'
+    assert reader.get_column_type('prcp_amt_q') == 'int'
+    assert reader.get_column_type('prcp_amt_j') == 'str'
+    assert reader.get_column_type('id_type') == 'str'
+    assert reader.get_column_type('max_air_temp') == 'float'
+
+
+def test_read_dataframe(synthetic_archive):
+    pytest.importorskip('pandas')
+    df = reader.read_table('TD', START, END, src_ids=['214', '926'])
+    records = list(iter_records('TD', START, END, src_ids=['214', '926']))
+
+    assert len(df) == len(records) == 17 * 2 * 2
+    assert df['ob_end_time'].dtype == np.dtype('datetime64[s]')
+    assert df['src_id'].dtype == 'Int64'
+    assert df['max_air_temp'].dtype == np.float64
+    assert df['min_grss_temp'].isna().sum() == sum(1 for record in records if not record[10])
+
+    assert str(df['ob_end_time'].iloc[0]) == records[0][0] + ':00'
+    assert list(df['src_id'].unique()) == [214, 926]
+    assert df['max_air_temp'].tolist() == [float(record[8]) for record in records]
+
+
+def test_read_chunks(synthetic_archive):
+    pytest.importorskip('pandas')
+    chunks = list(reader.read_table('TD', START, END, columns='src_id,max_air_temp',
+                                    chunksize=50))
+    whole = reader.read_table('TD', START, END, columns='src_id,max_air_temp')
+
+    assert [len(chunk) for chunk in chunks] == [50] * 2 + [36]
+    assert list(chunks[0].columns) == ['src_id', 'max_air_temp']
+    assert sum(chunk['max_air_temp'].sum() for chunk in chunks) == \
+        pytest.approx(whole['max_air_temp'].sum())
+
+
+def test_read_numpy(synthetic_archive):
+    array = reader.read_table('TD', START, END, src_ids=['30'], output='numpy',
+                              dtypes={'min_conc_temp': 'str'})
+
+    assert array.dtype['ob_end_time'] == np.dtype('datetime64[s]')
+    assert array.dtype['src_id'] == np.int64
+    assert array.dtype['min_conc_temp'] == object
+    assert len(array) == 17 * 2
+    assert (array['src_id'] == 30).all()
+    assert array['ob_end_time'][0] == np.datetime64('2017-12-25T09:00')
+
+    empty = reader.read_table('TD', START, END, src_ids=['99999'], output='numpy')
+    assert len(empty) == 0
+    assert empty.dtype.names == array.dtype.names
+
+
+def test_missing_ints_and_bad_values(synthetic_archive):
+    array = reader.read_table('RD', START, END, src_ids=['30'], output='numpy',
+                              dtypes={'prcp_amt_j': 'int'})
+    assert len(array) > 0 and (array['prcp_amt_j'] == reader.MISSING_INT).all()
+
+    with pytest.raises(Exception, match="'id_type' as float"):
+        reader.read_table('TD', START, END, output='numpy', dtypes={'id_type': 'float'})
+
+    with pytest.raises(Exception):
+        reader.read_table('TD', START, END, output='numpy', dtypes={'id_type': 'complex'})
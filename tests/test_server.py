@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `midas_extract.server` and `midas_extract.client`."""
+
+__author__ = """Ag Stephens"""
+__contact__ = 'ag.stephens@stfc.ac.uk'
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__version__ = "0.1.0"
+
+import io
+import threading
+
+import pytest
+
+from midas_extract import cli
+from midas_extract import client
+from midas_extract import server
+from midas_extract.server import ExtractionServer
+
+
+@pytest.fixture
+def running_server(synthetic_archive, station_metadata):
+    server = ExtractionServer(jobs=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_client_extract_matches_local(running_server, tmp_path, monkeypatch, capsys):
+    kwargs = {'table': 'TD', 'start': '201802010000', 'end': '201802102359',
+              'src_ids': '214,926', 'tmp_dir': tmp_path.as_posix()}
+
+    assert client.is_available()
+    cli.extract_records(output_filepath=(tmp_path / 'served.txt').as_posix(), **kwargs)
+    # Only the client reports the output file
+    assert 'records written' not in capsys.readouterr().out
+
+    monkeypatch.setenv('MIDAS_SERVER_SOCKET', (tmp_path / 'missing.sock').as_posix())
+    assert not client.is_available()
+    cli.extract_records(output_filepath=(tmp_path / 'local.txt').as_posix(), **kwargs)
+
+    served = (tmp_path / 'served.txt').read_text()
+    assert served == (tmp_path / 'local.txt').read_text()
+    assert served.count('\n') == 1 + 10 * 2 * 2
+
+
+def test_client_streams_output(running_server):
+    output = io.BytesIO()
+    client.extract({'table': 'TD', 'start': '201801010000', 'end': '201801012359',
+                    'columns': 'src_id,max_air_temp'}, output=output)
+
+    lines = output.getvalue().decode().splitlines()
+    assert lines[0] == 'src_id, max_air_temp'
+    assert len(lines) == 1 + 2 * 4
+
+
+def test_rows_are_streamed_from_the_scan(running_server, extract, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, '_CHUNK_BYTES', 100)
+    tmp_dir = tmp_path / 'tmp'
+    tmp_dir.mkdir()
+    args = {'table': 'TD', 'start': '201801010000', 'end': '201801312359', 'src_ids': ['214'],
+            'delimiter': 'tab', 'tmp_dir': tmp_dir.as_posix()}
+
+    output = io.BytesIO()
+    client.extract(args, output=output)
+    expected = extract('local.txt', 'TD', args['start'], args['end'], src_ids=['214'],
+                       delimiter='tab').text
+
+    assert output.getvalue().decode() == expected
+    assert list(tmp_dir.iterdir()) == []
+
+    # A page is sent with its continuation token in the header
+    output = io.BytesIO()
+    header = client.extract(dict(args, limit=5), output=output)
+    assert output.getvalue().decode().splitlines() == expected.splitlines()[:6]
+    assert header['cursor']
+
+
+def test_empty_and_explained_extractions(running_server, extract, capsys):
+    args = {'table': 'TD', 'start': '201801010000', 'end': '201801312359', 'src_ids': ['5']}
+
+    # No rows: only the header line, as when extracting to the display locally
+    output = io.BytesIO()
+    client.extract(args, output=output)
+    assert output.getvalue().decode() == extract('local.txt', 'TD', args['start'],
+                                                 args['end']).lines[0] + '\n'
+
+    # The plan is returned to the client, not printed by the server
+    capsys.readouterr()
+    output = io.BytesIO()
+    client.extract(dict(args, explain=True), output=output)
+    assert 'Estimated read' in output.getvalue().decode()
+    assert capsys.readouterr().out == ''
+
+
+def test_client_stations_and_errors(running_server):
+    assert client.stations([{'county': 'KENT'}, {'bbox': '52,-6,50,-4'}]) == [['926'], ['214']]
+
+    with pytest.raises(Exception, match='Tablename not known'):
+        client.extract({'table': 'XX'}, output=io.BytesIO())
+
+
+def test_server_is_not_used_with_other_settings(running_server, monkeypatch, tmp_path):
+    other = dict(server.get_environment(), MIDAS_INDEX_DIR=tmp_path.as_posix())
+    monkeypatch.setitem(server.JOBS, 'ping',
+                        lambda args: ({'version': server.PROTOCOL_VERSION, 'environment': other}, b''))
+    assert not client.is_available()
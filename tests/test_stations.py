@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `midas_extract.stations` and `midas_extract.stationdb`."""
+
+__author__ = """Ag Stephens"""
+__contact__ = 'ag.stephens@stfc.ac.uk'
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__version__ = "0.1.0"
+
+import sqlite3
+
+import pytest
+from click.testing import CliRunner
+
+from midas_extract import cli
+from midas_extract import stationdb
+from midas_extract.stations import StationIDGetter
+
+
+def _stations(counties=None, bbox=None, **kwargs):
+    getter = StationIDGetter(counties or [], bbox, kwargs.pop('start_time', None),
+                             kwargs.pop('end_time', None), quiet=True, **kwargs)
+    return getter.get_station_list()
+
+
+def test_stations_by_bbox(station_metadata):
+    assert _stations(bbox=['52', '-6', '50', '1']) == ['214', '30', '926']
+    assert _stations(bbox=['50', '-6', '52', '-4']) == ['214']
+    assert (station_metadata / 'stations.sqlite').is_file()
+
+
+def test_stations_by_bbox_across_meridian(station_metadata):
+    assert _stations(bbox=['61', '-2', '50', '359']) == ['214', '30', '926', '1001']
+    assert _stations(bbox=['52', '0.2', '51', '0.4']) == ['926']
+    assert _stations(bbox=['52', '-359.9', '51', '-359.5']) == ['926']
+
+
+def test_stations_by_county(station_metadata):
+    assert _stations(counties=['DEVON', 'CORNWALL']) == ['214', '30', '77']
+    assert _stations(counties=['KENT', 'SHETLAND']) == ['926']
+
+
+def test_stations_filtered_by_capabilities(station_metadata):
+    bbox = ['52', '-6', '50', '1']
+    assert _stations(bbox=bbox, data_type=['rain']) == ['30', '926']
+    assert _stations(bbox=bbox, data_type=['rain'], start_time=201101010000) == ['926']
+    assert _stations(bbox=bbox, end_time='1970-01-01T00:00') == ['214']
+
+    # Capabilities without an end date are open-ended
+    assert _stations(bbox=['61', '-2', '59', '0'], data_type=['RAIN'],
+                     start_time=204001010000) == ['1001']
+
+
+def test_station_db_rebuilt_when_metadata_changes(station_metadata):
+    assert _stations(counties=['KENT']) == ['926']
+
+    with open(station_metadata / 'SRCE' / 'SRCE.DATA.COMMAS_REMOVED', 'a') as writer:
+        writer.write('555, STATION 555, 51.1, 1.1, 13\n')
+
+    assert _stations(counties=['KENT']) == ['926', '555']
+
+
+def test_station_db_in_memory_if_not_writable(station_metadata, monkeypatch):
+    monkeypatch.setenv('MIDAS_STATIONS_DB', (station_metadata / 'missing' / 'db.sqlite').as_posix())
+    assert _stations(counties=['CORNWALL']) == ['214']
+    assert stationdb._memory_dbs
+
+
+@pytest.mark.parametrize('in_memory', [False, True])
+def test_station_db_connections_are_closed(station_metadata, monkeypatch, in_memory):
+    if in_memory:
+        monkeypatch.setenv('MIDAS_STATIONS_DB',
+                           (station_metadata / 'missing' / 'db.sqlite').as_posix())
+
+    opened = []
+    connect = stationdb.connect
+    monkeypatch.setattr(stationdb, 'connect', lambda: opened.append(connect()) or opened[-1])
+
+    assert _stations(counties=['KENT'], data_type=['rain']) == ['926']
+    assert StationIDGetter.query_many([{'county': 'kent'}, {'county': 'cornwall'}]) == \
+        [['926'], ['214']]
+    assert _stations(counties=['CORNWALL']) == ['214']
+
+    assert len(opened) == 3
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute('SELECT 1')
+
+
+def test_query_many(station_metadata):
+    queries = [{'bbox': '52,-6,50,1'},
+               {'county': ['devon', 'cornwall'], 'data_type': 'rain', 'end': '2000-01-01T00:00'},
+               {'bbox': [61, -2, 59, 0], 'start': '204001010000'}]
+
+    assert StationIDGetter.query_many(queries) == [['214', '30', '926'], ['30'], ['1001']]
+
+    with pytest.raises(Exception):
+        StationIDGetter.query_many([{'data_type': 'rain'}])
+
+
+def test_cli_stations_batch(station_metadata, tmp_path):
+    batch = tmp_path / 'queries.jsonl'
+    batch.write_text('{"county": "KENT"}\n{"bbox": "52,-6,50,-4"}\n')
+
+    result = CliRunner().invoke(cli.main, ['stations', '--batch', batch.as_posix()])
+    assert result.exit_code == 0
+    assert result.output == '["926"]\n["214"]\n'
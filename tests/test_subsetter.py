@@ -8,7 +8,11 @@ __copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
 __license__ = "BSD - see LICENSE file in top-level package directory"
 __version__ = "0.1.0"
 
-from midas_extract.subsetter import pad_time
+import pytest
+
+from midas_extract import subsetter
+from midas_extract.subsetter import MIDASSubsetter, iter_records
+from midas_extract.subsetter import pad_time, makeSrcIdFilter, srcIdOf
 
 
 def test_pad_time():
@@ -23,4 +27,111 @@ def test_pad_time():
 
     for ts, (start, end) in args:
         assert(pad_time(ts, "start") == start)
-        assert(pad_time(ts, "end") == end)
\ No newline at end of file
+        assert(pad_time(ts, "end") == end)
+
+
+def test_src_id_filter():
+    line = '2017-01-01 09:00, DCNN, 642, 12, 1, DLY3208, 214, 1001, 3.5, 1.2'
+    assert srcIdOf(line, 6) == '214'
+    assert srcIdOf('a, b', 6) is None
+
+    assert makeSrcIdFilter(['214', '926'], 6)(line)
+    assert not makeSrcIdFilter(['21', '2140', '926'], 6)(line)
+    assert not makeSrcIdFilter(['214'], 6)('a, b, c')
+
+    many = [str(i) for i in range(50000)]
+    assert makeSrcIdFilter(many, 6)(line)
+    assert not makeSrcIdFilter(many[:214] + many[215:], 6)(line)
+
+
+def test_parallel_extract_matches_serial(synthetic_archive, tmp_path):
+    outputs = []
+    for workers in (1, 3):
+        output = (tmp_path / f'out_{workers}.txt').as_posix()
+        MIDASSubsetter('TD', output, '201706010000', '201906302359', src_ids=['30', '926'],
+                       tmp_dir=tmp_path.as_posix(), verbose=False, workers=workers)
+
+        with open(output, 'rb') as reader:
+            outputs.append(reader.read())
+
+    assert outputs[0] == outputs[1]
+    assert outputs[0].count(b'\n') == 1 + 2 * 2 * (365 + 214 + 181)
+    assert [p.name for p in tmp_path.iterdir() if p.name.startswith('temp_')] == []
+
+
+@pytest.mark.parametrize('kwargs', [
+    {},
+    {'src_ids': ['214']},
+    {'src_ids': ['1001', '30'], 'workers': 2},
+])
+def test_mmap_engine_matches_text_engine(synthetic_archive, tmp_path, kwargs):
+    outputs = []
+    for engine in ('text', 'mmap'):
+        output = (tmp_path / f'out_{engine}.txt').as_posix()
+        MIDASSubsetter('TD', output, '201712150000', '201801152100', tmp_dir=tmp_path.as_posix(),
+                       verbose=False, engine=engine, **kwargs)
+
+        with open(output, 'rb') as reader:
+            outputs.append(reader.read())
+
+    assert outputs[0] == outputs[1]
+    assert outputs[0].count(b'\n') > 1
+
+
+@pytest.mark.parametrize('delimiter', ['default', 'tab', '|'])
+def test_output_is_streamed_in_chunks(synthetic_archive, tmp_path, monkeypatch, capsys, delimiter):
+    # A file's worth of rows, written a few lines at a time
+    monkeypatch.setattr(subsetter, '_OUTPUT_CHUNK_BYTES', 200)
+    output = tmp_path / 'out.txt'
+    subsetter.MIDASSubsetter('TD', output.as_posix(), '201801010000', '201812312359',
+                             delimiter=delimiter, tmp_dir=tmp_path.as_posix(), verbose=False)
+
+    sep = {'default': ', ', 'tab': '\t'}.get(delimiter, delimiter)
+    with open(synthetic_archive[1]) as reader:
+        expected = sep.join(subsetter.MIDASSubsetter('TD', 'x', explain=True,
+                                                     verbose=False).rowHeaders) + '\n' + \
+            ''.join(line.replace(', ', sep) for line in reader)
+
+    assert output.read_text() == expected
+
+    capsys.readouterr()
+    subsetter.MIDASSubsetter('TD', 'display', '201801010000', '201812312359', delimiter=delimiter,
+                             tmp_dir=tmp_path.as_posix(), verbose=False)
+    assert capsys.readouterr().out.endswith('Output data follows:\n\n' + expected + '\n\n')
+
+
+def test_no_data_message(synthetic_archive, tmp_path):
+    output = tmp_path / 'out.txt'
+    subsetter.MIDASSubsetter('TD', output.as_posix(), '201801010000', '201812312359',
+                             src_ids=['99999'], tmp_dir=tmp_path.as_posix(), verbose=False)
+    assert output.read_text() == subsetter.NO_DATA_MESSAGE
+
+
+@pytest.mark.parametrize('kwargs', [
+    {},
+    {'src_ids': ['214', '30']},
+    {'columns': 'src_id,ob_end_time,max_air_temp', 'conditions': 'max_air_temp:greater_than=20'},
+])
+def test_iter_records_matches_output_file(synthetic_archive, tmp_path, kwargs):
+    output = tmp_path / 'out.txt'
+    MIDASSubsetter('TD', output.as_posix(), '201711010000', '201902282359',
+                   tmp_dir=tmp_path.as_posix(), verbose=False, **kwargs)
+    expected = [[value.strip() for value in line.split(',')]
+                for line in output.read_text().splitlines()[1:]]
+
+    records = iter_records('TD', '201711010000', '201902282359', **kwargs)
+    assert list(records) == expected
+
+    first = next(iter_records('TD', '201711010000', '201902282359', as_dict=True, **kwargs))
+    assert list(first.values()) == expected[0]
+
+
+def test_iter_lines_stops_early(synthetic_archive):
+    subsetter = MIDASSubsetter('TD', None, '201701010000', '201912312359', verbose=False,
+                               run=False)
+    lines = subsetter.iterLines()
+    first = [next(lines) for i in range(5)]
+    lines.close()
+
+    assert len(first) == 5
+    assert subsetter.metrics.counts['lines_scanned'] == 5
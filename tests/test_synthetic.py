@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `midas_extract.synthetic`."""
+
+__author__ = """Ag Stephens"""
+__contact__ = 'ag.stephens@stfc.ac.uk'
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__version__ = "0.1.0"
+
+import os
+
+import pytest
+
+from midas_extract import bbox_utils
+from midas_extract import synthetic
+from midas_extract.stations import StationIDGetter
+from midas_extract.subsetter import MIDASSubsetter
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    archive = synthetic.generate_archive(tmp_path.as_posix(), stations=12, years=2, obs_per_day=2)
+
+    monkeypatch.setenv('MIDAS_DATA_DIR', archive['data_dir'])
+    monkeypatch.setenv('MIDAS_METADATA_DIR', archive['metadata_dir'])
+    monkeypatch.delenv('MIDAS_STATIONS_DB', raising=False)
+    monkeypatch.delenv('MIDAS_CACHE_DIR', raising=False)
+    monkeypatch.setenv('MIDAS_SERVER_SOCKET', (tmp_path / 'server.sock').as_posix())
+    return archive
+
+
+def _count(path):
+    with open(path) as reader:
+        return sum(1 for line in reader if line.strip()) - 1
+
+
+def test_archive_layout(archive):
+    names = sorted(os.path.basename(path) for path in archive['files'])
+
+    assert names == ['midas_raindrnl_201701-201712.txt', 'midas_raindrnl_201801-201812.txt',
+                     'midas_tmpdrnl_201701-201712.txt', 'midas_tmpdrnl_201801-201812.txt']
+    assert archive['rows'] == 2 * 12 * 2 * 365 * 2
+    assert archive['bytes'] == sum(os.path.getsize(path) for path in archive['files'])
+
+
+def test_archive_is_reproducible(archive, tmp_path):
+    again = synthetic.generate_archive((tmp_path / 'again').as_posix(), stations=12, years=2,
+                                       obs_per_day=2)
+
+    for (first, second) in zip(archive['files'], again['files']):
+        with open(first) as a, open(second) as b:
+            assert a.read() == b.read()
+
+
+def test_read_stations(archive):
+    assert synthetic.read_stations(archive['metadata_dir']) == archive['stations']
+
+
+def test_subsetter_reads_archive(archive, tmp_path):
+    output = (tmp_path / 'out.txt').as_posix()
+    src_id = archive['stations'][3][0]
+
+    MIDASSubsetter('TD', output, startTime='201802010000', endTime='201802282359',
+                   src_ids=[str(src_id)], verbose=False, tmp_dir=tmp_path.as_posix())
+    assert _count(output) == 28 * 2
+
+    MIDASSubsetter('RD', output, startTime='201701010000', endTime='201712312359',
+                   verbose=False, tmp_dir=tmp_path.as_posix())
+    assert _count(output) == 365 * 2 * 12
+
+
+def test_stations_found_by_county_and_bbox(archive):
+    (src_id, lat, lon, area) = archive['stations'][0]
+    county = synthetic.COUNTIES[area - 100]
+
+    by_county = StationIDGetter([county], None, None, None, quiet=True).get_station_list()
+    assert str(src_id) in by_county
+    assert len(by_county) == sum(1 for station in archive['stations'] if station[3] == area)
+
+    bbox = [lat + 0.01, lon - 0.01, lat - 0.01, lon + 0.01]
+    by_bbox = StationIDGetter([], bbox, None, None, quiet=True).get_station_list()
+    assert str(src_id) in by_bbox
+
+    lats = [station[1] for station in archive['stations']]
+    lons = [station[2] for station in archive['stations']]
+    assert bbox_utils.is_in_bbox_array(lats, lons, *synthetic.UK_BBOX).all()